@@ -1,12 +1,131 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
 from .models import User
+from .utils import make_upper_camel_case_names
+
+# Query string parameter holding the last primary key of the previous changelist page
+CURSOR_VAR = 'after'
+COUNTRIES_CACHE_KEY = 'accounts:admin:countries'
+
+
+def estimated_count(model):
+    """Rows of the table according to the PostgreSQL planner statistics, None when unknown or on other databases"""
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        row = cursor.fetchone()
+    # reltuples is -1 until the table is first analyzed
+    return row[0] if row and row[0] >= 0 else None
+
+
+class KeysetChangeList(ChangeList):
+    """Changelist paginated by primary key ranges, every page is an index range scan however deep it is. The
+    result count is the planner estimate for the whole table and a count of at most ADMIN_USERS_COUNT_LIMIT rows
+    for searches and filters, instead of COUNT(*) over the table."""
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        try:
+            self.cursor = int(self.params.get(CURSOR_VAR, 0))
+        except ValueError:
+            self.cursor = 0
+        queryset = self.queryset.order_by('pk')
+        if self.cursor:
+            queryset = queryset.filter(pk__gt=self.cursor)
+        rows = list(queryset[:self.list_per_page + 1])
+        self.result_list = rows[:self.list_per_page]
+        self.next_url = (self.get_query_string({CURSOR_VAR: self.result_list[-1].pk})
+                         if len(rows) > self.list_per_page else None)
+        self.first_url = self.get_query_string(remove=[CURSOR_VAR]) if self.cursor else None
+
+        filtered = self.queryset.query.where or self.query
+        count = None if filtered else estimated_count(self.model)
+        self.result_count_is_estimate = count is not None
+        self.result_count_is_limited = False
+        if count is None:
+            # One row over the limit tells a count of exactly the limit from a larger one
+            count = self.queryset.order_by()[:settings.ADMIN_USERS_COUNT_LIMIT + 1].count()
+            self.result_count_is_limited = count > settings.ADMIN_USERS_COUNT_LIMIT
+            count = min(count, settings.ADMIN_USERS_COUNT_LIMIT)
+        self.result_count = count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = bool(self.next_url or self.first_url)
+        self.paginator = None
+
+
+class LastNameInitialFilter(admin.SimpleListFilter):
+    """Prefix filter on the last name, the options are fixed and need no query"""
+    title = 'inicial de los apellidos'
+    parameter_name = 'last_name_initial'
+
+    def lookups(self, request, model_admin):
+        return [(letter, letter) for letter in 'ABCDEFGHIJKLMNÑOPQRSTUVWXYZ']
+
+    def queryset(self, request, queryset):
+        if self.value():
+            # Names are saved in Upper Camel Case, a case sensitive prefix can use an index
+            return queryset.filter(last_name__startswith=self.value()[:1].upper())
+        return queryset
+
+
+class CountryFilter(admin.SimpleListFilter):
+    """Country filter whose options are read once every ADMIN_FILTER_CACHE_TIMEOUT seconds"""
+    title = 'pais'
+    parameter_name = 'country'
+
+    def lookups(self, request, model_admin):
+        countries = cache.get(COUNTRIES_CACHE_KEY)
+        if countries is None:
+            countries = list(User.objects.order_by('country').values_list('country', flat=True).distinct())
+            cache.set(COUNTRIES_CACHE_KEY, countries, settings.ADMIN_FILTER_CACHE_TIMEOUT)
+        return [(country, country) for country in countries]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(country=self.value())
+        return queryset
 
 
 # Register your models here.
 
 class UserAdmin(admin.ModelAdmin):
     list_display = ['first_name', 'last_name', 'email', 'country', 'city', 'address', 'mobile_phone', 'is_active', ]
-    list_filter = ['first_name', 'last_name', 'email', 'country', ]
+    # Filters with one option per distinct value of a unique or almost unique column would scan the table
+    list_filter = ['is_active', 'is_staff', LastNameInitialFilter, CountryFilter, ]
+    search_fields = ['email', ]
+    search_help_text = 'Email completo, inicio del teléfono movil, del nombre o de los apellidos'
+    ordering = ['id', ]
+    # Keyset pages follow the primary key, the columns can not be sorted
+    sortable_by = []
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        # Every kind of term is an equality or prefix match that an index can serve, never a LIKE '%term%' scan
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if '@' in search_term:
+            # Emails are stored lowercase, a whole address is an exact match on the unique index
+            return queryset.filter(email=search_term), False
+        if search_term[0] == '+' or search_term[0].isdigit():
+            return queryset.filter(mobile_phone__startswith=search_term), False
+        name = make_upper_camel_case_names(search_term)
+        return queryset.filter(Q(last_name__startswith=name) | Q(first_name__startswith=name)), False
 
 
 admin.site.register(User, UserAdmin)
@@ -0,0 +1,118 @@
+# Module to keep the HistoricalUser table at a fixed size, old rows are archived to files and deleted
+import gzip
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import User
+from .utils import ChangesJSONEncoder
+
+PARTITION_NAME_FORMAT = '{table}_p{year:04d}_{month:02d}'
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(moment):
+    return (moment.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def history_table():
+    return User.history.model._meta.db_table
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [history_table()])
+        return cursor.fetchone() is not None
+
+
+def monthly_partitions():
+    """(name, start of the month) of the monthly partitions of the history table"""
+    table = history_table()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT child.relname FROM pg_inherits "
+                       "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                       "WHERE pg_inherits.inhparent = %s::regclass", [table])
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        suffix = name[len(table) + 2:]
+        if name.startswith(f'{table}_p') and len(suffix) == 7 and suffix[4] == '_':
+            start = month_start(timezone.now()).replace(year=int(suffix[:4]), month=int(suffix[5:]))
+            partitions.append((name, start))
+    return partitions
+
+
+def create_monthly_partitions(start, months):
+    """Create the monthly partitions of the history table from start, existing ones are left as they are"""
+    table = history_table()
+    start = month_start(start)
+    with connection.cursor() as cursor:
+        for _ in range(months):
+            end = next_month(start)
+            name = PARTITION_NAME_FORMAT.format(table=table, year=start.year, month=start.month)
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" '
+                           f'FOR VALUES FROM (%s) TO (%s)', [start, end])
+            start = end
+
+
+def drop_partitions(names):
+    with connection.cursor() as cursor:
+        for name in names:
+            cursor.execute(f'DROP TABLE "{name}"')
+
+
+def write_chunk(archive_dir, rows):
+    """Write rows as gzipped NDJSON, the file only appears under its final name once it is complete"""
+    path = Path(archive_dir) / f"{history_table()}-{rows[0]['history_id']}-{rows[-1]['history_id']}.ndjson.gz"
+    temporary_path = path.with_suffix('.tmp')
+    with gzip.open(temporary_path, 'wt', encoding='utf-8') as archive:
+        for row in rows:
+            archive.write(json.dumps(row, cls=ChangesJSONEncoder, ensure_ascii=False) + '\n')
+    os.replace(temporary_path, path)
+    return path
+
+
+def archive_user_history(older_than_days=None, archive_dir=None, chunk_size=None, delete_batch_size=None):
+    """Archive and delete the historical records older than older_than_days, returns the written files.
+    Scheduler hook, run it periodically (cron, celery beat, ...) or through the archive_user_history command.
+    On a partitioned table the monthly partitions past the cutoff are dropped instead of deleted row by row, the old
+    rows of the default partition are deleted like on a plain table."""
+    older_than_days = settings.HISTORY_RETENTION_DAYS if older_than_days is None else older_than_days
+    archive_dir = archive_dir or settings.HISTORY_ARCHIVE_DIR
+    chunk_size = chunk_size or settings.HISTORY_ARCHIVE_CHUNK_SIZE
+    delete_batch_size = delete_batch_size or settings.HISTORY_DELETE_BATCH_SIZE
+    Path(archive_dir).mkdir(parents=True, exist_ok=True)
+    model = User.history.model
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    partitioned = is_partitioned()
+    # Rows of these months live in monthly partitions that are dropped as a whole at the end
+    dropped = {}
+    if partitioned:
+        dropped = {start: name for name, start in monthly_partitions() if next_month(start) <= month_start(cutoff)}
+
+    files = []
+    last_history_id = 0
+    while True:
+        rows = list(model.objects.filter(history_date__lt=cutoff, history_id__gt=last_history_id)
+                    .order_by('history_id').values()[:chunk_size])
+        if not rows:
+            break
+        files.append(write_chunk(archive_dir, rows))
+        history_ids = [row['history_id'] for row in rows if month_start(row['history_date']) not in dropped]
+        for start in range(0, len(history_ids), delete_batch_size):
+            with transaction.atomic():
+                model.objects.filter(history_id__in=history_ids[start:start + delete_batch_size]).delete()
+        last_history_id = rows[-1]['history_id']
+
+    if partitioned:
+        drop_partitions(dropped.values())
+        create_monthly_partitions(timezone.now(), settings.HISTORY_PARTITION_MONTHS_AHEAD)
+    return files
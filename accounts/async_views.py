@@ -0,0 +1,156 @@
+import asyncio
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.contrib.auth.signals import user_login_failed
+from django.http import Http404
+from rest_framework import exceptions, status
+from rest_framework.response import Response
+from api.serializers import USER_FIELD_PLAN, represent_rows, represent_instance
+from .hashing import get_hashing_executor
+from .models import User
+from .throttling import record_failed_login, record_successful_login
+from .views import ListCreateUser, RetrieveUpdateDestroyUser, MyTokenObtainPairView
+
+
+class AsyncAPIViewMixin:
+    """Run a DRF view as a native async Django view. Authentication uses aauthenticate() when the authenticator
+    has it, permissions only read the request user, throttles and the remaining blocking calls run through
+    sync_to_async. The handlers of the view must be coroutines."""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # csrf_exempt() of APIView.as_view() wraps the view in a plain function, mark it again
+        return markcoroutinefunction(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def ainitial(self, request, *args, **kwargs):
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        request.accepted_renderer, request.accepted_media_type = self.perform_content_negotiation(request)
+        request.version, request.versioning_scheme = self.determine_version(request, *args, **kwargs)
+        await self.aperform_authentication(request)
+        self.check_permissions(request)
+        if self.throttle_classes:
+            await sync_to_async(self.check_throttles)(request)
+
+    async def aperform_authentication(self, request):
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+
+
+class AsyncListCreateUser(AsyncAPIViewMixin, ListCreateUser):
+    """ListCreateUser with the async ORM, the password is hashed without blocking the event loop"""
+
+    async def get(self, request, *args, **kwargs):
+        page = await self.paginator.apaginate_queryset(self.get_list_rows(), request, view=self)
+        return self.get_paginated_response(represent_rows(page, self.get_field_plan()))
+
+    async def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        # The unique validators query the database
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        user = await serializer.acreate(serializer.validated_data)
+        return Response(represent_instance(user, USER_FIELD_PLAN), status=status.HTTP_201_CREATED)
+
+
+class AsyncRetrieveUpdateDestroyUser(AsyncAPIViewMixin, RetrieveUpdateDestroyUser):
+    """RetrieveUpdateDestroyUser with the async ORM"""
+
+    async def aget_object(self):
+        if self.is_self_service():
+            self.check_object_permissions(self.request, self.request.user)
+            return self.request.user
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            instance = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except User.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+    async def get(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(represent_instance(instance, self.get_field_plan()))
+
+    async def put(self, request, *args, **kwargs):
+        return await self.aupdate(request, partial=False)
+
+    async def patch(self, request, *args, **kwargs):
+        return await self.aupdate(request, partial=True)
+
+    async def aupdate(self, request, partial):
+        instance = await self.aget_object()
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        instance = await serializer.aupdate(instance, serializer.validated_data)
+        return Response(represent_instance(instance, USER_FIELD_PLAN))
+
+    async def delete(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        instance.is_active = False
+        await instance.asave()
+        return Response({'Response': 'Se eliminó al usuario de forma correcta'}, status=status.HTTP_204_NO_CONTENT)
+
+
+class AsyncTokenObtainPairView(AsyncAPIViewMixin, MyTokenObtainPairView):
+    """MyTokenObtainPairView checking the credentials with the async ORM and the hashing executor, the event loop
+    keeps serving other requests while the password hash runs"""
+
+    async def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        # Field validation only, validate() would authenticate with blocking calls
+        credentials = serializer.to_internal_value(request.data)
+        user = await self.aauthenticate_user(request, credentials[User.USERNAME_FIELD], credentials['password'])
+        if user is None:
+            await sync_to_async(record_failed_login)(request)
+            raise exceptions.AuthenticationFailed(serializer.error_messages['no_active_account'],
+                                                  'no_active_account')
+        # The refresh token is recorded as an outstanding token
+        data = await sync_to_async(serializer.login)(user)
+        await sync_to_async(record_successful_login)(request)
+        return Response(data, status=status.HTTP_200_OK)
+
+    async def aauthenticate_user(self, request, username, password):
+        """authenticate() of the ModelBackend, unknown emails hash the password too so they take as long"""
+        try:
+            user = await User._default_manager.aget(**{User.USERNAME_FIELD: username})
+        except User.DoesNotExist:
+            await get_hashing_executor().amake_password(password)
+            user = None
+        if user is not None and (not await user.acheck_password(password) or not user.is_active):
+            user = None
+        if user is None:
+            user_login_failed.send(sender=__name__, credentials={User.USERNAME_FIELD: username}, request=request)
+        return user
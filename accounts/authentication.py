@@ -0,0 +1,126 @@
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from .cache import (get_cached_user, aget_cached_user, cache_user, acache_user, get_user_changed_at,
+                    aget_user_changed_at)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves the user from the users cache before querying the database.
+    The cache is invalidated by the accounts signals, QuerySet.update() bypasses them.
+    aauthenticate() is the same lookup for the async views, with the async cache and ORM."""
+
+    @staticmethod
+    def get_user_id(validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+    def get_user(self, validated_token):
+        user = get_cached_user(self.get_user_id(validated_token))
+        if user is None:
+            user = super().get_user(validated_token)
+            cache_user(user)
+            return user
+        return self.check_user(user, validated_token)
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        user = await aget_cached_user(user_id)
+        if user is None:
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+            self.check_user(user, validated_token)
+            await acache_user(user)
+            return user
+        return self.check_user(user, validated_token)
+
+    @staticmethod
+    def check_user(user, validated_token):
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Cached users carry the digest of their password instead of the hash
+            password_md5 = getattr(user, 'password_md5', None) or get_md5_hash_password(user.password)
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_md5:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
+
+
+class ClaimsUser(TokenUser):
+    """Stateless user built from the claims MyTokenObtainPairSerializer embeds in the tokens"""
+
+    @cached_property
+    def id(self):
+        # The claim holds the primary key as a string
+        return get_user_model()._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def is_active(self):
+        return self.token.get('is_active', False)
+
+
+class StatelessJWTAuthentication(CachedJWTAuthentication):
+    """Authenticate from the claims embedded in the access token without touching the database.
+    Claims older than USER_AUTH_CLAIMS_MAX_AGE, or read before the last change of the user, are not trusted
+    and the user is resolved through CachedJWTAuthentication instead."""
+
+    def get_user(self, validated_token):
+        if not self.claims_are_fresh(validated_token):
+            return super().get_user(validated_token)
+        return self.claims_user(validated_token)
+
+    async def aget_user(self, validated_token):
+        if not await self.aclaims_are_fresh(validated_token):
+            return await super().aget_user(validated_token)
+        return self.claims_user(validated_token)
+
+    @staticmethod
+    def claims_user(validated_token):
+        user = ClaimsUser(validated_token)
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+    @staticmethod
+    def claims_are_recent(validated_token):
+        claims_at = validated_token.get('claims_at')
+        if claims_at is None or api_settings.USER_ID_CLAIM not in validated_token:
+            return False
+        if any(claim not in validated_token for claim in settings.USER_AUTH_TOKEN_CLAIMS):
+            return False
+        return time.time() - claims_at <= settings.USER_AUTH_CLAIMS_MAX_AGE
+
+    @classmethod
+    def claims_are_fresh(cls, validated_token):
+        if not cls.claims_are_recent(validated_token):
+            return False
+        changed_at = get_user_changed_at(validated_token[api_settings.USER_ID_CLAIM])
+        return changed_at is None or validated_token['claims_at'] > changed_at
+
+    @classmethod
+    async def aclaims_are_fresh(cls, validated_token):
+        if not cls.claims_are_recent(validated_token):
+            return False
+        changed_at = await aget_user_changed_at(validated_token[api_settings.USER_ID_CLAIM])
+        return changed_at is None or validated_token['claims_at'] > changed_at
@@ -0,0 +1,96 @@
+# Module to create users in batches with a handful of queries
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.validators import UniqueValidator
+from simple_history.utils import bulk_create_with_history
+from api.serializers import BulkUserSerializer, USER_FIELD_PLAN, represent_instance
+from .hashing import make_passwords
+from .models import User, UserChange
+from .search import search_index
+from .uniqueness import unique_values
+
+
+def _find_duplicates(valid_items, field, taken_values):
+    """Index of every item that repeats a value already taken in the database or by an earlier item"""
+    duplicates = set()
+    seen = set(taken_values)
+    for index, data in valid_items:
+        if data[field] in seen:
+            duplicates.add(index)
+        seen.add(data[field])
+    return duplicates
+
+
+def _check_unique(pending, results):
+    """Items of pending whose email and mobile phone are free, the others get a 400 result. Two queries check the
+    uniqueness of the whole batch instead of two per item."""
+    taken_emails = User.objects.filter(email__in=[data['email'] for _, data in pending]) \
+        .values_list('email', flat=True)
+    taken_phones = User.objects.filter(mobile_phone__in=[data['mobile_phone'] for _, data in pending]) \
+        .values_list('mobile_phone', flat=True)
+    duplicated_emails = _find_duplicates(pending, 'email', taken_emails)
+    duplicated_phones = _find_duplicates(pending, 'mobile_phone', taken_phones)
+    free_items = []
+    for index, data in pending:
+        errors = {}
+        if index in duplicated_emails:
+            errors['email'] = [UniqueValidator.message]
+        if index in duplicated_phones:
+            errors['mobile_phone'] = [UniqueValidator.message]
+        if errors:
+            results[index] = {'index': index, 'status': 400, 'errors': errors}
+        else:
+            free_items.append((index, data))
+    return free_items
+
+
+def _insert_users(users, history_user):
+    with transaction.atomic():
+        if settings.USER_HISTORY_FORMAT == 'diff':
+            users = User.objects.bulk_create(users, batch_size=settings.USERS_BULK_CREATE_BATCH_SIZE)
+            UserChange.objects.record_creations(users, history_date=timezone.now(), history_user=history_user)
+            return users
+        return bulk_create_with_history(users, User, batch_size=settings.USERS_BULK_CREATE_BATCH_SIZE,
+                                        default_user=history_user)
+
+
+def bulk_create_users(items, history_user=None):
+    """Validate, hash and insert a batch of users, returns one result per item in the input order"""
+    results = [None] * len(items)
+    valid_items = []
+    for index, item in enumerate(items):
+        serializer = BulkUserSerializer(data=item)
+        if serializer.is_valid():
+            data = dict(serializer.validated_data)
+            data['email'] = User.objects.normalize_email(data['email'])
+            valid_items.append((index, data))
+        else:
+            results[index] = {'index': index, 'status': 400, 'errors': serializer.errors}
+
+    new_items = _check_unique(valid_items, results)
+    passwords = make_passwords(data.pop('password') for _, data in new_items)
+    users = {}
+    for (index, data), password in zip(new_items, passwords):
+        user = User(**data)
+        user.normalize_names()
+        user.update_search_text()
+        user.password = user._hashed_password = password
+        users[index] = user
+    created = []
+    while new_items:
+        try:
+            created = _insert_users([users[index] for index, _ in new_items], history_user)
+            break
+        except IntegrityError:
+            # Another request took an email or a mobile phone after the check, insert the batch without its items
+            free_items = _check_unique(new_items, results)
+            if len(free_items) == len(new_items):
+                raise
+            new_items = free_items
+    # bulk_create() sends no post_save signal
+    unique_values.add(created)
+    search_index.add(created)
+    for (index, _), user in zip(new_items, created):
+        results[index] = {'index': index, 'status': 201, 'user': represent_instance(user, USER_FIELD_PLAN)}
+    return results
@@ -0,0 +1,142 @@
+# Module to cache the users resolved from access tokens
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import router
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# Fields the authentication, the permissions and the owner's own representation read. The password hash is not
+# cached, the revoke token check compares the digest of it instead.
+CACHED_USER_FIELDS = ('id', 'is_superuser', 'is_staff', 'is_active', 'first_name', 'last_name', 'email', 'country',
+                      'city', 'address', 'mobile_phone', )
+
+
+class LocalUserCache:
+    """Thread safe in process LRU, entries expire after ttl seconds"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def set(self, key, user):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_user_cache = LocalUserCache(settings.USER_AUTH_LOCAL_CACHE_SIZE, settings.USER_AUTH_LOCAL_CACHE_TTL)
+
+
+def user_cache_key(user_id):
+    return f'accounts:auth-user:{user_id}'
+
+
+def user_cache_entry(user):
+    entry = {field: getattr(user, field) for field in CACHED_USER_FIELDS}
+    if api_settings.CHECK_REVOKE_TOKEN:
+        entry['password_md5'] = get_md5_hash_password(user.password)
+    return entry
+
+
+def user_from_cache_entry(entry):
+    """User loaded with the cached fields only, the other ones are deferred and read from the database on access"""
+    user_model = get_user_model()
+    field_names = [field.attname for field in user_model._meta.concrete_fields if field.attname in entry]
+    user = user_model.from_db(router.db_for_read(user_model), field_names, [entry[name] for name in field_names])
+    user.password_md5 = entry.get('password_md5')
+    return user
+
+
+def get_cached_user(user_id):
+    """Look for the user in the local LRU, then in the shared cache, None when it is not cached"""
+    # Token claims hold the id as a string, keys built from it match the ones built from user.pk
+    key = user_cache_key(user_id)
+    entry = local_user_cache.get(key)
+    if entry is None:
+        entry = caches[settings.USER_AUTH_CACHE_ALIAS].get(key)
+        if entry is None:
+            return None
+        local_user_cache.set(key, entry)
+    # Every request gets its own instance, changes made by one request never leak into another one
+    return user_from_cache_entry(entry)
+
+
+async def aget_cached_user(user_id):
+    key = user_cache_key(user_id)
+    entry = local_user_cache.get(key)
+    if entry is None:
+        entry = await caches[settings.USER_AUTH_CACHE_ALIAS].aget(key)
+        if entry is None:
+            return None
+        local_user_cache.set(key, entry)
+    return user_from_cache_entry(entry)
+
+
+def cache_user(user):
+    key = user_cache_key(user.pk)
+    entry = user_cache_entry(user)
+    caches[settings.USER_AUTH_CACHE_ALIAS].set(key, entry, settings.USER_AUTH_CACHE_TIMEOUT)
+    local_user_cache.set(key, entry)
+
+
+async def acache_user(user):
+    key = user_cache_key(user.pk)
+    entry = user_cache_entry(user)
+    await caches[settings.USER_AUTH_CACHE_ALIAS].aset(key, entry, settings.USER_AUTH_CACHE_TIMEOUT)
+    local_user_cache.set(key, entry)
+
+
+def user_changed_at_key(user_id):
+    return f'accounts:auth-user-changed-at:{user_id}'
+
+
+def get_user_changed_at(user_id):
+    """Timestamp of the last change of the user, None when it did not change within the claims max age"""
+    return caches[settings.USER_AUTH_CACHE_ALIAS].get(user_changed_at_key(user_id))
+
+
+async def aget_user_changed_at(user_id):
+    return await caches[settings.USER_AUTH_CACHE_ALIAS].aget(user_changed_at_key(user_id))
+
+
+def invalidate_cached_users(user_ids):
+    """Drop the cached users and record when they changed, so the claims embedded in older tokens are not trusted"""
+    user_ids = list(user_ids)
+    keys = [user_cache_key(user_id) for user_id in user_ids]
+    for key in keys:
+        local_user_cache.delete(key)
+    shared_cache = caches[settings.USER_AUTH_CACHE_ALIAS]
+    shared_cache.delete_many(keys)
+    changed_at = time.time()
+    shared_cache.set_many({user_changed_at_key(user_id): changed_at for user_id in user_ids},
+                          settings.USER_AUTH_CLAIMS_MAX_AGE)
@@ -0,0 +1,249 @@
+# Module to run password hashing through a pluggable executor
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from core.metrics import password_hashing_duration, password_hashing_queued
+
+
+class HashingMetrics:
+    """Thread safe counters of the hashing executor, hashes in flight and latency in seconds. The hashes submitted
+    to a pool and not started yet are counted in queued, shared with the worker processes that start them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queued = multiprocessing.Value('i', 0)
+        self.reset()
+
+    def reset(self):
+        self.in_flight = 0
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        with self.queued.get_lock():
+            self.queued.value = 0
+
+    def started(self, count=1):
+        with self._lock:
+            self.in_flight += count
+
+    def submitted(self, count=1):
+        with self.queued.get_lock():
+            self.queued.value += count
+
+    def finished(self, started_at, count=1):
+        elapsed = time.perf_counter() - started_at
+        with self._lock:
+            self.in_flight -= count
+            self.calls += count
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+        password_hashing_duration.observe(elapsed)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'in_flight': self.in_flight,
+                'queued': self.queued.value,
+                'calls': self.calls,
+                'total_seconds': self.total_seconds,
+                'max_seconds': self.max_seconds,
+                'mean_seconds': self.total_seconds / self.calls if self.calls else 0.0,
+            }
+
+
+hashing_metrics = HashingMetrics()
+password_hashing_queued.set_function(lambda: hashing_metrics.queued.value)
+_worker_queued = None
+
+
+def dequeue(queued, function, *args):
+    """Run a hash submitted to a pool, it leaves the queue when a pool thread or worker process starts it"""
+    with queued.get_lock():
+        queued.value -= 1
+    return function(*args)
+
+
+def init_worker(queued):
+    global _worker_queued
+    _worker_queued = queued
+    django.setup()
+
+
+def worker_dequeue(function, *args):
+    # The shared counter can not be pickled with the call, the worker got it when it started
+    return dequeue(_worker_queued, function, *args)
+
+
+def verify_password(raw_password, encoded):
+    """check_password() without the upgrade setter, so it can run in another process"""
+    return hashers.check_password(raw_password, encoded)
+
+
+def password_must_update(encoded):
+    """True when a valid hash was produced by a hasher or work factor that is no longer the preferred one"""
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False
+    preferred = hashers.get_hasher('default')
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+class InlineHashingExecutor:
+    """Hash in the calling thread"""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+
+    def run(self, function, *args):
+        return function(*args)
+
+    def map(self, function, iterable):
+        return [function(item) for item in iterable]
+
+    async def arun(self, function, *args):
+        # Hashing inline would block the event loop, run it in the loop default executor instead
+        hashing_metrics.submitted()
+        return await asyncio.get_running_loop().run_in_executor(None, dequeue, hashing_metrics.queued, function,
+                                                                *args)
+
+    def make_password(self, raw_password):
+        started_at = time.perf_counter()
+        hashing_metrics.started()
+        try:
+            return self.run(hashers.make_password, raw_password)
+        finally:
+            hashing_metrics.finished(started_at)
+
+    def check_password(self, raw_password, encoded):
+        if raw_password is None or not hashers.is_password_usable(encoded):
+            return False
+        started_at = time.perf_counter()
+        hashing_metrics.started()
+        try:
+            return self.run(verify_password, raw_password, encoded)
+        finally:
+            hashing_metrics.finished(started_at)
+
+    async def amake_password(self, raw_password):
+        started_at = time.perf_counter()
+        hashing_metrics.started()
+        try:
+            return await self.arun(hashers.make_password, raw_password)
+        finally:
+            hashing_metrics.finished(started_at)
+
+    async def acheck_password(self, raw_password, encoded):
+        if raw_password is None or not hashers.is_password_usable(encoded):
+            return False
+        started_at = time.perf_counter()
+        hashing_metrics.started()
+        try:
+            return await self.arun(verify_password, raw_password, encoded)
+        finally:
+            hashing_metrics.finished(started_at)
+
+    def make_passwords(self, raw_passwords):
+        """Hash a batch of raw passwords, keeping the input order"""
+        raw_passwords = list(raw_passwords)
+        started_at = time.perf_counter()
+        hashing_metrics.started(len(raw_passwords))
+        try:
+            return self.map(hashers.make_password, raw_passwords)
+        finally:
+            hashing_metrics.finished(started_at, len(raw_passwords))
+
+    def shutdown(self):
+        pass
+
+
+class ThreadPoolHashingExecutor(InlineHashingExecutor):
+    """Hash in a thread pool, hashlib.pbkdf2_hmac releases the GIL so PBKDF2 hashes run on every core"""
+
+    def __init__(self, max_workers=None):
+        super().__init__(max_workers)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hashing')
+
+    def submit(self, function, *args):
+        hashing_metrics.submitted()
+        return self._pool.submit(dequeue, hashing_metrics.queued, function, *args)
+
+    def run(self, function, *args):
+        return self.submit(function, *args).result()
+
+    async def arun(self, function, *args):
+        return await asyncio.wrap_future(self.submit(function, *args))
+
+    def map(self, function, iterable):
+        items = list(iterable)
+        hashing_metrics.submitted(len(items))
+        return list(self._pool.map(functools.partial(dequeue, hashing_metrics.queued, function), items))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+class ProcessPoolHashingExecutor(InlineHashingExecutor):
+    """Hash in worker processes, for hashers that hold the GIL while they run"""
+
+    def __init__(self, max_workers=None):
+        super().__init__(max_workers)
+        # Workers only hash, django.setup() loads the settings when the start method is not fork
+        self._pool = ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                         initargs=(hashing_metrics.queued, ))
+
+    def submit(self, function, *args):
+        hashing_metrics.submitted()
+        return self._pool.submit(worker_dequeue, function, *args)
+
+    def run(self, function, *args):
+        return self.submit(function, *args).result()
+
+    async def arun(self, function, *args):
+        return await asyncio.wrap_future(self.submit(function, *args))
+
+    def map(self, function, iterable):
+        items = list(iterable)
+        chunksize = max(1, len(items) // ((self.max_workers or os.cpu_count() or 1) * 4))
+        hashing_metrics.submitted(len(items))
+        return list(self._pool.map(functools.partial(worker_dequeue, function), items, chunksize=chunksize))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_hashing_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                executor_class = import_string(settings.PASSWORD_HASHING_EXECUTOR)
+                _executor = executor_class(max_workers=settings.PASSWORD_HASHING_WORKERS)
+    return _executor
+
+
+@receiver(setting_changed)
+def reset_hashing_executor(*, setting, **kwargs):
+    global _executor
+    if setting in ('PASSWORD_HASHING_EXECUTOR', 'PASSWORD_HASHING_WORKERS', 'PASSWORD_HASHERS'):
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = None
+
+
+def make_passwords(raw_passwords):
+    return get_hashing_executor().make_passwords(raw_passwords)
@@ -0,0 +1,182 @@
+# Module to write the historical records out of the request path
+import atexit
+import logging
+import queue
+import threading
+import time
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from django.utils import timezone
+from simple_history.models import HistoricalRecords
+from simple_history.signals import pre_create_historical_record
+from core.metrics import history_write_duration
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryWriter:
+    """Queue historical records in memory and flush them with bulk_create from a background thread.
+    A batch is written when it reaches batch_size rows or flush_interval seconds after its first row, when the
+    queue is full the caller writes the row itself, so memory stays bounded. A batch that fails is tried again
+    and then written row by row, only the rows the database rejects on their own are lost."""
+    write_attempts = 2
+
+    def __init__(self, batch_size, flush_interval, max_size):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self.run, name='history-writer', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, history_instance):
+        self.start()
+        try:
+            self._queue.put_nowait(history_instance)
+        except queue.Full:
+            self.write([history_instance])
+
+    def run(self):
+        try:
+            while not self._stopping.is_set():
+                batch = self.collect()
+                if batch:
+                    # The thread lives as long as the process, drop the connection if it broke or got too old
+                    close_old_connections()
+                    self.write(batch)
+        finally:
+            connections.close_all()
+
+    def collect(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch):
+        started_at = time.perf_counter()
+        models = {}
+        for history_instance in batch:
+            models.setdefault(type(history_instance), []).append(history_instance)
+        for model, rows in models.items():
+            self.write_rows(model, rows)
+        history_write_duration.observe(time.perf_counter() - started_at, writer='batch')
+
+    def write_rows(self, model, rows):
+        # The savepoints keep a failed write from breaking the transaction of a caller writing a full queue
+        using = router.db_for_write(model)
+        for attempt in range(1, self.write_attempts + 1):
+            try:
+                with transaction.atomic(using=using):
+                    model.objects.bulk_create(rows, batch_size=self.batch_size)
+                return
+            except Exception:
+                logger.warning("Could not write %s %s rows, attempt %s", len(rows), model.__name__, attempt,
+                               exc_info=True)
+                if threading.current_thread() is self._thread:
+                    close_old_connections()
+        for row in rows:
+            try:
+                with transaction.atomic(using=using):
+                    model.objects.bulk_create([row])
+            except Exception:
+                logger.exception("Could not write %s row %s", model.__name__,
+                                 {field.attname: getattr(row, field.attname) for field in row._meta.concrete_fields})
+
+    def flush(self):
+        """Write every queued row from the calling thread"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.write(batch)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 2 if timeout is None else timeout)
+        self.flush()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+history_writer = HistoryWriter(settings.HISTORY_BATCH_SIZE, settings.HISTORY_FLUSH_INTERVAL,
+                               settings.HISTORY_QUEUE_SIZE)
+atexit.register(history_writer.stop)
+
+
+class BufferedHistoricalRecords(HistoricalRecords):
+    """HistoricalRecords that hands the rows to the history writer when HISTORY_BUFFERED_WRITES is on.
+    Rows are queued once the transaction of the change commits, post_create_historical_record is not sent.
+    When USER_HISTORY_FORMAT is 'diff' the change is stored by change_model.objects.record() instead,
+    in the transaction of the change, since its versions are numbered from the last stored one."""
+
+    def __init__(self, *args, change_model=None, **kwargs):
+        self.change_model = change_model
+        super().__init__(*args, **kwargs)
+
+    def create_historical_record(self, instance, history_type, using=None):
+        started_at = time.perf_counter()
+        try:
+            return self.write_historical_record(instance, history_type, using)
+        finally:
+            history_write_duration.observe(time.perf_counter() - started_at, writer='request')
+
+    def write_historical_record(self, instance, history_type, using):
+        if self.change_model is not None and settings.USER_HISTORY_FORMAT == 'diff':
+            change_model = apps.get_model(self.change_model)
+            return change_model.objects.record(instance, history_type,
+                                               history_date=getattr(instance, "_history_date", timezone.now()),
+                                               history_user=self.get_history_user(instance))
+        if not settings.HISTORY_BUFFERED_WRITES:
+            return super().create_historical_record(instance, history_type, using=using)
+
+        using = using if self.use_base_model_db else None
+        history_date = getattr(instance, "_history_date", timezone.now())
+        history_user = self.get_history_user(instance)
+        history_change_reason = self.get_change_reason_for_object(instance, history_type, using)
+        manager = getattr(instance, self.manager_name)
+
+        attrs = {}
+        for field in self.fields_included(instance):
+            attrs[field.attname] = getattr(instance, field.attname)
+
+        history_instance = manager.model(
+            history_date=history_date,
+            history_type=history_type,
+            history_user=history_user,
+            history_change_reason=history_change_reason,
+            **attrs,
+        )
+        pre_create_historical_record.send(
+            sender=manager.model,
+            instance=instance,
+            history_date=history_date,
+            history_user=history_user,
+            history_change_reason=history_change_reason,
+            history_instance=history_instance,
+            using=using,
+        )
+        transaction.on_commit(lambda: history_writer.enqueue(history_instance), using=using)
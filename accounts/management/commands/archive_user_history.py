@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from accounts.archive import archive_user_history
+
+
+class Command(BaseCommand):
+    help = "Archive HistoricalUser rows older than the retention period to gzipped NDJSON files and delete them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None)
+        parser.add_argument('--archive-dir', default=None)
+        parser.add_argument('--chunk-size', type=int, default=None, help="Rows per archive file")
+        parser.add_argument('--delete-batch-size', type=int, default=None, help="Rows per DELETE statement")
+
+    def handle(self, *args, **options):
+        files = archive_user_history(older_than_days=options['older_than_days'],
+                                     archive_dir=options['archive_dir'],
+                                     chunk_size=options['chunk_size'],
+                                     delete_batch_size=options['delete_batch_size'])
+        for path in files:
+            self.stdout.write(str(path))
+        self.stdout.write(f"Archived {len(files)} files")
@@ -0,0 +1,197 @@
+import json
+import math
+import platform
+import subprocess
+import time
+import tracemalloc
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from accounts.cache import invalidate_cached_users
+from accounts.models import User
+from core.middleware import QueryCounter
+
+PASSWORD = 'PasswordStrong1234'
+SCENARIOS = ('signup', 'login', 'retrieve', 'patch', 'list', 'delete')
+
+
+class RollbackBenchmark(Exception):
+    pass
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * percent / 100) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Measure req/s, p50/p99 latency, queries and allocations per request of the accounts endpoints, "
+            "on the configured database. The benchmark data is rolled back at the end.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario")
+        parser.add_argument('--allocation-requests', type=int, default=20,
+                            help="Requests per scenario traced with tracemalloc, in a separate pass")
+        parser.add_argument('--list-rows', type=int, nargs='+', default=[1000],
+                            help="Users in the table for the listing scenario, e.g. 1000 100000 1000000")
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+        parser.add_argument('--compare', help="JSON results of a previous run to compare with")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError("--requests must be at least 1")
+        self.options = options
+        self.results = []
+        self.authenticated_users = []
+        self.password = make_password(PASSWORD)
+        self.sequence = 0
+        # Benchmark rows are created inside a transaction that is always rolled back, the login throttle would
+        # reject the repeated logins
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                                                         LOGIN_THROTTLE_ENABLED=False):
+                self.run()
+                raise RollbackBenchmark
+        except RollbackBenchmark:
+            pass
+        # The rolled back users stay in the authentication cache, their ids will be reused
+        invalidate_cached_users(self.authenticated_users)
+
+        report = {
+            'commit': git_commit(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'created_at': timezone.now().isoformat(),
+            'results': self.results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        if options['compare']:
+            self.compare(options['compare'])
+
+    def build_users(self, count, **fields):
+        users = []
+        for _ in range(count):
+            self.sequence += 1
+            users.append(User(email=f'benchmark{self.sequence}@example.com', first_name='Benchmark',
+                              last_name='User', country='Cuba', city='La Habana', address='Habana Cuba',
+                              mobile_phone=f'+99 {self.sequence:010d}', password=self.password, **fields))
+        return users
+
+    def create_users(self, count, **fields):
+        return User.objects.bulk_create(self.build_users(count, **fields), batch_size=5000)
+
+    def authenticated_client(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        return client
+
+    def run(self):
+        scenarios = self.options['scenarios']
+        user, admin = self.create_users(1)[0], self.create_users(1, is_staff=True)[0]
+        self.authenticated_users = [user.pk, admin.pk]
+        client, admin_client = self.authenticated_client(user), self.authenticated_client(admin)
+        total = self.options['requests'] + self.options['allocation_requests']
+
+        if 'signup' in scenarios:
+            signups = iter(self.build_users(total))
+
+            def signup():
+                new_user = next(signups)
+                return APIClient().post('/api/v1/accounts/users/', data={
+                    'first_name': new_user.first_name, 'last_name': new_user.last_name,
+                    'email': new_user.email, 'country': new_user.country, 'city': new_user.city,
+                    'address': new_user.address, 'mobile_phone': new_user.mobile_phone, 'password': PASSWORD})
+            self.measure('signup', signup, 201)
+        if 'login' in scenarios:
+            self.measure('login', lambda: APIClient().post('/api/v1/accounts/users/login',
+                                                           data={'email': user.email, 'password': PASSWORD}), 200)
+        if 'retrieve' in scenarios:
+            self.measure('retrieve', lambda: client.get(f'/api/v1/accounts/users/{user.id}'), 200)
+        if 'patch' in scenarios:
+            self.measure('patch', lambda: client.patch(f'/api/v1/accounts/users/{user.id}',
+                                                       data={'city': 'Matanzas'}), 200)
+        if 'delete' in scenarios:
+            deleted = iter(self.create_users(total))
+            self.measure('delete', lambda: admin_client.delete(f'/api/v1/accounts/users/{next(deleted).id}'), 204)
+        if 'list' in scenarios:
+            for rows in sorted(self.options['list_rows']):
+                self.create_users(max(0, rows - User.objects.count()))
+                pages = {'next': None}
+
+                def list_users():
+                    # Walk the pages through the cursors, starting over after the last one
+                    response = admin_client.get(pages['next'] or '/api/v1/accounts/users/')
+                    pages['next'] = response.data['next'] if response.status_code == 200 else None
+                    return response
+                self.measure('list', list_users, 200, rows=rows)
+
+    def measure(self, scenario, request, expected_status, rows=None):
+        latencies = []
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            started_at = time.perf_counter()
+            for _ in range(self.options['requests']):
+                request_started_at = time.perf_counter()
+                response = request()
+                latencies.append(time.perf_counter() - request_started_at)
+                if response.status_code != expected_status:
+                    raise CommandError(f"{scenario} answered {response.status_code}: {response.content[:200]}")
+            elapsed = time.perf_counter() - started_at
+
+        allocated = None
+        if self.options['allocation_requests']:
+            tracemalloc.start()
+            try:
+                for _ in range(self.options['allocation_requests']):
+                    request()
+                allocated = tracemalloc.get_traced_memory()[1] / self.options['allocation_requests']
+            finally:
+                tracemalloc.stop()
+
+        result = {
+            'scenario': scenario,
+            'rows': rows,
+            'requests': len(latencies),
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'queries_per_request': counter.count / len(latencies),
+            'peak_allocated_bytes_per_request': allocated,
+        }
+        self.results.append(result)
+        name = scenario if rows is None else f'{scenario} ({rows} rows)'
+        allocations = '-' if allocated is None else f'{allocated / 1024:,.1f} KiB'
+        self.stdout.write(f"{name:<22} {result['requests_per_second']:>9,.1f} req/s  "
+                          f"p50 {result['p50_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  "
+                          f"{result['queries_per_request']:>5.1f} queries  {allocations}")
+
+    def compare(self, path):
+        with open(path) as previous_file:
+            previous = json.load(previous_file)
+        previous_results = {(result['scenario'], result['rows']): result for result in previous['results']}
+        self.stdout.write(f"Compared with {previous.get('commit') or path}")
+        for result in self.results:
+            before = previous_results.get((result['scenario'], result['rows']))
+            if before is None:
+                continue
+            change = (result['requests_per_second'] / before['requests_per_second'] - 1) * 100
+            name = result['scenario'] if result['rows'] is None else f"{result['scenario']} ({result['rows']} rows)"
+            self.stdout.write(f"{name:<22} {before['requests_per_second']:>9,.1f} -> "
+                              f"{result['requests_per_second']:>9,.1f} req/s ({change:+.1f}%)  "
+                              f"{before['queries_per_request']:.1f} -> {result['queries_per_request']:.1f} queries")
@@ -0,0 +1,114 @@
+import json
+import time
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from accounts.admin import COUNTRIES_CACHE_KEY, CURSOR_VAR, UserAdmin
+from accounts.models import User
+from core.middleware import QueryCounter
+from .benchmark_accounts import PASSWORD, RollbackBenchmark, git_commit, percentile
+
+SCENARIOS = ('first_page', 'deep_page', 'search_email', 'search_name', 'filter')
+LAST_NAMES = ('Garcia', 'Lopez', 'Martinez', 'Perez', 'Rodriguez', 'Sanchez', 'Torres', 'Vazquez')
+
+
+class StockUserAdmin(admin.ModelAdmin):
+    """The users admin as it was before, offset pages, COUNT(*) and one filter option per distinct value, with the
+    default icontains search to compare the searches with"""
+    list_display = UserAdmin.list_display
+    list_filter = ['first_name', 'last_name', 'email', 'country', ]
+    search_fields = ['email', 'first_name', 'last_name', 'mobile_phone', ]
+    change_list_template = 'admin/change_list.html'
+
+
+class Command(BaseCommand):
+    help = ("Measure the users admin changelist on a table of --rows users, against the stock ModelAdmin options it "
+            "replaced. The benchmark data is rolled back at the end.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help="Users in the table")
+        parser.add_argument('--requests', type=int, default=5, help="Requests per scenario and admin")
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument('--skip-stock', action='store_true', help="Only measure the keyset changelist")
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        if options['rows'] < 2 or options['requests'] < 1:
+            raise CommandError("--rows must be at least 2 and --requests at least 1")
+        self.options = options
+        self.results = []
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                self.run()
+                raise RollbackBenchmark
+        except RollbackBenchmark:
+            pass
+        # The country filter options were read from the rolled back rows
+        cache.delete(COUNTRIES_CACHE_KEY)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'commit': git_commit(), 'database': connection.vendor, 'rows': options['rows'],
+                           'results': self.results}, output, indent=2)
+
+    def create_users(self, rows):
+        password = make_password(PASSWORD)
+        for start in range(0, rows, 5000):
+            User.objects.bulk_create(
+                User(email=f'admin-benchmark{number}@example.com', first_name='Benchmark',
+                     last_name=LAST_NAMES[number % len(LAST_NAMES)], country='Cuba', city='La Habana',
+                     address='Habana Cuba', mobile_phone=f'+97 {number:010d}', password=password,
+                     is_staff=number == 0, is_superuser=number == 0)
+                for number in range(start, min(start + 5000, rows)))
+        self.stdout.write(f"Created {rows:,} users")
+
+    def run(self):
+        rows = self.options['rows']
+        self.create_users(rows)
+        superuser = User.objects.get(email='admin-benchmark0@example.com')
+        deep_user = User.objects.filter(email=f'admin-benchmark{rows * 9 // 10}@example.com').get()
+        middle_email = f'admin-benchmark{rows // 2}@example.com'
+        admins = [('keyset', UserAdmin(User, admin.site))]
+        if not self.options['skip_stock']:
+            admins.append(('stock', StockUserAdmin(User, admin.site)))
+
+        for kind, model_admin in admins:
+            deep_page = rows * 9 // 10 // model_admin.list_per_page + 1
+            scenarios = {
+                'first_page': {},
+                'deep_page': {CURSOR_VAR: deep_user.pk} if kind == 'keyset' else {'p': deep_page},
+                'search_email': {'q': middle_email},
+                'search_name': {'q': 'Lopez'},
+                'filter': {'last_name_initial': 'L'} if kind == 'keyset' else {'last_name': 'Lopez'},
+            }
+            for scenario in self.options['scenarios']:
+                self.measure(scenario, kind, model_admin, superuser, scenarios[scenario])
+
+    def measure(self, scenario, kind, model_admin, user, params):
+        latencies = []
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            for _ in range(self.options['requests']):
+                request = RequestFactory().get('/admin/accounts/user/', params)
+                request.user = user
+                started_at = time.perf_counter()
+                response = model_admin.changelist_view(request)
+                response.render()
+                latencies.append(time.perf_counter() - started_at)
+                if response.status_code != 200:
+                    raise CommandError(f"{kind} {scenario} answered {response.status_code}")
+        result = {
+            'scenario': scenario,
+            'admin': kind,
+            'requests': len(latencies),
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'queries_per_request': counter.count / len(latencies),
+        }
+        self.results.append(result)
+        self.stdout.write(f"{scenario:<14} {kind:<7} p50 {result['p50_ms']:>10.2f} ms  "
+                          f"p99 {result['p99_ms']:>10.2f} ms  {result['queries_per_request']:>5.1f} queries")
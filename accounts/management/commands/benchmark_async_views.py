@@ -0,0 +1,109 @@
+import asyncio
+import json
+import time
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from accounts.cache import invalidate_cached_users
+from accounts.models import User
+from .benchmark_accounts import PASSWORD, RollbackBenchmark, git_commit, percentile
+
+SCENARIOS = ('retrieve', 'patch', 'list', 'login')
+
+
+class Command(BaseCommand):
+    help = ("Load test the sync and the async accounts views through the ASGI handler, with --concurrency requests "
+            "in flight, and compare their throughput. The benchmark data is rolled back at the end.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario and view kind")
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests and --concurrency must be at least 1")
+        self.options = options
+        self.results = []
+        self.authenticated_users = []
+        # The async views run their queries in this thread through sync_to_async(), inside the rolled back
+        # transaction, the login throttle would reject the repeated logins
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                                                         LOGIN_THROTTLE_ENABLED=False):
+                users = self.create_users()
+                async_to_sync(self.run)(*users)
+                raise RollbackBenchmark
+        except RollbackBenchmark:
+            pass
+        # The rolled back users stay in the authentication cache, their ids will be reused
+        invalidate_cached_users(self.authenticated_users)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'commit': git_commit(), 'results': self.results}, output, indent=2)
+
+    def create_users(self):
+        password = make_password(PASSWORD)
+        users = User.objects.bulk_create(
+            User(email=f'load{number}@example.com', first_name='Load', last_name='Test', country='Cuba',
+                 city='La Habana', address='Habana Cuba', mobile_phone=f'+98 {number:010d}', password=password,
+                 is_staff=number == 0)
+            for number in range(max(100, settings.USERS_PAGE_SIZE * 2)))
+        admin, user = users[0], users[1]
+        self.authenticated_users = [user.pk, admin.pk]
+        return (user, {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'},
+                {'Authorization': f'Bearer {RefreshToken.for_user(admin).access_token}'})
+
+    async def run(self, user, user_headers, admin_headers):
+        client = AsyncClient()
+        scenarios = {
+            'retrieve': (lambda prefix: client.get(f'{prefix}users/{user.id}', headers=user_headers), 200),
+            'patch': (lambda prefix: client.patch(f'{prefix}users/{user.id}', data={'city': 'Matanzas'},
+                                                  content_type='application/json', headers=user_headers), 200),
+            'list': (lambda prefix: client.get(f'{prefix}users/', headers=admin_headers), 200),
+            'login': (lambda prefix: client.post(f'{prefix}users/login', content_type='application/json',
+                                                 data={'email': user.email, 'password': PASSWORD}), 200),
+        }
+        for scenario in self.options['scenarios']:
+            request, expected_status = scenarios[scenario]
+            throughput = {}
+            for kind, prefix in (('sync', '/api/v1/accounts/'), ('async', '/api/v1/accounts/async/')):
+                result = await self.load(scenario, kind, lambda: request(prefix), expected_status)
+                throughput[kind] = result['requests_per_second']
+            self.stdout.write(f"{scenario:<10} async/sync {throughput['async'] / throughput['sync']:.2f}x")
+
+    async def load(self, scenario, kind, request, expected_status):
+        semaphore = asyncio.Semaphore(self.options['concurrency'])
+        latencies = []
+
+        async def send():
+            async with semaphore:
+                started_at = time.perf_counter()
+                response = await request()
+                latencies.append(time.perf_counter() - started_at)
+                if response.status_code != expected_status:
+                    raise CommandError(f"{kind} {scenario} answered {response.status_code}: "
+                                       f"{response.content[:200]}")
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(send() for _ in range(self.options['requests'])))
+        elapsed = time.perf_counter() - started_at
+        result = {
+            'scenario': scenario,
+            'kind': kind,
+            'concurrency': self.options['concurrency'],
+            'requests': len(latencies),
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+        }
+        self.results.append(result)
+        self.stdout.write(f"{scenario:<10} {kind:<6} {result['requests_per_second']:>9,.1f} req/s  "
+                          f"p50 {result['p50_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms")
+        return result
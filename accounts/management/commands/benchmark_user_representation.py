@@ -0,0 +1,52 @@
+import time
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from accounts.models import User
+from api.serializers import UserSerializer, USER_FIELD_PLAN, USER_FIELD_COLUMNS, represent_rows
+
+
+class RollbackBenchmark(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare rows/sec of UserSerializer(many=True) against the field plan fast path"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        # Benchmark rows are created inside a transaction that is always rolled back
+        try:
+            with transaction.atomic():
+                self.create_users(options['rows'])
+                self.run(options['repeat'])
+                raise RollbackBenchmark
+        except RollbackBenchmark:
+            pass
+
+    def create_users(self, rows):
+        password = make_password('PasswordStrong1234')
+        User.objects.bulk_create(
+            (User(email=f'benchmark{number}@example.com', username='Benchmark', first_name='Benchmark',
+                  last_name='User', country='Cuba', city='La Habana', address='Habana Cuba',
+                  mobile_phone=f'+99 {number:010d}', password=password)
+             for number in range(rows)),
+            batch_size=1000)
+
+    def run(self, repeat):
+        queryset = User.objects.filter(is_active=True).order_by('id')
+        benchmarks = {
+            'serializer': lambda: UserSerializer(queryset.all(), many=True).data,
+            'field plan': lambda: represent_rows(queryset.values(*USER_FIELD_COLUMNS), USER_FIELD_PLAN),
+        }
+        for name, benchmark in benchmarks.items():
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                rows = len(benchmark())
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write(f"{name:<12} {rows} rows in {best:.3f}s -> {rows / best:,.0f} rows/sec")
@@ -0,0 +1,83 @@
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, Min
+from accounts.models import User, UserChange
+
+
+class Command(BaseCommand):
+    help = ("Convert the HistoricalUser rows into compact UserChange rows. The rows of users that already have "
+            "UserChange rows are merged below their versions when older than them and skipped otherwise.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--delete', action='store_true', help="Delete the HistoricalUser rows once converted")
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.delete = options['delete']
+        self.attnames = [field.attname for field in User._meta.concrete_fields
+                         if field.attname not in User.HISTORY_EXCLUDED_FIELDS]
+        self.converted = self.skipped = 0
+        # Users whose history went on in UserChange, e.g. created in bulk or before the switch to the diff format
+        self.first_changes = dict(UserChange.objects.values('user_id').annotate(first=Min('history_date'))
+                                  .values_list('user_id', 'first'))
+
+        records = User.history.model.objects.order_by('id', 'history_date', 'history_id') \
+            .iterator(chunk_size=self.batch_size)
+        changes, history_ids = [], []
+        user_id = previous = None
+        version = snapshot_version = 0
+        for record in records:
+            if record.id in self.first_changes and record.history_date >= self.first_changes[record.id]:
+                self.skipped += 1
+                continue
+            if record.id != user_id:
+                # Batches end at a user boundary, an interrupted run never leaves a user half converted
+                if len(changes) >= self.batch_size:
+                    self.write(changes, history_ids)
+                    changes, history_ids = [], []
+                user_id, previous, version = record.id, None, 0
+            version += 1
+            values = {attname: getattr(record, attname) for attname in self.attnames}
+            is_snapshot = previous is None or version - snapshot_version >= settings.USER_HISTORY_SNAPSHOT_INTERVAL
+            if is_snapshot:
+                snapshot_version = version
+                changed = values
+            elif record.history_type == '-':
+                changed = {}
+            else:
+                changed = {attname: value for attname, value in values.items() if previous[attname] != value}
+            previous = values
+            changes.append(UserChange(user_id=user_id,
+                                      version=version,
+                                      snapshot_version=snapshot_version,
+                                      history_type=record.history_type,
+                                      history_date=record.history_date,
+                                      history_user_id=record.history_user_id,
+                                      changes=changed))
+            history_ids.append(record.history_id)
+        if changes:
+            self.write(changes, history_ids)
+        self.stdout.write(f"Converted {self.converted} historical rows, skipped {self.skipped} newer than the "
+                          f"UserChange rows of their user")
+
+    def write(self, changes, history_ids):
+        with transaction.atomic():
+            merged = Counter(change.user_id for change in changes if change.user_id in self.first_changes)
+            for user_id, count in merged.items():
+                self.shift_versions(user_id, count)
+            UserChange.objects.bulk_create(changes)
+            if self.delete:
+                User.history.model.objects.filter(history_id__in=history_ids).delete()
+        self.converted += len(changes)
+
+    @staticmethod
+    def shift_versions(user_id, count):
+        """Renumber the UserChange rows of a user after count older versions. The rows first move past the
+        highest version so no UPDATE hits the unique (user, version) constraint."""
+        user_changes = UserChange.objects.filter(user_id=user_id)
+        top = user_changes.aggregate(top=Max('version'))['top']
+        user_changes.update(version=F('version') + top + count, snapshot_version=F('snapshot_version') + top + count)
+        user_changes.update(version=F('version') - top, snapshot_version=F('snapshot_version') - top)
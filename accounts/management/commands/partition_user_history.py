@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from accounts.archive import history_table, is_partitioned, create_monthly_partitions
+
+
+class Command(BaseCommand):
+    help = "Turn the HistoricalUser table into monthly range partitions on history_date (PostgreSQL only)"
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Partitioning is only available on PostgreSQL")
+        if is_partitioned():
+            self.stdout.write("The history table is already partitioned")
+            return
+        table = history_table()
+        old_table = f'{table}_unpartitioned'
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE "{table}" IN ACCESS EXCLUSIVE MODE')
+            cursor.execute(f'SELECT min(history_date) FROM "{table}"')
+            oldest = cursor.fetchone()[0] or timezone.now()
+            cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{old_table}"')
+            # The partition key has to be part of the primary key
+            cursor.execute(f'CREATE TABLE "{table}" (LIKE "{old_table}" INCLUDING DEFAULTS INCLUDING IDENTITY '
+                           f'INCLUDING CONSTRAINTS) PARTITION BY RANGE (history_date)')
+            cursor.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY (history_id, history_date)')
+            cursor.execute(f'CREATE INDEX ON "{table}" (history_date)')
+            cursor.execute(f'CREATE INDEX ON "{table}" (id)')
+            cursor.execute(f'CREATE INDEX ON "{table}" (history_user_id)')
+            cursor.execute(f'ALTER TABLE "{table}" ADD FOREIGN KEY (history_user_id) REFERENCES accounts_user (id) '
+                           f'DEFERRABLE INITIALLY DEFERRED')
+            months = ((timezone.now().year - oldest.year) * 12 + timezone.now().month - oldest.month
+                      + 1 + settings.HISTORY_PARTITION_MONTHS_AHEAD)
+            create_monthly_partitions(oldest, months)
+            cursor.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+            cursor.execute(f'INSERT INTO "{table}" OVERRIDING SYSTEM VALUE SELECT * FROM "{old_table}"')
+            cursor.execute(f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'history_id'), "
+                           f"coalesce(max(history_id), 1)) FROM \"{table}\"")
+            cursor.execute(f'DROP TABLE "{old_table}"')
+        self.stdout.write(f"Partitioned {table} in {months} monthly partitions")
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.1 on 2026-10-17 20:19
+
+import accounts.utils
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_user_managers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('snapshot_version', models.PositiveIntegerField()),
+                ('history_type', models.CharField(choices=[('+', 'Created'), ('~', 'Changed'), ('-', 'Deleted')], max_length=1)),
+                ('history_date', models.DateTimeField()),
+                ('changes', models.JSONField(encoder=accounts.utils.ChangesJSONEncoder)),
+                ('history_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Cambio de usuario',
+                'verbose_name_plural': 'Cambios de usuarios',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='userchange',
+            constraint=models.UniqueConstraint(fields=('user', 'version'), name='accounts_userchange_user_version'),
+        ),
+    ]
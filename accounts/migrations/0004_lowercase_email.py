@@ -0,0 +1,39 @@
+# Generated by Django 4.2.1 on 2026-10-17 21:07
+
+import accounts.models
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def lowercase_emails(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    duplicates = list(User.objects.values(email_lower=Lower('email')).annotate(users=Count('id'))
+                      .filter(users__gt=1).values_list('email_lower', flat=True)[:20])
+    if duplicates:
+        raise RuntimeError("These emails are used by several users with a different case, merge or change them "
+                           f"before migrating: {', '.join(duplicates)}")
+    users = [User(pk=pk, email=email.lower())
+             for pk, email in User.objects.exclude(email=Lower('email')).values_list('pk', 'email').iterator()]
+    User.objects.bulk_update(users, ['email'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_userchange'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historicaluser',
+            name='email',
+            field=accounts.models.LowercaseEmailField(db_index=True, max_length=254, verbose_name='Email'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='email',
+            field=accounts.models.LowercaseEmailField(max_length=254, unique=True, verbose_name='Email'),
+        ),
+        migrations.RunPython(lowercase_emails, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.1 on 2026-10-17 21:14
+
+from django.db import migrations, models
+from accounts.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0005_user_email_lowercase'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['id'], name='accounts_user_active_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['country', 'city'], name='accounts_user_country_city_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['last_name'], name='accounts_user_last_name_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['first_name'], name='accounts_user_first_name_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.1 on 2026-10-17 21:18
+
+from django.db import migrations, models
+from accounts.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0006_user_access_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_staff', True)), fields=['id'], name='accounts_user_active_staff_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['date_joined'], name='accounts_user_joined_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.1 on 2026-10-17 21:27
+
+from django.db import migrations, models
+from accounts.utils import make_search_text
+
+SEARCH_FIELDS = ['first_name', 'last_name', 'city', 'address', ]
+
+
+def fill_search_text(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    users = []
+    for pk, *values in User.objects.values_list('pk', *SEARCH_FIELDS).iterator(chunk_size=1000):
+        users.append(User(pk=pk, search_text=make_search_text(*values)))
+        if len(users) == 1000:
+            User.objects.bulk_update(users, ['search_text'])
+            users = []
+    User.objects.bulk_update(users, ['search_text'])
+
+
+def create_search_index(apps, schema_editor):
+    # GIN indexes are PostgreSQL only, the expression is the one accounts.search.ToTSVector compiles to
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS accounts_user_search_idx ON accounts_user "
+                              "USING gin (to_tsvector('simple', search_text))")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS accounts_user_search_idx")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0007_user_listing_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='search_text',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index, atomic=False),
+    ]
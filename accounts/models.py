@@ -1,12 +1,48 @@
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractUser, UserManager
-from django.contrib.auth.hashers import make_password
-from simple_history.models import HistoricalRecords
 from .validators import validate_mobile_phone, validate_name
-from .utils import make_upper_camel_case_names
+from .utils import make_upper_camel_case_names, make_search_text, ChangesJSONEncoder
+from .hashing import get_hashing_executor, password_must_update
+from .history import BufferedHistoricalRecords
+
+
+def get_history_user(instance=None, request=None, **kwargs):
+    if request is None:
+        return None
+    user = request.user
+    # Stateless token users only carry claims, the history only needs the primary key
+    if not isinstance(user, User):
+        return User(pk=user.pk)
+    return user
+
+
+class LowercaseEmailField(models.EmailField):
+    """EmailField saving and looking up the addresses in lowercase, the unique index rejects every spelling of a
+    taken email and exact lookups of any spelling use it"""
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        return value.lower() if isinstance(value, str) else value
+
+    def pre_save(self, model_instance, add):
+        value = self.get_prep_value(super().pre_save(model_instance, add))
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+@LowercaseEmailField.register_lookup
+class LowercaseIExact(models.lookups.Exact):
+    # The stored values are lowercase, iexact is an exact match on the index instead of UPPER() on every row
+    lookup_name = 'iexact'
 
 
 class CustomUserManager(UserManager):
+    @classmethod
+    def normalize_email(cls, email):
+        return super().normalize_email(email).lower()
+
     def _create_user(self, email, password, **extra_fields):
         if not email:
             raise ValueError("Es obligatorio tener un correo electrónico")
@@ -24,6 +60,19 @@ class CustomUserManager(UserManager):
         extra_fields.setdefault("is_superuser", False)
         return self._create_user(email, password, **extra_fields)
 
+    async def acreate_user(self, email=None, password=None, **extra_fields):
+        # The password is hashed by the hashing executor without blocking the event loop
+        if not email:
+            raise ValueError("Es obligatorio tener un correo electrónico")
+        if not password:
+            raise ValueError("Es obligatorio tener una clave")
+        extra_fields.setdefault("is_staff", False)
+        extra_fields.setdefault("is_superuser", False)
+        user = self.model(email=self.normalize_email(email), **extra_fields)
+        await user.aset_password(password)
+        await user.asave(using=self._db)
+        return user
+
     def create_superuser(self, email=None, password=None, **extra_fields):
         extra_fields.setdefault("is_staff", True)
         extra_fields.setdefault("is_superuser", True)
@@ -34,32 +83,210 @@ class CustomUserManager(UserManager):
 class User(AbstractUser):
     first_name = models.CharField(max_length=50, validators=[validate_name, ], verbose_name="Nombre", )
     last_name = models.CharField(max_length=50, validators=[validate_name, ], verbose_name="Apellidos", )
-    email = models.EmailField(unique=True, verbose_name="Email", )
+    email = LowercaseEmailField(unique=True, verbose_name="Email", )
     country = models.CharField(max_length=50, validators=[validate_name, ], verbose_name="Pais", )
     city = models.CharField(max_length=50, validators=[validate_name, ], verbose_name="Ciudad", )
     address = models.CharField(max_length=255, verbose_name="Direccion", )
     mobile_phone = models.CharField(max_length=15, unique=True, validators=[validate_mobile_phone, ],
                                     verbose_name="Teléfono movil", )
     username = models.CharField(unique=False, max_length=50)
-    history = HistoricalRecords()
+    # Words of the searched fields for the users search, derived on save
+    search_text = models.TextField(default='', editable=False, )
+    # Derived fields are left out of the history
+    HISTORY_EXCLUDED_FIELDS = ['search_text', ]
+    history = BufferedHistoricalRecords(get_user=get_history_user, change_model='accounts.UserChange',
+                                        excluded_fields=HISTORY_EXCLUDED_FIELDS)
     objects = CustomUserManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name', 'username', 'country', 'city', 'address', 'mobile_phone', ]
+    SEARCH_FIELDS = ['first_name', 'last_name', 'city', 'address', ]
 
     class Meta:
         verbose_name = "Usuario"
         verbose_name_plural = "Usuarios"
+        constraints = [
+            models.CheckConstraint(check=models.Q(email=Lower('email')), name='accounts_user_email_lowercase'),
+        ]
+        indexes = [
+            # The API lists, pages and exports the active users in primary key order
+            models.Index(fields=['id'], condition=models.Q(is_active=True), name='accounts_user_active_id_idx'),
+            models.Index(fields=['id'], condition=models.Q(is_active=True, is_staff=True),
+                         name='accounts_user_active_staff_idx'),
+            models.Index(fields=['date_joined'], condition=models.Q(is_active=True),
+                         name='accounts_user_joined_idx'),
+            models.Index(fields=['country', 'city'], name='accounts_user_country_city_idx'),
+            # Prefix searches of the names (LIKE 'Lo%'), on PostgreSQL they need the pattern operator class
+            models.Index(fields=['last_name'], opclasses=['varchar_pattern_ops'], name='accounts_user_last_name_idx'),
+            models.Index(fields=['first_name'], opclasses=['varchar_pattern_ops'],
+                         name='accounts_user_first_name_idx'),
+            # The GIN index of the search is PostgreSQL only, migration 0008 creates it
+        ]
+
+    # Last password value known to be a hash, either loaded from the database or produced by
+    # set_password(). Any other value found in the password field at save time is a raw password.
+    _hashed_password = None
+    # Field values as loaded from the database or as last saved, None for instances never saved
+    _loaded_values = None
 
     def __str__(self):
         return f"{self.username}"
 
-    def save(self, *args, **kwargs):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._hashed_password = instance.__dict__.get('password')
+        instance._loaded_values = instance.field_values()
+        return instance
+
+    def field_values(self):
+        # Deferred fields are not in __dict__ and are left out, as the fields left out of the history
+        return {field.attname: self.__dict__[field.attname]
+                for field in self._meta.concrete_fields
+                if field.attname in self.__dict__ and field.attname not in self.HISTORY_EXCLUDED_FIELDS}
+
+    def changed_values(self):
+        """Values of the fields changed since the instance was loaded or saved, None when there is no baseline"""
+        if self._loaded_values is None:
+            return None
+        return {attname: value for attname, value in self.field_values().items()
+                if attname not in self._loaded_values or self._loaded_values[attname] != value}
+
+    def set_password(self, raw_password):
+        self.password = get_hashing_executor().make_password(raw_password)
+        self._password = raw_password
+        self._hashed_password = self.password
+
+    def check_password(self, raw_password):
+        valid = get_hashing_executor().check_password(raw_password, self.password)
+        if valid and password_must_update(self.password):
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+        return valid
+
+    async def aset_password(self, raw_password):
+        self.password = await get_hashing_executor().amake_password(raw_password)
+        self._password = raw_password
+        self._hashed_password = self.password
+
+    async def acheck_password(self, raw_password):
+        valid = await get_hashing_executor().acheck_password(raw_password, self.password)
+        if valid and password_must_update(self.password):
+            await self.aset_password(raw_password)
+            self._password = None
+            await self.asave(update_fields=['password'])
+        return valid
+
+    def set_unusable_password(self):
+        super().set_unusable_password()
+        self._hashed_password = self.password
+
+    @property
+    def password_changed(self):
+        # The password field is deferred when the instance was loaded with .only()/.defer()
+        password = self.__dict__.get('password')
+        return password is not None and password != self._hashed_password
+
+    def normalize_names(self):
         self.first_name = make_upper_camel_case_names(self.first_name)
         self.last_name = make_upper_camel_case_names(self.last_name)
         self.country = make_upper_camel_case_names(self.country)
         self.city = make_upper_camel_case_names(self.city)
         self.username = self.first_name
-        if not self.is_superuser:
-            self.password = make_password(self.password)
+
+    def update_search_text(self):
+        # Instances loaded with .only()/.defer() save the loaded fields only, the search text stays as it is
+        if any(field not in self.__dict__ for field in self.SEARCH_FIELDS):
+            return
+        self.search_text = make_search_text(*(getattr(self, field) for field in self.SEARCH_FIELDS))
+
+    def save(self, *args, **kwargs):
+        self.normalize_names()
+        self.update_search_text()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & set(self.SEARCH_FIELDS):
+            kwargs['update_fields'] = {*update_fields, 'search_text'}
+        if self.password_changed:
+            self.password = get_hashing_executor().make_password(self.password)
         super().save(*args, **kwargs)
+        self._hashed_password = self.__dict__.get('password')
+        self._loaded_values = self.field_values()
+
+
+class UserChangeManager(models.Manager):
+    # Saves of the same user racing for the next version, the loser numbers its change again
+    record_attempts = 3
+
+    def record(self, instance, history_type, history_date, history_user=None):
+        """Store the fields changed by a save or delete, or a full snapshot every USER_HISTORY_SNAPSHOT_INTERVAL
+        versions and whenever the instance has no baseline to compare with"""
+        for attempt in range(1, self.record_attempts + 1):
+            last = (self.filter(user_id=instance.pk).order_by('-version')
+                    .values_list('version', 'snapshot_version').first())
+            changes = instance.changed_values()
+            if history_type == '-':
+                changes = {}
+            version = last[0] + 1 if last else 1
+            is_snapshot = (last is None or changes is None
+                           or version - last[1] >= settings.USER_HISTORY_SNAPSHOT_INTERVAL)
+            if is_snapshot:
+                changes = instance.field_values()
+            try:
+                # The savepoint keeps the transaction of the save usable when the version was taken meanwhile
+                with transaction.atomic(using=self.db):
+                    return self.create(user_id=instance.pk,
+                                       version=version,
+                                       snapshot_version=version if is_snapshot else last[1],
+                                       history_type=history_type,
+                                       history_date=history_date,
+                                       history_user=history_user,
+                                       changes=changes)
+            except IntegrityError:
+                if attempt == self.record_attempts:
+                    raise
+
+    def record_creations(self, instances, history_date, history_user=None):
+        """Store the first version, a full snapshot, of users created in bulk without save()"""
+        return self.bulk_create([self.model(user_id=instance.pk,
+                                            version=1,
+                                            snapshot_version=1,
+                                            history_type='+',
+                                            history_date=history_date,
+                                            history_user=history_user,
+                                            changes=instance.field_values())
+                                 for instance in instances])
+
+    def rebuild(self, user_id, version):
+        """Unsaved User with the field values it had at the given version, folding the changes since the snapshot"""
+        snapshot_version = self.values_list('snapshot_version', flat=True).get(user_id=user_id, version=version)
+        values = {}
+        for changes in (self.filter(user_id=user_id, version__gte=snapshot_version, version__lte=version)
+                        .order_by('version').values_list('changes', flat=True)):
+            values.update(changes)
+        return User(**{field.attname: field.to_python(values[field.attname])
+                       for field in User._meta.concrete_fields if field.attname in values})
+
+
+class UserChange(models.Model):
+    """Compact audit trail of User, each row holds only the fields changed by one save"""
+    HISTORY_TYPES = (('+', 'Created'), ('~', 'Changed'), ('-', 'Deleted'), )
+
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='changes', )
+    version = models.PositiveIntegerField()
+    snapshot_version = models.PositiveIntegerField()
+    history_type = models.CharField(max_length=1, choices=HISTORY_TYPES, )
+    history_date = models.DateTimeField()
+    history_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', )
+    changes = models.JSONField(encoder=ChangesJSONEncoder, )
+    objects = UserChangeManager()
+
+    class Meta:
+        verbose_name = "Cambio de usuario"
+        verbose_name_plural = "Cambios de usuarios"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'version'], name='accounts_userchange_user_version'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} v{self.version}"
@@ -0,0 +1,103 @@
+from django.conf import settings
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination, _positive_int, _reverse_ordering
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class UserCursorPagination(CursorPagination):
+    """Keyset pagination over the primary key index, deep pages cost the same as the first one"""
+    ordering = 'id'
+    page_size = getattr(settings, 'USERS_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'USERS_MAX_PAGE_SIZE', 500)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() fetching the page with async iteration, for the async views"""
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor or (0, False, None)
+
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if current_position is not None:
+            order = self.ordering[0]
+            if self.cursor.reverse != order.startswith('-'):
+                queryset = queryset.filter(**{order.lstrip('-') + '__lt': current_position})
+            else:
+                queryset = queryset.filter(**{order.lstrip('-') + '__gt': current_position})
+
+        results = [row async for row in queryset[offset:offset + self.page_size + 1]]
+        self.page = results[:self.page_size]
+        has_following_position = len(results) > len(self.page)
+        following_position = (self._get_position_from_instance(results[-1], self.ordering)
+                              if has_following_position else None)
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None or offset > 0
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+        return self.page
+
+
+class UserSearchPagination(BasePagination):
+    """Page number pagination of the ranked search results, a rank gives no keyset to follow. There is no count,
+    each page fetches one row more to tell whether a next one follows, and the pages stop at
+    USER_SEARCH_MAX_RESULTS results."""
+    page_size = getattr(settings, 'USERS_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'USERS_MAX_PAGE_SIZE', 500)
+    page_query_param = 'page'
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        try:
+            self.page_number = _positive_int(request.query_params.get(self.page_query_param, 1), strict=True)
+        except ValueError:
+            raise NotFound("Página no válida")
+        offset = (self.page_number - 1) * self.page_size
+        max_results = settings.USER_SEARCH_MAX_RESULTS
+        if offset >= max_results and self.page_number > 1:
+            raise NotFound(f"La búsqueda muestra como máximo {max_results} resultados")
+        rows = list(queryset[offset:offset + self.page_size + 1])
+        self.has_next = len(rows) > self.page_size and offset + self.page_size < max_results
+        return rows[:min(self.page_size, max_results - offset)]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.page_number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data})
@@ -2,7 +2,16 @@ from rest_framework import permissions
 
 
 class IsAuthenticatedAndIsOwner(permissions.BasePermission):
+    def has_permission(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return False
+        # Compare the authenticated user id with the URL kwarg, non owners are rejected before any query runs
+        lookup_url_kwarg = getattr(view, 'lookup_url_kwarg', None) or getattr(view, 'lookup_field', None)
+        if lookup_url_kwarg not in view.kwargs:
+            return True
+        return str(request.user.pk) == str(view.kwargs[lookup_url_kwarg])
+
     def has_object_permission(self, request, view, obj):
         if not request.user.is_authenticated:
             return False
-        return request.user.email == obj.email
+        return request.user.pk == obj.pk
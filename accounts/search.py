@@ -0,0 +1,222 @@
+# Module to search the active users by the words of their names, city and address
+import bisect
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, connections
+from django.db.models import BooleanField, F, FloatField, Func, TextField, Value
+from django.dispatch import receiver
+from core.middleware import uncounted_queries
+from .models import User
+from .utils import make_search_text
+
+logger = logging.getLogger(__name__)
+
+class ToTSVector(Func):
+    # The expression of the GIN index of migration 0008, PostgreSQL only uses the index for this exact expression
+    template = "to_tsvector('simple', %(expressions)s)"
+    output_field = TextField()
+
+
+class ToTSQuery(Func):
+    template = "to_tsquery('simple', %(expressions)s)"
+    output_field = TextField()
+
+
+class TSMatch(Func):
+    template = '%(expressions)s'
+    arg_joiner = ' @@ '
+    output_field = BooleanField()
+
+
+class TSRank(Func):
+    function = 'ts_rank'
+    output_field = FloatField()
+
+
+def search_terms(query):
+    """Words of the query to match, without accents and lowercase, the short ones are left out"""
+    terms = [term for term in make_search_text(query).split() if len(term) >= settings.USER_SEARCH_MIN_TERM_LENGTH]
+    return list(dict.fromkeys(terms))[:settings.USER_SEARCH_MAX_TERMS]
+
+
+class PostgresSearchEngine:
+    """Full text search over search_text, the 'simple' configuration keeps the words as they are (no stemming of
+    the names) and every term matches as a prefix"""
+
+    def search(self, queryset, terms):
+        vector = ToTSVector(F('search_text'))
+        # The terms are letters and digits only, nothing to escape in the tsquery syntax
+        query = ToTSQuery(Value(' & '.join(f"'{term}':*" for term in terms)))
+        return queryset.filter(TSMatch(vector, query)).annotate(rank=TSRank(vector, query)).order_by('-rank', 'id')
+
+
+class RankedRows:
+    """Rows of a queryset in the order of a list of ranked primary keys, slicing fetches the rows of the slice"""
+
+    def __init__(self, queryset, ids):
+        self.queryset = queryset
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        ids = self.ids[index]
+        rows = {row['id']: row for row in self.queryset.filter(id__in=ids)}
+        # Users deleted by other processes are still in the index until it is built again
+        return [rows[pk] for pk in ids if pk in rows]
+
+
+class InvertedIndex:
+    """In process index from the words of search_text to the ids of the active users, the search engine of the
+    databases without full text search. The first search builds it from the table, a background thread builds it
+    again after USER_SEARCH_INDEX_TTL seconds while the searches use the current one. The saves and deletes of this
+    process update it meanwhile. Whole words rank above prefixes."""
+    # Seconds between the background builds started by the searches, a failing build is not retried on every search
+    build_interval = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._postings = None
+        self._words = []
+        self._documents = {}
+        self._pending = None
+        self.built_at = 0
+        self.build_started_at = None
+
+    def needs_build(self):
+        return self._postings is None or time.monotonic() - self.built_at > settings.USER_SEARCH_INDEX_TTL
+
+    def build(self, blocking=True, if_needed=False):
+        if not self._build_lock.acquire(blocking=blocking):
+            return
+        try:
+            # Searches that waited for another build find it done
+            if if_needed and not self.needs_build():
+                return
+            with self._lock:
+                self._pending = []
+            # Filling the index is not part of the request that happens to trigger it
+            with uncounted_queries():
+                documents = dict(User.objects.filter(is_active=True).values_list('id', 'search_text')
+                                 .iterator(chunk_size=10000))
+            with self._lock:
+                self._postings, self._words, self._documents = {}, [], {}
+                for pk, text in documents.items():
+                    self._index(pk, text, keep_sorted=False)
+                self._words.sort()
+                # Users saved or deleted while the table was read
+                for user, active in self._pending:
+                    self._update(user, active)
+                self._pending = None
+                self.built_at = time.monotonic()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        finally:
+            self._build_lock.release()
+
+    def build_in_background(self):
+        """Start a thread building the index, unless a build is running or one started recently"""
+        with self._lock:
+            now = time.monotonic()
+            if self.build_started_at is not None and now - self.build_started_at < self.build_interval:
+                return
+            self.build_started_at = now
+        threading.Thread(target=self.run_build, name='search-index-build', daemon=True).start()
+
+    def run_build(self):
+        try:
+            self.build(blocking=False, if_needed=True)
+        except Exception:
+            logger.exception("Could not build the search index, the searches use the current one")
+        finally:
+            connections.close_all()
+
+    def _index(self, pk, text, keep_sorted=True):
+        words = text.split()
+        self._documents[pk] = words
+        for word in words:
+            if word not in self._postings:
+                self._postings[word] = set()
+                if keep_sorted:
+                    bisect.insort(self._words, word)
+                else:
+                    self._words.append(word)
+            self._postings[word].add(pk)
+
+    def _update(self, user, active):
+        if active and 'search_text' not in user.__dict__:
+            # Saved from an instance loaded without its search text, which was not saved either
+            return
+        # The words no user has any more stay, they only cost a lookup until the next build
+        for word in self._documents.pop(user.pk, ()):
+            self._postings[word].discard(user.pk)
+        if active:
+            self._index(user.pk, user.search_text)
+
+    def _record(self, users, active):
+        with self._lock:
+            for user in users:
+                if self._pending is not None:
+                    self._pending.append((user, active and user.is_active))
+                if self._postings is not None:
+                    self._update(user, active and user.is_active)
+
+    def add(self, users):
+        self._record(users, active=True)
+
+    def remove(self, users):
+        self._record(users, active=False)
+
+    def reset(self):
+        with self._lock:
+            self._postings, self._words, self._documents = None, [], {}
+            self.build_started_at = None
+
+    def prefixed(self, term):
+        start = bisect.bisect_left(self._words, term)
+        end = start
+        while end < len(self._words) and self._words[end].startswith(term):
+            end += 1
+        return self._words[start:end]
+
+    def search(self, queryset, terms):
+        if self._postings is None:
+            self.build(if_needed=True)
+        elif self.needs_build():
+            if settings.USER_SEARCH_INDEX_BACKGROUND_BUILD:
+                self.build_in_background()
+            else:
+                self.build(if_needed=True)
+        with self._lock:
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for word in self.prefixed(term):
+                    weight = 2 if word == term else 1
+                    for pk in self._postings[word]:
+                        term_scores[pk] = term_scores.get(pk, 0) + weight
+                scores = term_scores if scores is None else {pk: score + term_scores[pk]
+                                                             for pk, score in scores.items() if pk in term_scores}
+        ids = sorted(scores, key=lambda pk: (-scores[pk], pk))[:settings.USER_SEARCH_MAX_RESULTS + 1]
+        return RankedRows(queryset, ids)
+
+
+postgres_search = PostgresSearchEngine()
+search_index = InvertedIndex()
+
+
+def get_search_engine():
+    return postgres_search if connection.vendor == 'postgresql' else search_index
+
+
+@receiver(setting_changed)
+def reset_search_index(*, setting, **kwargs):
+    if setting.startswith('USER_SEARCH_'):
+        search_index.reset()
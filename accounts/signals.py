@@ -0,0 +1,69 @@
+from django.contrib.auth.models import Group
+from django.contrib.auth.signals import user_login_failed
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from core.metrics import failed_logins
+from .cache import invalidate_cached_users
+from .models import User
+from .search import search_index
+from .uniqueness import unique_values
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_cached_users([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def add_unique_values(sender, instance, created, **kwargs):
+    # Updates keeping the email and the mobile phone add no value, they would only count against the capacity
+    changed = instance.changed_values()
+    if created or changed is None or not changed.keys().isdisjoint(unique_values.fields):
+        unique_values.add([instance])
+
+
+@receiver(post_delete, sender=User)
+def remove_unique_values(sender, instance, **kwargs):
+    unique_values.remove([instance])
+
+
+@receiver(post_save, sender=User)
+def index_user_search_text(sender, instance, **kwargs):
+    search_index.add([instance])
+
+
+@receiver(post_delete, sender=User)
+def unindex_user_search_text(sender, instance, **kwargs):
+    search_index.remove([instance])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_cached_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_cached_users([instance.pk])
+    # instance is a Group or a Permission and pk_set holds user ids, clear() only tells them before running
+    elif action in ('post_add', 'post_remove'):
+        invalidate_cached_users(pk_set)
+    elif action == 'pre_clear':
+        invalidate_cached_users(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_cached_group_members(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('pre_clear', 'post_add', 'post_remove'):
+        return
+    if not reverse:
+        users = User.objects.filter(groups=instance)
+    elif action == 'pre_clear':
+        users = User.objects.filter(groups__permissions=instance)
+    else:
+        users = User.objects.filter(groups__in=pk_set)
+    invalidate_cached_users(users.values_list('pk', flat=True).distinct())
+
+
+@receiver(user_login_failed)
+def count_failed_login(sender, credentials, **kwargs):
+    failed_logins.inc()
@@ -0,0 +1,75 @@
+from unittest import mock
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from accounts.admin import UserAdmin
+from accounts.models import User
+
+
+@override_settings(ADMIN_USERS_COUNT_LIMIT=5)
+class TestUserAdmin(TestCase):
+    """Test the users changelist pages by primary key ranges, searches by index friendly matches and never counts
+    or lists the distinct values of the whole table"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin_user = User.objects.create_superuser(email='rossi@gmail.com',
+                                                        first_name='Rossi',
+                                                        last_name='Valentina',
+                                                        country='Italia',
+                                                        city='Milan',
+                                                        address='Milan Italia',
+                                                        mobile_phone='+55 101017890',
+                                                        password='PasswordStrong1234')
+        User.objects.bulk_create(User(email=f'user{number}@gmail.com', first_name='Robert',
+                                      last_name='López Pérez' if number % 2 else 'García', country='España',
+                                      city='Barcelona', address='Barcelona España',
+                                      mobile_phone=f'+34 {number:08d}', password='PasswordStrong1234')
+                                 for number in range(7))
+        self.client.force_login(self.admin_user)
+
+    def changelist(self, **params):
+        return self.client.get('/admin/accounts/user/', params)
+
+    @mock.patch.object(UserAdmin, 'list_per_page', 3)
+    def test_pages_follow_the_primary_key(self):
+        first_page = self.changelist()
+        self.assertEqual(first_page.status_code, 200)
+        second_page = self.client.get('/admin/accounts/user/' + first_page.context['cl'].next_url)
+        first_ids = [user.pk for user in first_page.context['cl'].result_list]
+        second_ids = [user.pk for user in second_page.context['cl'].result_list]
+        self.assertEqual(len(first_ids), 3)
+        self.assertEqual(len(second_ids), 3)
+        self.assertEqual(first_ids + second_ids, sorted(first_ids + second_ids))
+        self.assertContains(second_page, 'Primera página')
+        self.assertContains(second_page, 'Página siguiente')
+
+    def test_changelist_does_not_count_or_list_the_whole_table(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.changelist()
+        self.assertEqual(response.status_code, 200)
+        sql = [query['sql'] for query in queries]
+        self.assertFalse([query for query in sql if 'DISTINCT' in query and '"email"' in query])
+        self.assertFalse([query for query in sql if 'COUNT(*)' in query and 'LIMIT' not in query])
+        self.assertContains(response, 'Más de 5')
+
+    @override_settings(ADMIN_USERS_COUNT_LIMIT=3)
+    def test_count_of_exactly_the_limit_is_not_limited(self):
+        response = self.changelist(last_name_initial='L')
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertFalse(response.context['cl'].result_count_is_limited)
+        self.assertNotContains(response, 'Más de 3')
+
+    def test_search_by_email_phone_and_name(self):
+        response = self.changelist(q='USER3@gmail.com')
+        self.assertEqual([user.email for user in response.context['cl'].result_list], ['user3@gmail.com'])
+        response = self.changelist(q='+34 0000000')
+        self.assertEqual(len(response.context['cl'].result_list), 7)
+        response = self.changelist(q='garcía')
+        self.assertEqual({user.last_name for user in response.context['cl'].result_list}, {'García'})
+
+    def test_filter_by_last_name_initial(self):
+        response = self.changelist(last_name_initial='L')
+        self.assertEqual({user.last_name for user in response.context['cl'].result_list}, {'López Pérez'})
+        self.assertEqual(response.context['cl'].result_count, 3)
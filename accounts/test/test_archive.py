@@ -0,0 +1,79 @@
+import gzip
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+from accounts.archive import archive_user_history, month_start, next_month
+from accounts.models import User
+
+
+class TestArchiveUserHistory(TestCase):
+    """Test old historical records are written to the archive and deleted, recent ones are kept"""
+
+    def setUp(self):
+        self.test_user = User.objects.create(email='robert@gmail.com',
+                                             first_name='Robert',
+                                             last_name='López Pérez',
+                                             country='España',
+                                             city='Barcelona',
+                                             address='Barcelona España',
+                                             mobile_phone='+34 10101023',
+                                             password='PasswordStrong1234')
+        for city in ('Madrid', 'Sevilla', 'Valencia'):
+            self.test_user.city = city
+            self.test_user.save()
+        User.history.filter(city__in=('Barcelona', 'Madrid', 'Sevilla')).update(
+            history_date=timezone.now() - timedelta(days=400))
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.archive_dir = Path(archive_dir.name)
+
+    def test_old_history_is_archived_and_deleted(self):
+        files = archive_user_history(older_than_days=365, archive_dir=self.archive_dir, chunk_size=2,
+                                     delete_batch_size=1)
+        self.assertEqual(len(files), 2)
+        rows = []
+        for path in files:
+            with gzip.open(path, 'rt', encoding='utf-8') as archive:
+                rows.extend(json.loads(line) for line in archive)
+        self.assertEqual([row['city'] for row in rows], ['Barcelona', 'Madrid', 'Sevilla'])
+        self.assertEqual(list(self.test_user.history.values_list('city', flat=True)), ['Valencia'])
+        self.assertEqual(list(self.archive_dir.glob('*.tmp')), [])
+
+    def test_partitioned_table_deletes_the_old_rows_of_the_default_partition(self):
+        # Madrid and Sevilla are in a monthly partition, Barcelona in the default one
+        User.history.filter(city='Barcelona').update(history_date=timezone.now() - timedelta(days=800))
+        old_month = month_start(timezone.now() - timedelta(days=400))
+        partition = 'accounts_historicaluser_p{:04d}_{:02d}'.format(old_month.year, old_month.month)
+        with mock.patch('accounts.archive.is_partitioned', return_value=True), \
+                mock.patch('accounts.archive.monthly_partitions', return_value=[(partition, old_month)]), \
+                mock.patch('accounts.archive.create_monthly_partitions'), \
+                mock.patch('accounts.archive.drop_partitions') as drop_partitions:
+            archive_user_history(older_than_days=365, archive_dir=self.archive_dir)
+        drop_partitions.assert_called_once()
+        self.assertEqual(list(drop_partitions.call_args.args[0]), [partition])
+        self.assertEqual(list(self.test_user.history.values_list('city', flat=True)),
+                         ['Valencia', 'Sevilla', 'Madrid'])
+
+    def test_nothing_to_archive(self):
+        self.assertEqual(archive_user_history(older_than_days=500, archive_dir=self.archive_dir), [])
+        self.assertEqual(self.test_user.history.count(), 4)
+
+    def test_command_archives_history(self):
+        call_command('archive_user_history', older_than_days=365, archive_dir=str(self.archive_dir),
+                     stdout=StringIO())
+        self.assertEqual(self.test_user.history.count(), 1)
+
+    def test_partition_command_requires_postgresql(self):
+        with self.assertRaises(CommandError):
+            call_command('partition_user_history')
+
+    def test_next_month(self):
+        self.assertEqual(next_month(timezone.now().replace(year=2024, month=1, day=31)).month, 2)
+        self.assertEqual(next_month(timezone.now().replace(year=2024, month=12, day=15)).year, 2025)
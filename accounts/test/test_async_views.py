@@ -0,0 +1,176 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from accounts.authentication import StatelessJWTAuthentication, ClaimsUser
+from accounts.cache import local_user_cache
+from accounts.models import User
+from accounts.throttling import local_counters
+from api.serializers import MyTokenObtainPairSerializer
+from core.middleware import QueryBudgetExceeded
+
+
+class TestAsyncViews(TestCase):
+    """Test the async views answer like their sync counterparts"""
+
+    def setUp(self):
+        cache.clear()
+        local_user_cache.clear()
+        local_counters.clear()
+        self.test_user = User.objects.create(email='robert@gmail.com',
+                                             first_name='Robert',
+                                             last_name='López Pérez',
+                                             country='España',
+                                             city='Barcelona',
+                                             address='Barcelona España',
+                                             mobile_phone='+34 10101023',
+                                             password='PasswordStrong1234')
+        self.test_admin_user = User.objects.create(email='rossi@gmail.com',
+                                                   first_name='Rossi',
+                                                   last_name='Valentina',
+                                                   country='Italia',
+                                                   city='Milan',
+                                                   address='Milan Italia',
+                                                   mobile_phone='+55 101017890',
+                                                   password='PasswordStrong1234',
+                                                   is_staff=True, )
+        self.user_headers = self.authorization(self.test_user)
+        self.admin_headers = self.authorization(self.test_admin_user)
+        self.claims_token = MyTokenObtainPairSerializer.get_token(self.test_user).access_token
+        self.plain_token = RefreshToken.for_user(self.test_user).access_token
+
+    @staticmethod
+    def authorization(user):
+        return {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+    async def test_signup(self):
+        data = {
+            "first_name": "john",
+            "last_name": "doe",
+            "email": "johndoe@example.com",
+            "country": "USA",
+            "city": "New York",
+            "address": "123 Main St",
+            "mobile_phone": "+1 123456789",
+            "password": "StrongPassword123",
+        }
+        response = await self.async_client.post('/api/v1/accounts/async/users/', data=data,
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['first_name'], 'John')
+        self.assertNotIn('password', response.json())
+        user = await User.objects.aget(email='johndoe@example.com')
+        self.assertTrue(await user.acheck_password('StrongPassword123'))
+
+    async def test_signup_with_taken_email_is_rejected(self):
+        data = {"first_name": "Robert", "last_name": "Doe", "email": "robert@gmail.com", "country": "USA",
+                "city": "New York", "address": "123 Main St", "mobile_phone": "+1 123456789",
+                "password": "StrongPassword123"}
+        response = await self.async_client.post('/api/v1/accounts/async/users/', data=data,
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', response.json())
+
+    async def test_list_is_paginated_for_admins(self):
+        response = await self.async_client.get('/api/v1/accounts/async/users/?page_size=1',
+                                               headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['id'] for user in response.json()['results']], [self.test_user.id])
+        response = await self.async_client.get(response.json()['next'], headers=self.admin_headers)
+        self.assertEqual([user['id'] for user in response.json()['results']], [self.test_admin_user.id])
+        self.assertIsNone(response.json()['next'])
+        self.assertIsNotNone(response.json()['previous'])
+        response = await self.async_client.get('/api/v1/accounts/async/users/', headers=self.user_headers)
+        self.assertEqual(response.status_code, 403)
+
+    async def test_list_and_retrieve_return_the_requested_fields_only(self):
+        response = await self.async_client.get('/api/v1/accounts/async/users/?fields=id,email',
+                                               headers=self.admin_headers)
+        self.assertEqual(response.json()['results'], [{'id': self.test_user.id, 'email': 'robert@gmail.com'},
+                                                      {'id': self.test_admin_user.id, 'email': 'rossi@gmail.com'}])
+        response = await self.async_client.get(f'/api/v1/accounts/async/users/{self.test_user.id}?fields=city',
+                                               headers=self.admin_headers)
+        self.assertEqual(response.json(), {'city': 'Barcelona'})
+        response = await self.async_client.get('/api/v1/accounts/async/users/?fields=password',
+                                               headers=self.admin_headers)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_owner_retrieves_and_patches_own_user(self):
+        url = f'/api/v1/accounts/async/users/{self.test_user.id}'
+        response = await self.async_client.get(url, headers=self.user_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['email'], 'robert@gmail.com')
+        response = await self.async_client.patch(url, data={'city': 'madrid'}, content_type='application/json',
+                                                 headers=self.user_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['city'], 'Madrid')
+        await self.test_user.arefresh_from_db()
+        self.assertEqual(self.test_user.city, 'Madrid')
+        self.assertEqual(await self.test_user.history.acount(), 2)
+
+    async def test_owner_patch_does_not_save_stale_cached_values(self):
+        url = f'/api/v1/accounts/async/users/{self.test_user.id}'
+        await self.async_client.get(url, headers=self.user_headers)
+        # Changes saved without signals leave the cached authenticated user stale
+        await User.objects.filter(id=self.test_user.id).aupdate(city='Madrid')
+        response = await self.async_client.patch(url, data={'address': 'Madrid España'},
+                                                 content_type='application/json', headers=self.user_headers)
+        self.assertEqual(response.status_code, 200)
+        await self.test_user.arefresh_from_db()
+        self.assertEqual((self.test_user.city, self.test_user.address), ('Madrid', 'Madrid España'))
+
+    async def test_other_users_are_forbidden_and_missing_ones_not_found(self):
+        response = await self.async_client.get(f'/api/v1/accounts/async/users/{self.test_admin_user.id}',
+                                               headers=self.user_headers)
+        self.assertEqual(response.status_code, 403)
+        response = await self.async_client.get('/api/v1/accounts/async/users/999', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(f'/api/v1/accounts/async/users/{self.test_user.id}')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_admin_soft_deletes(self):
+        response = await self.async_client.delete(f'/api/v1/accounts/async/users/{self.test_user.id}',
+                                                  headers=self.admin_headers)
+        self.assertEqual(response.status_code, 204)
+        await self.test_user.arefresh_from_db()
+        self.assertFalse(self.test_user.is_active)
+
+    async def test_login(self):
+        response = await self.async_client.post('/api/v1/accounts/async/users/login',
+                                                data={'email': 'robert@gmail.com', 'password': 'PasswordStrong1234'},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['email'], 'robert@gmail.com')
+        self.assertEqual(response.json()['token_type'], 'Bearer')
+        response = await self.async_client.get(f'/api/v1/accounts/async/users/{self.test_user.id}',
+                                               headers={'Authorization': f"Bearer {response.json()['access_token']}"})
+        self.assertEqual(response.status_code, 200)
+
+    async def test_failed_login(self):
+        for email, password in (('robert@gmail.com', 'wrong'), ('nobody@gmail.com', 'PasswordStrong1234')):
+            response = await self.async_client.post('/api/v1/accounts/async/users/login',
+                                                    data={'email': email, 'password': password},
+                                                    content_type='application/json')
+            self.assertEqual(response.status_code, 401)
+        response = await self.async_client.post('/api/v1/accounts/async/users/login', data={'email': ''},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(LOGIN_EMAIL_MAX_ATTEMPTS=1)
+    async def test_login_is_throttled(self):
+        for status_code in (200, 429):
+            response = await self.async_client.post('/api/v1/accounts/async/users/login',
+                                                    data={'email': 'robert@gmail.com',
+                                                          'password': 'PasswordStrong1234'},
+                                                    content_type='application/json')
+            self.assertEqual(response.status_code, status_code)
+
+    @override_settings(QUERY_BUDGETS={'accounts.async_views.AsyncRetrieveUpdateDestroyUser': 0})
+    async def test_queries_of_async_views_are_counted(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            await self.async_client.get(f'/api/v1/accounts/async/users/{self.test_admin_user.id}',
+                                        headers=self.admin_headers)
+
+    async def test_stateless_authentication(self):
+        authentication = StatelessJWTAuthentication()
+        self.assertIsInstance(await authentication.aget_user(self.claims_token), ClaimsUser)
+        self.assertEqual(await authentication.aget_user(self.plain_token), self.test_user)
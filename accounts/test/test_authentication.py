@@ -0,0 +1,244 @@
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from unittest import mock
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework.test import APITestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from accounts.authentication import StatelessJWTAuthentication, ClaimsUser, api_settings
+from accounts.cache import local_user_cache, get_cached_user, user_cache_key
+from accounts.models import User
+from accounts.views import BulkCreateUsers, ListCreateUser, RetrieveUpdateDestroyUser
+from api.serializers import MyTokenObtainPairSerializer
+
+
+class TestCachedJWTAuthentication(APITestCase):
+    """Test users resolved from access tokens are cached and invalidated when they change"""
+
+    def setUp(self):
+        cache.clear()
+        local_user_cache.clear()
+        self.test_user = User.objects.create(id=1,
+                                             email='robert@gmail.com',
+                                             first_name='Robert',
+                                             last_name='López Pérez',
+                                             country='España',
+                                             city='Barcelona',
+                                             address='Barcelona España',
+                                             mobile_phone='+34 10101023',
+                                             password='PasswordStrong1234')
+        self.test_admin_user = User.objects.create(id=2,
+                                                   email='rossi@gmail.com',
+                                                   first_name='Rossi',
+                                                   last_name='Valentina',
+                                                   country='Italia',
+                                                   city='Milan',
+                                                   address='Milan Italia',
+                                                   mobile_phone='+55 101017890',
+                                                   password='PasswordStrong1234',
+                                                   is_staff=True, )
+        self.client = APIClient()
+        refresh = RefreshToken.for_user(self.test_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+
+    def test_authenticated_user_is_cached(self):
+        self.assertIsNone(get_cached_user(self.test_user.id))
+        response = self.client.get('/api/v1/accounts/users/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_cached_user(self.test_user.id), self.test_user)
+
+    def test_cached_user_saves_the_authentication_query(self):
+        self.client = APIClient()
+        refresh = RefreshToken.for_user(self.test_admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+        self.client.get('/api/v1/accounts/users/1')
+        # Only the requested user is fetched, the admin comes from the cache
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/accounts/users/1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached_user_leaves_out_the_password(self):
+        self.client.get('/api/v1/accounts/users/1')
+        entry = cache.get(user_cache_key(self.test_user.id))
+        self.assertNotIn('password', entry)
+        self.assertNotIn(self.test_user.password, entry.values())
+        user = get_cached_user(self.test_user.id)
+        self.assertEqual(user.get_deferred_fields(), {field.attname for field in User._meta.concrete_fields
+                                                      if field.attname not in entry})
+        self.assertEqual((user.email, user.is_staff, user.is_active), ('robert@gmail.com', False, True))
+
+    # override_settings(SIMPLE_JWT=...) rebinds the simplejwt settings, the modules that imported them never see it
+    @mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True)
+    def test_cached_user_passes_the_revoke_token_check(self):
+        refresh = RefreshToken.for_user(self.test_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+        self.client.get('/api/v1/accounts/users/1')
+        self.assertNotIn(self.test_user.password, cache.get(user_cache_key(self.test_user.id)).values())
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/accounts/users/1')
+        self.assertEqual(response.status_code, 200)
+        self.test_user.set_password('OtherPassword1234')
+        self.test_user.save()
+        response = self.client.get('/api/v1/accounts/users/1')
+        self.assertEqual(response.status_code, 401)
+
+    def test_cached_user_is_a_copy(self):
+        self.client.get('/api/v1/accounts/users/1')
+        user = get_cached_user(self.test_user.id)
+        user.first_name = 'Changed'
+        self.assertEqual(get_cached_user(self.test_user.id).first_name, 'Robert')
+
+    def test_save_invalidates_cached_user(self):
+        self.client.get('/api/v1/accounts/users/1')
+        self.test_user.is_staff = True
+        self.test_user.save()
+        self.assertIsNone(get_cached_user(self.test_user.id))
+        response = self.client.get('/api/v1/accounts/users/2')
+        self.assertEqual(response.status_code, 200)
+
+    def test_soft_deleted_user_is_rejected(self):
+        self.client.get('/api/v1/accounts/users/1')
+        admin_client = APIClient()
+        refresh = RefreshToken.for_user(self.test_admin_user)
+        admin_client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+        response = admin_client.delete('/api/v1/accounts/users/1')
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get('/api/v1/accounts/users/1')
+        self.assertEqual(response.status_code, 401)
+
+    def test_permission_changes_invalidate_cached_user(self):
+        group = Group.objects.create(name='support')
+        permission = Permission.objects.get(codename='view_user')
+        self.client.get('/api/v1/accounts/users/1')
+        self.test_user.user_permissions.add(permission)
+        self.assertIsNone(get_cached_user(self.test_user.id))
+
+        self.client.get('/api/v1/accounts/users/1')
+        group.user_set.add(self.test_user)
+        self.assertIsNone(get_cached_user(self.test_user.id))
+
+        self.client.get('/api/v1/accounts/users/1')
+        group.permissions.add(permission)
+        self.assertIsNone(get_cached_user(self.test_user.id))
+
+        self.client.get('/api/v1/accounts/users/1')
+        group.user_set.clear()
+        self.assertIsNone(get_cached_user(self.test_user.id))
+
+
+class TestStatelessJWTAuthentication(APITestCase):
+    """Test the request user is built from the token claims while they are fresh"""
+
+    def setUp(self):
+        cache.clear()
+        local_user_cache.clear()
+        self.test_user = User.objects.create(email='robert@gmail.com',
+                                             first_name='Robert',
+                                             last_name='López Pérez',
+                                             country='España',
+                                             city='Barcelona',
+                                             address='Barcelona España',
+                                             mobile_phone='+34 10101023',
+                                             password='PasswordStrong1234')
+        self.authentication = StatelessJWTAuthentication()
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        user, _ = self.authentication.authenticate(request)
+        return user
+
+    def login(self):
+        return MyTokenObtainPairSerializer.get_token(self.test_user).access_token
+
+    def test_token_carries_user_claims(self):
+        token = self.login()
+        self.assertEqual(token['email'], 'robert@gmail.com')
+        self.assertFalse(token['is_staff'])
+        self.assertTrue(token['is_active'])
+        self.assertIn('claims_at', token)
+
+    def test_fresh_claims_authenticate_without_queries(self):
+        token = self.login()
+        with self.assertNumQueries(0):
+            user = self.authenticate(token)
+        self.assertIsInstance(user, ClaimsUser)
+        self.assertEqual(user.pk, self.test_user.pk)
+        self.assertEqual(user.email, 'robert@gmail.com')
+        self.assertFalse(user.is_staff)
+
+    def test_token_without_claims_falls_back_to_database(self):
+        token = RefreshToken.for_user(self.test_user).access_token
+        user = self.authenticate(token)
+        self.assertIsInstance(user, User)
+
+    def test_role_change_falls_back_to_database(self):
+        token = self.login()
+        self.test_user.is_staff = True
+        self.test_user.save()
+        user = self.authenticate(token)
+        self.assertIsInstance(user, User)
+        self.assertTrue(user.is_staff)
+
+    def test_soft_deleted_user_is_rejected(self):
+        token = self.login()
+        self.test_user.is_active = False
+        self.test_user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+
+    @override_settings(USER_AUTH_CLAIMS_MAX_AGE=-1)
+    def test_claims_older_than_max_age_fall_back_to_database(self):
+        token = self.login()
+        self.assertIsInstance(self.authenticate(token), User)
+
+    def test_history_records_claims_user_as_history_user(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.login()}')
+        with mock.patch.object(RetrieveUpdateDestroyUser, 'authentication_classes', [StatelessJWTAuthentication]):
+            response = self.client.patch(f'/api/v1/accounts/users/{self.test_user.id}', data={'city': 'Madrid'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.test_user.history.first().history_user_id, self.test_user.id)
+
+    def admin_client(self):
+        admin = User.objects.create(email='rossi@gmail.com', first_name='Rossi', last_name='Valentina',
+                                    country='Italia', city='Milan', address='Milan Italia',
+                                    mobile_phone='+55 101017890', password='PasswordStrong1234', is_staff=True)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {MyTokenObtainPairSerializer.get_token(admin).access_token}')
+        return client, admin
+
+    def test_bulk_create_records_claims_user_as_history_user(self):
+        client, admin = self.admin_client()
+        data = [{'first_name': 'John', 'last_name': 'Doe', 'email': 'johndoe@example.com', 'country': 'USA',
+                 'city': 'New York', 'address': '123 Main St', 'mobile_phone': '+1 123456789',
+                 'password': 'StrongPassword123'}]
+        with mock.patch.object(BulkCreateUsers, 'authentication_classes', [StatelessJWTAuthentication]):
+            response = client.post('/api/v1/accounts/users/bulk', data, format='json')
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(email='johndoe@example.com')
+        self.assertEqual(user.history.get().history_user_id, admin.id)
+
+    def test_put_and_delete_record_claims_user_as_history_user(self):
+        client, admin = self.admin_client()
+        url = f'/api/v1/accounts/users/{self.test_user.id}'
+        data = {'first_name': 'Robert', 'last_name': 'López Pérez', 'email': 'robert@gmail.com',
+                'country': 'España', 'city': 'Sevilla', 'address': 'Sevilla España', 'mobile_phone': '+34 10101023',
+                'password': 'StrongPassword1234'}
+        with mock.patch.object(RetrieveUpdateDestroyUser, 'authentication_classes', [StatelessJWTAuthentication]):
+            self.assertEqual(client.put(url, data=data).status_code, 200)
+            self.assertEqual(client.delete(url).status_code, 204)
+        self.assertEqual(list(self.test_user.history.order_by('history_id')[1:].values_list('history_user_id',
+                                                                                           flat=True)),
+                         [admin.id, admin.id])
+
+    def test_listing_and_signup_work_with_claims_users(self):
+        client, admin = self.admin_client()
+        data = {'first_name': 'John', 'last_name': 'Doe', 'email': 'johndoe@example.com', 'country': 'USA',
+                'city': 'New York', 'address': '123 Main St', 'mobile_phone': '+1 123456789',
+                'password': 'StrongPassword123'}
+        with mock.patch.object(ListCreateUser, 'authentication_classes', [StatelessJWTAuthentication]):
+            self.assertEqual(client.get('/api/v1/accounts/users/').status_code, 200)
+            self.assertEqual(client.post('/api/v1/accounts/users/', data=data).status_code, 201)
+        self.assertEqual(User.objects.get(email='johndoe@example.com').history.get().history_user_id, admin.id)
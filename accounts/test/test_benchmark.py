@@ -0,0 +1,52 @@
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from accounts.cache import local_user_cache
+from accounts.models import User
+
+
+class TestBenchmarkAccounts(TestCase):
+    """Smoke test of the benchmark commands, every scenario runs and the benchmark data is rolled back"""
+
+    def setUp(self):
+        cache.clear()
+        local_user_cache.clear()
+
+    def test_benchmark_writes_results_and_rolls_back(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'results.json'
+            call_command('benchmark_accounts', requests=2, allocation_requests=1, list_rows=[5],
+                         output=str(output), stdout=StringIO())
+            report = json.loads(output.read_text())
+            stdout = StringIO()
+            call_command('benchmark_accounts', requests=2, allocation_requests=0, scenarios=['retrieve'],
+                         compare=str(output), stdout=stdout)
+        self.assertEqual([result['scenario'] for result in report['results']],
+                         ['signup', 'login', 'retrieve', 'patch', 'delete', 'list'])
+        self.assertEqual(report['results'][-1]['rows'], 5)
+        self.assertGreater(report['results'][2]['requests_per_second'], 0)
+        self.assertIn('retrieve', stdout.getvalue().split('Compared with')[1])
+        self.assertEqual(User.objects.count(), 0)
+
+    def test_async_load_test_compares_sync_and_async(self):
+        stdout = StringIO()
+        call_command('benchmark_async_views', requests=2, concurrency=2, scenarios=['retrieve', 'list'],
+                     stdout=stdout)
+        self.assertIn('retrieve   async/sync', stdout.getvalue())
+        self.assertIn('list       async/sync', stdout.getvalue())
+        self.assertEqual(User.objects.count(), 0)
+
+    def test_admin_benchmark_compares_keyset_and_stock_changelists(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'results.json'
+            call_command('benchmark_admin', rows=60, requests=1, output=str(output), stdout=StringIO())
+            report = json.loads(output.read_text())
+        self.assertEqual({(result['scenario'], result['admin']) for result in report['results']},
+                         {(scenario, admin) for scenario in ('first_page', 'deep_page', 'search_email',
+                                                             'search_name', 'filter')
+                          for admin in ('keyset', 'stock')})
+        self.assertEqual(User.objects.count(), 0)
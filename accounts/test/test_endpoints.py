@@ -1,8 +1,13 @@
 from rest_framework.test import APITestCase
 from rest_framework.test import APIClient
 from rest_framework_simplejwt.tokens import RefreshToken
+from accounts import bulk
 from accounts.models import User
 from collections import OrderedDict
+from unittest import mock
+import json
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 
 class TestListCreateUser(APITestCase):
@@ -282,7 +287,7 @@ class TestListCreateUser(APITestCase):
     def test_get_request_return_correct_data(self):
         response = self.client.get('/api/v1/accounts/users/')
         self.assertEqual(User.objects.count(), 1)
-        self.assertEqual(response.data, [OrderedDict({'id': self.test_user.id,
+        self.assertEqual(response.data['results'], [OrderedDict({'id': self.test_user.id,
                                                       'first_name': self.test_user.first_name,
                                                       'last_name': self.test_user.last_name,
                                                       'email': self.test_user.email,
@@ -293,6 +298,65 @@ class TestListCreateUser(APITestCase):
                                                       'is_admin_user': self.test_user.is_staff,
                                                       })])
 
+    def test_get_request_is_paginated_with_cursor(self):
+        for number in range(5):
+            User.objects.create(email=f'user{number}@gmail.com',
+                                first_name='User',
+                                last_name='Test',
+                                country='Cuba',
+                                city='La Habana',
+                                address='Habana Cuba',
+                                mobile_phone=f'+53 5000000{number}',
+                                password='PasswordStrong1234')
+        response = self.client.get('/api/v1/accounts/users/', {'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.data)
+        ids = [user['id'] for user in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [user['id'] for user in response.data['results']]
+        self.assertEqual(ids, list(User.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_get_request_returns_the_requested_fields_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/accounts/users/', {'fields': 'id,first_name, city'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [{'id': self.test_user.id,
+                                                     'first_name': self.test_user.first_name,
+                                                     'city': self.test_user.city}])
+        listing_sql = queries[-1]['sql']
+        self.assertIn('"city"', listing_sql)
+        self.assertNotIn('"email"', listing_sql)
+        self.assertNotIn('"address"', listing_sql)
+
+    def test_get_request_sparse_fields_follow_the_cursor(self):
+        for number in range(3):
+            User.objects.create(email=f'user{number}@gmail.com',
+                                first_name='User',
+                                last_name='Test',
+                                country='Cuba',
+                                city='La Habana',
+                                address='Habana Cuba',
+                                mobile_phone=f'+53 5000000{number}',
+                                password='PasswordStrong1234')
+        response = self.client.get('/api/v1/accounts/users/', {'fields': 'email', 'ordering': '-date_joined',
+                                                               'page_size': 2})
+        emails = [user['email'] for user in response.data['results']]
+        response = self.client.get(response.data['next'])
+        emails += [user['email'] for user in response.data['results']]
+        self.assertEqual(emails, ['user2@gmail.com', 'user1@gmail.com', 'user0@gmail.com', 'robert@gmail.com'])
+
+    def test_get_request_unknown_field_returns_400(self):
+        for fields in ['id,password', 'groups', ',']:
+            response = self.client.get('/api/v1/accounts/users/', {'fields': fields})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(list(response.data), ['fields'])
+
+    def test_get_request_page_size_is_capped(self):
+        response = self.client.get('/api/v1/accounts/users/', {'page_size': 100000})
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.data['results']), 500)
+
 
 class TestRetrieveUpdateDestroyUser(APITestCase):
     """Test /api/v1/accounts/users/{id_user} endpoint, check responses and permissions"""
@@ -339,6 +403,23 @@ class TestRetrieveUpdateDestroyUser(APITestCase):
         response = self.client.get('/api/v1/accounts/users/2')
         self.assertEqual(response.status_code, 403)
 
+    def test_get_request_non_owner_is_rejected_before_any_query(self):
+        self.client = APIClient()
+        refresh = RefreshToken.for_user(self.test_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+        self.client.get('/api/v1/accounts/users/1')
+        # The authenticated user is cached after the first request, no query is left for the 403
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/accounts/users/2')
+        self.assertEqual(response.status_code, 403)
+
+    def test_get_request_non_owner_gets_403_for_missing_user(self):
+        self.client = APIClient()
+        refresh = RefreshToken.for_user(self.test_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+        response = self.client.get('/api/v1/accounts/users/999')
+        self.assertEqual(response.status_code, 403)
+
     def test_get_request_access_authenticated_admin_user_returns_200(self):
         """Test that an administrator user is able to access all users"""
         response = self.client.get('/api/v1/accounts/users/1')
@@ -463,6 +544,95 @@ class TestRetrieveUpdateDestroyUser(APITestCase):
         user = User.objects.filter(email__exact="robert@gmail.com").first()
         self.assertFalse(user.is_active)
 
+    def owner_client(self):
+        client = APIClient()
+        refresh = RefreshToken.for_user(self.test_user)
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+        return client
+
+    def test_get_request_returns_the_requested_fields_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/accounts/users/1', {'fields': 'id,email,is_admin_user'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'id': 1, 'email': 'robert@gmail.com', 'is_admin_user': False})
+        user_sql = queries[-1]['sql']
+        self.assertIn('"is_staff"', user_sql)
+        self.assertNotIn('"password"', user_sql)
+        self.assertNotIn('"first_name"', user_sql)
+
+    def test_get_request_owner_gets_the_requested_fields_only(self):
+        response = self.owner_client().get('/api/v1/accounts/users/1', {'fields': 'first_name'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'first_name': 'Robert'})
+
+    def test_get_request_unknown_field_returns_400(self):
+        response = self.client.get('/api/v1/accounts/users/1', {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_request_owner_reuses_authenticated_user(self):
+        client = self.owner_client()
+        # Only the authentication SELECT, the user is not fetched twice
+        with self.assertNumQueries(1):
+            response = client.get('/api/v1/accounts/users/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['email'], 'robert@gmail.com')
+
+    def test_get_request_admin_fetches_other_user(self):
+        # Authentication SELECT and the requested user SELECT
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/accounts/users/1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_patch_request_owner_fetches_user(self):
+        client = self.owner_client()
+        # Authentication SELECT, user SELECT, UPDATE and the history INSERT
+        with self.assertNumQueries(4):
+            response = client.patch('/api/v1/accounts/users/1', data={"address": "Madrid España"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(User.objects.get(id=1).address, 'Madrid España')
+
+    def test_put_request_owner_fetches_user(self):
+        data = {
+            "first_name": "Robertico JR",
+            "last_name": "López Pérez",
+            "email": "robert@gmail.com",
+            "country": "España",
+            "city": "Barcelona",
+            "address": "Barcelona España",
+            "mobile_phone": "+34 99999999",
+            "password": "StrongPassword1234",
+        }
+        client = self.owner_client()
+        # Authentication SELECT, user SELECT, email and mobile phone unique checks, UPDATE and the history INSERT
+        with self.assertNumQueries(6):
+            response = client.put('/api/v1/accounts/users/1', data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(User.objects.get(id=1).first_name, 'Robertico Jr')
+
+    def test_patch_request_owner_does_not_save_stale_cached_values(self):
+        client = self.owner_client()
+        client.get('/api/v1/accounts/users/1')
+        # Changes saved without signals leave the cached authenticated user stale
+        User.objects.filter(id=1).update(city='Madrid')
+        response = client.patch('/api/v1/accounts/users/1', data={"address": "Madrid España"})
+        self.assertEqual(response.status_code, 200)
+        user = User.objects.get(id=1)
+        self.assertEqual((user.city, user.address), ('Madrid', 'Madrid España'))
+
+    def test_patch_request_owner_does_not_restore_deleted_user(self):
+        client = self.owner_client()
+        client.get('/api/v1/accounts/users/1')
+        User.objects.filter(id=1).update(is_active=False)
+        response = client.patch('/api/v1/accounts/users/1', data={"address": "Madrid España"})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(User.objects.get(id=1).is_active)
+
+    def test_delete_request_admin_on_own_record_fetches_user(self):
+        response = self.client.delete('/api/v1/accounts/users/2')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(User.objects.get(id=2).is_active)
+
+
 class TestLoginUser(APITestCase):
     """Test /api/v1/accounts/users/login endpoint, check responses and correct login credentials"""
 
@@ -509,6 +679,15 @@ class TestLoginUser(APITestCase):
             'token_type': 'Bearer'
         })
 
+    def test_post_request_email_is_case_insensitive(self):
+        data = {
+            "email": "Robert@GMAIL.com",
+            "password": "PasswordStrong1234"
+        }
+        response = self.client.post('/api/v1/accounts/users/login', data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user']['email'], 'robert@gmail.com')
+
     def test_post_request_invalid_user_credentials_email(self):
         data = {
             "email": "wrongemail@gmail.com",
@@ -524,3 +703,251 @@ class TestLoginUser(APITestCase):
         }
         response = self.client.post('/api/v1/accounts/users/login', data=data)
         self.assertEqual(response.status_code, 401)
+
+
+class TestExportUsers(APITestCase):
+    """Test /api/v1/accounts/users/export endpoint, check permissions and NDJSON streaming"""
+
+    def setUp(self):
+        self.test_admin_user = User.objects.create(email='rossi@gmail.com',
+                                                   first_name='Rossi',
+                                                   last_name='Valentina',
+                                                   country='Italia',
+                                                   city='Milan',
+                                                   address='Milan Italia',
+                                                   mobile_phone='+55 101017890',
+                                                   password='PasswordStrong1234',
+                                                   is_staff=True, )
+        self.test_user = User.objects.create(email='robert@gmail.com',
+                                             first_name='Robert',
+                                             last_name='López Pérez',
+                                             country='España',
+                                             city='Barcelona',
+                                             address='Barcelona España',
+                                             mobile_phone='+34 10101023',
+                                             password='PasswordStrong1234')
+        self.client = APIClient()
+        refresh = RefreshToken.for_user(self.test_admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+
+    def test_get_request_access_non_admin_user_returns_403(self):
+        self.client = APIClient()
+        refresh = RefreshToken.for_user(self.test_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+        response = self.client.get('/api/v1/accounts/users/export')
+        self.assertEqual(response.status_code, 403)
+
+    def test_get_request_streams_one_json_object_per_active_user(self):
+        inactive_user = User.objects.create(email='migue@gmail.com',
+                                            first_name='Miguel',
+                                            last_name='Perez',
+                                            country='Cuba',
+                                            city='La Habana',
+                                            address='Habana Cuba',
+                                            mobile_phone='+53 51234567',
+                                            password='PasswordStrong1234',
+                                            is_active=False)
+        response = self.client.get('/api/v1/accounts/users/export')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['id'] for row in rows], [self.test_admin_user.id, self.test_user.id])
+        self.assertNotIn(inactive_user.id, [row['id'] for row in rows])
+        self.assertEqual(rows[1], {'id': self.test_user.id,
+                                   'first_name': 'Robert',
+                                   'last_name': 'López Pérez',
+                                   'email': 'robert@gmail.com',
+                                   'country': 'España',
+                                   'city': 'Barcelona',
+                                   'address': 'Barcelona España',
+                                   'mobile_phone': '+34 10101023',
+                                   'is_admin_user': False,
+                                   })
+
+
+class TestBulkCreateUsers(APITestCase):
+    """Test /api/v1/accounts/users/bulk endpoint, check per item results, history and query count"""
+
+    def setUp(self):
+        self.test_admin_user = User.objects.create(email='rossi@gmail.com',
+                                                   first_name='Rossi',
+                                                   last_name='Valentina',
+                                                   country='Italia',
+                                                   city='Milan',
+                                                   address='Milan Italia',
+                                                   mobile_phone='+55 101017890',
+                                                   password='PasswordStrong1234',
+                                                   is_staff=True, )
+        self.client = APIClient()
+        refresh = RefreshToken.for_user(self.test_admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+
+    @staticmethod
+    def build_users(count, start=0):
+        return [{
+            "first_name": "john",
+            "last_name": "DOE",
+            "email": f"john{number}@EXAMPLE.com",
+            "country": "USA",
+            "city": "New York",
+            "address": "123 Main St",
+            "mobile_phone": f"+1 1234567{number:02d}",
+            "password": "StrongPassword123",
+        } for number in range(start, start + count)]
+
+    def test_post_request_access_unauthenticated_user_returns_401(self):
+        response = APIClient().post('/api/v1/accounts/users/bulk', data=self.build_users(1), format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_post_request_creates_all_users_with_history(self):
+        response = self.client.post('/api/v1/accounts/users/bulk', data=self.build_users(3), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['status'] for result in response.data], [201, 201, 201])
+        user = User.objects.get(email='john0@example.com')
+        self.assertEqual(response.data[0]['user']['id'], user.id)
+        self.assertEqual((user.first_name, user.last_name, user.username), ('John', 'Doe', 'John'))
+        self.assertTrue(user.check_password('StrongPassword123'))
+        self.assertEqual(user.history.count(), 1)
+        self.assertEqual(user.history.first().history_user, self.test_admin_user)
+
+    def test_post_request_returns_per_item_errors(self):
+        users = self.build_users(3)
+        users[1]['email'] = 'rossi@gmail.com'
+        users[2]['mobile_phone'] = users[0]['mobile_phone']
+        users.append({'email': 'email'})
+        response = self.client.post('/api/v1/accounts/users/bulk', data=users, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.data], [201, 400, 400, 400])
+        self.assertIn('email', response.data[1]['errors'])
+        self.assertIn('mobile_phone', response.data[2]['errors'])
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_post_request_where_every_item_fails_returns_400(self):
+        users = self.build_users(2)
+        users[0]['email'] = 'rossi@gmail.com'
+        users[1]['password'] = '123'
+        response = self.client.post('/api/v1/accounts/users/bulk', data=users, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['status'] for result in response.data], [400, 400])
+
+    def test_post_request_reports_values_taken_during_the_request(self):
+        original_make_passwords = bulk.make_passwords
+
+        def make_passwords_while_another_signup(raw_passwords):
+            # Another request creates a user with the email of the second item after the uniqueness check
+            User.objects.create(email='john1@example.com', first_name='Jane', last_name='Smith', country='Canada',
+                                city='Toronto', address='456 Maple Ave', mobile_phone='+0 9876543210',
+                                password='PasswordStrong1234')
+            return original_make_passwords(raw_passwords)
+
+        with mock.patch('accounts.bulk.make_passwords', side_effect=make_passwords_while_another_signup):
+            response = self.client.post('/api/v1/accounts/users/bulk', data=self.build_users(3), format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.data], [201, 400, 201])
+        self.assertIn('email', response.data[1]['errors'])
+        self.assertEqual(User.objects.filter(first_name='John').count(), 2)
+
+    def test_post_request_accepts_ndjson(self):
+        body = "\n".join(json.dumps(user) for user in self.build_users(2))
+        response = self.client.post('/api/v1/accounts/users/bulk', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(User.objects.count(), 3)
+
+    def test_post_request_rejects_non_list_body(self):
+        response = self.client.post('/api/v1/accounts/users/bulk', data=self.build_users(1)[0], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_post_request_query_count_does_not_grow_with_batch_size(self):
+        with CaptureQueriesContext(connection) as small_batch:
+            self.client.post('/api/v1/accounts/users/bulk', data=self.build_users(2), format='json')
+        with CaptureQueriesContext(connection) as large_batch:
+            self.client.post('/api/v1/accounts/users/bulk', data=self.build_users(40, start=2), format='json')
+        self.assertEqual(User.objects.count(), 43)
+        self.assertLessEqual(len(large_batch), len(small_batch))
+
+
+class TestListUsersFilters(APITestCase):
+    """Test the filters and orderings of the /api/v1/accounts/users/ listing"""
+
+    def setUp(self):
+        self.test_user = User.objects.create_superuser(email='robert@gmail.com',
+                                                       first_name='Robert',
+                                                       last_name='López Pérez',
+                                                       country='España',
+                                                       city='Barcelona',
+                                                       address='Barcelona España',
+                                                       mobile_phone='+34 10101023',
+                                                       password='PasswordStrong1234')
+        self.other_users = [User.objects.create(email=f'user{number}@gmail.com',
+                                                first_name='User',
+                                                last_name='Test',
+                                                country='Cuba',
+                                                city='La Habana' if number % 2 else 'Santiago',
+                                                address='Habana Cuba',
+                                                mobile_phone=f'+53 5000000{number}',
+                                                password='PasswordStrong1234')
+                            for number in range(4)]
+        self.client = APIClient()
+        refresh = RefreshToken.for_user(self.test_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+
+    def listed_ids(self, params, url='/api/v1/accounts/users/'):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [user['id'] for user in response.data['results']]
+
+    def test_filter_by_country_and_city(self):
+        self.assertEqual(self.listed_ids({'country': 'cuba'}), [user.id for user in self.other_users])
+        self.assertEqual(self.listed_ids({'country': 'Cuba', 'city': 'la habana'}),
+                         [self.other_users[1].id, self.other_users[3].id])
+
+    def test_filter_by_name_prefix(self):
+        self.assertEqual(self.listed_ids({'name': 'lópez'}), [self.test_user.id])
+        self.assertEqual(self.listed_ids({'name': 'Rob'}), [self.test_user.id])
+        self.assertEqual(self.listed_ids({'name': 'Pérez'}), [])
+
+    def test_filter_by_is_staff(self):
+        self.assertEqual(self.listed_ids({'is_staff': 'true'}), [self.test_user.id])
+        self.assertEqual(self.listed_ids({'is_staff': '0'}), [user.id for user in self.other_users])
+
+    def test_filter_by_date_joined(self):
+        User.objects.filter(pk=self.test_user.pk).update(date_joined='2020-01-15T10:00:00Z')
+        self.assertEqual(self.listed_ids({'joined_before': '2021-01-01'}), [self.test_user.id])
+        self.assertEqual(self.listed_ids({'joined_after': '2020-01-15T10:00:00Z', 'joined_before': '2020-01-16'}),
+                         [self.test_user.id])
+        self.assertEqual(self.listed_ids({'joined_after': '2021-01-01'}), [user.id for user in self.other_users])
+
+    def test_unknown_filter_returns_400(self):
+        response = self.client.get('/api/v1/accounts/users/', {'email__icontains': 'gmail'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data), ['email__icontains'])
+
+    def test_city_without_country_returns_400(self):
+        response = self.client.get('/api/v1/accounts/users/', {'city': 'La Habana'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data), ['city'])
+
+    def test_invalid_filter_values_return_400(self):
+        response = self.client.get('/api/v1/accounts/users/', {'joined_after': 'ayer', 'is_staff': 'quizás',
+                                                               'name': ' '})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(response.data), ['is_staff', 'joined_after', 'name'])
+
+    def test_ordering_by_date_joined_follows_the_cursor(self):
+        for number, user in enumerate([self.test_user, *self.other_users]):
+            User.objects.filter(pk=user.pk).update(date_joined=f'2020-01-0{number + 1}T10:00:00Z')
+        response = self.client.get('/api/v1/accounts/users/', {'ordering': '-date_joined', 'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        ids = [user['id'] for user in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [user['id'] for user in response.data['results']]
+        self.assertEqual(ids, [user.id for user in reversed([self.test_user, *self.other_users])])
+
+    def test_async_listing_applies_the_same_filters(self):
+        self.assertEqual(self.listed_ids({'country': 'Cuba', 'city': 'Santiago'}, url='/api/v1/accounts/async/users/'),
+                         [self.other_users[0].id, self.other_users[2].id])
+        response = self.client.get('/api/v1/accounts/async/users/', {'country__contains': 'Cu'})
+        self.assertEqual(response.status_code, 400)
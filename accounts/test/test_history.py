@@ -0,0 +1,110 @@
+import time
+from unittest import mock
+from django.db import OperationalError
+from django.db.models.query import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from accounts.history import HistoryWriter, history_writer
+from accounts.models import User
+
+
+def build_user(number=0):
+    return User(email=f'user{number}@gmail.com',
+                first_name='Robert',
+                last_name='López Pérez',
+                country='España',
+                city='Barcelona',
+                address='Barcelona España',
+                mobile_phone=f'+34 1010102{number}',
+                password='PasswordStrong1234')
+
+
+@override_settings(HISTORY_BUFFERED_WRITES=True)
+class TestBufferedHistoricalRecords(TestCase):
+    """Test historical records are queued after commit and written when the writer flushes"""
+
+    def setUp(self):
+        patcher = mock.patch.object(history_writer, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(history_writer.flush)
+
+    def test_history_is_written_on_flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user = build_user()
+            user.save()
+            user.city = 'Madrid'
+            user.save()
+        self.assertEqual(User.history.count(), 0)
+        self.assertEqual(history_writer.qsize(), 2)
+        history_writer.flush()
+        self.assertEqual([record.history_type for record in user.history.order_by('history_date')], ['+', '~'])
+        self.assertEqual(user.history.latest().city, 'Madrid')
+
+    def test_history_is_not_queued_when_transaction_rolls_back(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            build_user().save()
+        self.assertEqual(history_writer.qsize(), 0)
+
+    @override_settings(HISTORY_BUFFERED_WRITES=False)
+    def test_history_is_written_in_the_request_when_disabled(self):
+        user = build_user()
+        user.save()
+        self.assertEqual(user.history.count(), 1)
+
+    def test_full_queue_writes_in_the_caller(self):
+        writer = HistoryWriter(batch_size=10, flush_interval=1, max_size=1)
+        with mock.patch.object(writer, 'start'), mock.patch('accounts.history.history_writer', writer):
+            with self.captureOnCommitCallbacks(execute=True):
+                build_user(1).save()
+                build_user(2).save()
+            self.assertEqual(writer.qsize(), 1)
+            self.assertEqual(User.history.count(), 1)
+
+    def test_failed_batch_is_written_again(self):
+        original_bulk_create = QuerySet.bulk_create
+        calls = []
+
+        def failing_once(queryset, *args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OperationalError("server closed the connection unexpectedly")
+            return original_bulk_create(queryset, *args, **kwargs)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            build_user(1).save()
+            build_user(2).save()
+        with mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=failing_once):
+            history_writer.flush()
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(User.history.count(), 2)
+
+    def test_rows_of_a_failing_batch_are_written_one_by_one(self):
+        original_bulk_create = QuerySet.bulk_create
+
+        def failing_batches(queryset, objs, *args, **kwargs):
+            if len(objs) > 1:
+                raise OperationalError("server closed the connection unexpectedly")
+            return original_bulk_create(queryset, objs, *args, **kwargs)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            build_user(1).save()
+            build_user(2).save()
+        with mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=failing_batches):
+            history_writer.flush()
+        self.assertEqual(User.history.count(), 2)
+
+
+@override_settings(HISTORY_BUFFERED_WRITES=True)
+class TestHistoryWriterThread(TransactionTestCase):
+    """Test the background thread writes the queued rows in batches"""
+
+    def test_background_thread_flushes_batches(self):
+        writer = HistoryWriter(batch_size=2, flush_interval=0.05, max_size=100)
+        with mock.patch('accounts.history.history_writer', writer):
+            for number in range(3):
+                build_user(number).save()
+        deadline = time.monotonic() + 5
+        while User.history.count() < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        writer.stop()
+        self.assertEqual(User.history.count(), 3)
@@ -0,0 +1,78 @@
+import re
+from unittest import skipUnless
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase
+from accounts.models import User
+from accounts.pagination import UserCursorPagination
+from accounts.search import postgres_search
+from api.serializers import USER_FIELD_COLUMNS
+
+# A sequential scan of the users table in the EXPLAIN output of PostgreSQL or SQLite
+SEQUENTIAL_SCAN = re.compile(r'Seq Scan on accounts_user\b|\bSCAN (TABLE )?accounts_user\b(?! USING)')
+
+
+class TestQueryPlans(TestCase):
+    """Test the main queries of the users endpoints and the admin are served by their index, the EXPLAIN output must
+    name it and not show a sequential scan of the users table. PostgreSQL is told to avoid sequential scans, with the
+    few rows of a test table it would prefer them. It then falls back to a full scan of the primary key index when
+    an index is missing, which is why the plan has to name the expected one."""
+
+    def setUp(self):
+        User.objects.bulk_create(User(email=f'user{number}@gmail.com', first_name='Robert',
+                                      last_name='López Pérez', country='España', city='Barcelona',
+                                      address='Barcelona España', mobile_phone=f'+34 {number:08d}',
+                                      password='PasswordStrong1234', is_active=number % 10 != 0)
+                                 for number in range(200))
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE accounts_user')
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, *indexes):
+        """Every pattern of indexes must match an index of the plan, alternatives are separated by |"""
+        plan = queryset.explain()
+        self.assertIsNone(SEQUENTIAL_SCAN.search(plan), plan)
+        for index in indexes:
+            self.assertRegex(plan, rf'\b({index})\b')
+
+    def test_listing_pages(self):
+        page_size = UserCursorPagination.page_size
+        active_users = User.objects.filter(is_active=True).order_by('id').values(*USER_FIELD_COLUMNS)
+        self.assertUsesIndex(active_users[:page_size + 1], 'accounts_user_active_id_idx')
+        self.assertUsesIndex(active_users.filter(id__gt=100)[:page_size + 1], 'accounts_user_active_id_idx')
+
+    def test_retrieve_and_login(self):
+        self.assertUsesIndex(User.objects.filter(is_active=True, id=10).only(*USER_FIELD_COLUMNS),
+                             'accounts_user_pkey|accounts_user_active_id_idx|INTEGER PRIMARY KEY')
+        # The unique index of the email, named by the database
+        self.assertUsesIndex(User.objects.filter(email='User10@gmail.com'),
+                             r'accounts_user_email_\w+|sqlite_autoindex_accounts_user_\d+')
+
+    def test_admin_country_filter(self):
+        self.assertUsesIndex(User.objects.filter(country='España').order_by('id')[:101],
+                             'accounts_user_country_city_idx')
+        self.assertUsesIndex(User.objects.filter(country='España', city='Barcelona').order_by('id')[:101],
+                             'accounts_user_country_city_idx')
+
+    def test_listing_filters(self):
+        page_size = UserCursorPagination.page_size
+        active_users = User.objects.filter(is_active=True)
+        self.assertUsesIndex(active_users.filter(is_staff=True).order_by('id')[:page_size + 1],
+                             'accounts_user_active_staff_idx')
+        self.assertUsesIndex(active_users.filter(date_joined__gte='2020-01-01').order_by('-date_joined')
+                             [:page_size + 1], 'accounts_user_joined_idx')
+        self.assertUsesIndex(active_users.filter(country='España', city='Barcelona').order_by('id')[:page_size + 1],
+                             'accounts_user_country_city_idx')
+
+    # SQLite runs LIKE case insensitively, it can not use the indexes of the names
+    @skipUnless(connection.vendor == 'postgresql', "Prefix indexes need PostgreSQL")
+    def test_admin_name_prefix_search(self):
+        self.assertUsesIndex(User.objects.filter(Q(last_name__startswith='Ló') | Q(first_name__startswith='Ló'))
+                             .order_by('id')[:101], 'accounts_user_last_name_idx', 'accounts_user_first_name_idx')
+
+    @skipUnless(connection.vendor == 'postgresql', "Full text search needs PostgreSQL")
+    def test_search(self):
+        users = User.objects.filter(is_active=True).values(*USER_FIELD_COLUMNS)
+        self.assertUsesIndex(postgres_search.search(users, ['lopez', 'rob'])[:UserCursorPagination.page_size + 1],
+                             'accounts_user_search_idx')
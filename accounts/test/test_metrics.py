@@ -0,0 +1,87 @@
+import json
+import tempfile
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from accounts.models import User
+from core.metrics import Registry, registry
+
+
+@override_settings(METRICS_TOKEN='scraper-token')
+class TestMetricsEndpoint(TestCase):
+    """Test the requests, logins and hashing are recorded and served at /metrics"""
+
+    def setUp(self):
+        registry.reset()
+        self.test_user = User.objects.create(email='robert@gmail.com',
+                                             first_name='Robert',
+                                             last_name='López Pérez',
+                                             country='España',
+                                             city='Barcelona',
+                                             address='Barcelona España',
+                                             mobile_phone='+34 10101023',
+                                             password='PasswordStrong1234')
+
+    def test_request_latency_and_queries_by_view(self):
+        client = APIClient()
+        refresh = RefreshToken.for_user(self.test_user)
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+        client.get(f'/api/v1/accounts/users/{self.test_user.id}')
+        response = self.get_metrics()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        content = response.content.decode()
+        labels = 'view="accounts.views.RetrieveUpdateDestroyUser",method="GET"'
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 1', content)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1', content)
+        self.assertIn(f'http_request_queries_bucket{{{labels},le="1"}} 1', content)
+        self.assertIn('# TYPE http_request_query_seconds_total counter', content)
+
+    def test_logins_are_counted(self):
+        client = APIClient()
+        client.post('/api/v1/accounts/users/login', data={'email': 'robert@gmail.com',
+                                                          'password': 'PasswordStrong1234'})
+        client.post('/api/v1/accounts/users/login', data={'email': 'robert@gmail.com', 'password': 'wrong'})
+        content = self.get_metrics().content.decode()
+        self.assertIn('accounts_logins_total 1\n', content)
+        self.assertIn('accounts_failed_logins_total 1\n', content)
+        self.assertIn('accounts_tokens_issued_total 1\n', content)
+        # The password hashed in setUp and the two verifications
+        self.assertIn('accounts_password_hashing_seconds_count 3\n', content)
+        self.assertIn('accounts_history_write_seconds_count{writer="request"}', content)
+
+    def get_metrics(self):
+        return self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper-token')
+
+    def test_token_is_required_when_configured(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer other-token').status_code, 403)
+        self.assertEqual(self.get_metrics().status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_without_token_are_only_public_when_allowed(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with self.settings(METRICS_PUBLIC=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class TestMultiprocessRegistry(TestCase):
+    """Test the samples written by every process are merged"""
+
+    def test_samples_of_other_processes_are_merged(self):
+        with tempfile.TemporaryDirectory() as directory:
+            process_registry = Registry(multiprocess_dir=directory)
+            counter = process_registry.counter('logins', 'Logins')
+            histogram = process_registry.histogram('latency', 'Latency', labels=('view', ), buckets=(0.1, 1.0))
+            counter.inc()
+            histogram.observe(0.05, view='users')
+            other_process = {'logins': [[[], 2]], 'latency': [[['users'], [0, 1, 0, 0.5]]]}
+            process_registry.process_file(pid=1).write_text(json.dumps(other_process))
+            content = process_registry.render()
+        self.assertIn('logins_total 3\n', content)
+        self.assertIn('latency_bucket{view="users",le="0.1"} 1\n', content)
+        self.assertIn('latency_bucket{view="users",le="1.0"} 2\n', content)
+        self.assertIn('latency_count{view="users"} 2\n', content)
+        self.assertIn('latency_sum{view="users"} 0.55\n', content)
@@ -176,6 +176,44 @@ class TestUser(TestCase):
                                            mobile_phone='+53 00000000',
                                            password='password123')
 
+    def test_email_is_stored_lowercase(self):
+        new_user = User.objects.create_user(email='Miguel.Perez@Gmail.COM',
+                                            first_name='Miguel',
+                                            last_name='Perez',
+                                            country='Cuba',
+                                            city='La Habana',
+                                            address='Habana Cuba',
+                                            mobile_phone='+53 51234567',
+                                            password='password123')
+        self.assertEqual(new_user.email, 'miguel.perez@gmail.com')
+        self.test_user.email = 'Robert.Lopez@Gmail.com'
+        self.test_user.save()
+        self.assertEqual(User.objects.get(pk=self.test_user.pk).email, 'robert.lopez@gmail.com')
+
+    def test_search_text_follows_the_searched_fields(self):
+        self.assertEqual(self.test_user.search_text, 'robert lopez la habana habana cuba')
+        self.test_user.city = 'Santiago de Cuba'
+        self.test_user.save(update_fields=['city'])
+        self.assertEqual(User.objects.get(pk=self.test_user.pk).search_text,
+                         'robert lopez santiago de cuba habana cuba')
+
+    def test_email_lookups_ignore_the_case(self):
+        self.assertEqual(User.objects.get(email='ROBERT@gmail.com'), self.test_user)
+        self.assertEqual(User.objects.get(email__iexact='Robert@Gmail.com'), self.test_user)
+        # iexact runs as an exact match, which uses the unique index
+        self.assertNotIn('UPPER', str(User.objects.filter(email__iexact='Robert@Gmail.com').query))
+
+    def test_validate_email_unique_constraint_ignores_the_case(self):
+        with self.assertRaises(IntegrityError):
+            User.objects.create(email='Robert@Gmail.com',
+                                first_name='Name',
+                                last_name='Last Name',
+                                country='Country',
+                                city='City',
+                                address='Address',
+                                mobile_phone='+53 00000000',
+                                password='password123')
+
     def test_validate_mobile_phone_unique_constraint(self):
         with self.assertRaises(IntegrityError):
             new_user = User.objects.create(email='email@gmail.com',
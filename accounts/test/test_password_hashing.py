@@ -0,0 +1,187 @@
+import threading
+from contextlib import contextmanager
+from unittest import mock
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.test import TestCase, override_settings
+from rest_framework.test import APITestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from accounts.models import User
+from accounts.hashing import get_hashing_executor, hashing_metrics
+from core.metrics import registry
+
+
+@contextmanager
+def count_hasher_calls():
+    """Count how many times the PBKDF2 hasher runs, check_password() verifications included"""
+    original_encode = PBKDF2PasswordHasher.encode
+    with mock.patch.object(PBKDF2PasswordHasher, 'encode', autospec=True, side_effect=original_encode) as encode:
+        yield encode
+
+
+class TestPasswordHashingPerEndpoint(APITestCase):
+    """Regression benchmark, each endpoint must run the password hasher only when a raw password is involved"""
+
+    def setUp(self):
+        self.test_user = User.objects.create(id=1,
+                                             email='robert@gmail.com',
+                                             first_name='Robert',
+                                             last_name='López Pérez',
+                                             country='España',
+                                             city='Barcelona',
+                                             address='Barcelona España',
+                                             mobile_phone='+34 10101023',
+                                             password='PasswordStrong1234')
+        self.test_admin_user = User.objects.create(id=2,
+                                                   email='rossi@gmail.com',
+                                                   first_name='Rossi',
+                                                   last_name='Valentina',
+                                                   country='Italia',
+                                                   city='Milan',
+                                                   address='Milan Italia',
+                                                   mobile_phone='+55 101017890',
+                                                   password='PasswordStrong1234',
+                                                   is_staff=True, )
+        self.client = APIClient()
+        refresh = RefreshToken.for_user(self.test_admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+
+    def test_signup_hashes_password_once(self):
+        data = {
+            "first_name": "John",
+            "last_name": "Doe",
+            "email": "johndoe@example.com",
+            "country": "USA",
+            "city": "New York",
+            "address": "123 Main St",
+            "mobile_phone": "+1 123456789",
+            "password": "StrongPassword123",
+        }
+        with count_hasher_calls() as encode:
+            response = APIClient().post('/api/v1/accounts/users/', data=data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(encode.call_count, 1)
+        self.assertTrue(User.objects.get(email='johndoe@example.com').check_password('StrongPassword123'))
+
+    def test_login_hashes_password_once(self):
+        data = {"email": "robert@gmail.com", "password": "PasswordStrong1234"}
+        with count_hasher_calls() as encode:
+            response = APIClient().post('/api/v1/accounts/users/login', data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(encode.call_count, 1)
+
+    def test_patch_without_password_does_not_hash(self):
+        with count_hasher_calls() as encode:
+            response = self.client.patch('/api/v1/accounts/users/1', data={"address": "Madrid España"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(encode.call_count, 0)
+        self.test_user.refresh_from_db()
+        self.assertTrue(self.test_user.check_password('PasswordStrong1234'))
+
+    def test_patch_with_password_hashes_once(self):
+        with count_hasher_calls() as encode:
+            response = self.client.patch('/api/v1/accounts/users/1', data={"password": "NewStrongPassword123"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(encode.call_count, 1)
+        self.test_user.refresh_from_db()
+        self.assertTrue(self.test_user.check_password('NewStrongPassword123'))
+
+    def test_soft_delete_does_not_hash(self):
+        with count_hasher_calls() as encode:
+            response = self.client.delete('/api/v1/accounts/users/1')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(encode.call_count, 0)
+        self.test_user.refresh_from_db()
+        self.assertTrue(self.test_user.check_password('PasswordStrong1234'))
+
+    def test_create_user_manager_hashes_password_once(self):
+        with count_hasher_calls() as encode:
+            user = User.objects.create_user(email='migue@gmail.com',
+                                            first_name='Miguel',
+                                            last_name='Perez',
+                                            country='Cuba',
+                                            city='La Habana',
+                                            address='Habana Cuba',
+                                            mobile_phone='+53 51234567',
+                                            password='password123')
+        self.assertEqual(encode.call_count, 1)
+        self.assertTrue(user.check_password('password123'))
+
+
+class TestHashingExecutors(TestCase):
+    """Test every hashing executor hashes, verifies and records metrics"""
+
+    executors = (
+        'accounts.hashing.InlineHashingExecutor',
+        'accounts.hashing.ThreadPoolHashingExecutor',
+        'accounts.hashing.ProcessPoolHashingExecutor',
+    )
+
+    def test_executors_make_and_check_passwords(self):
+        for executor in self.executors:
+            with self.subTest(executor=executor), override_settings(PASSWORD_HASHING_EXECUTOR=executor,
+                                                                    PASSWORD_HASHING_WORKERS=2):
+                hashes = get_hashing_executor().make_passwords(['password1', 'password2', 'password3'])
+                self.assertEqual(len(hashes), 3)
+                self.assertTrue(get_hashing_executor().check_password('password2', hashes[1]))
+                self.assertFalse(get_hashing_executor().check_password('password1', hashes[1]))
+
+    def test_metrics_record_calls_and_empty_queue(self):
+        hashing_metrics.reset()
+        encoded = get_hashing_executor().make_password('password1')
+        get_hashing_executor().check_password('password1', encoded)
+        metrics = hashing_metrics.snapshot()
+        self.assertEqual(metrics['calls'], 2)
+        self.assertEqual(metrics['in_flight'], 0)
+        self.assertEqual(metrics['queued'], 0)
+        self.assertGreater(metrics['total_seconds'], 0)
+
+    @override_settings(PASSWORD_HASHING_EXECUTOR='accounts.hashing.ThreadPoolHashingExecutor',
+                       PASSWORD_HASHING_WORKERS=1)
+    def test_queued_hashes_wait_for_a_free_worker(self):
+        hashing_metrics.reset()
+        running, release = threading.Event(), threading.Event()
+
+        def blocking_hash(raw_password):
+            running.set()
+            release.wait(5)
+            return raw_password
+
+        executor = get_hashing_executor()
+        futures = [executor.submit(blocking_hash, 'password1'), executor.submit(blocking_hash, 'password2')]
+        running.wait(5)
+        self.assertEqual(hashing_metrics.snapshot()['queued'], 1)
+        self.assertIn('accounts_password_hashing_queued 1\n', registry.render())
+        release.set()
+        self.assertEqual([future.result() for future in futures], ['password1', 'password2'])
+        self.assertEqual(hashing_metrics.snapshot()['queued'], 0)
+
+    @override_settings(PASSWORD_HASHING_EXECUTOR='accounts.hashing.ProcessPoolHashingExecutor',
+                       PASSWORD_HASHING_WORKERS=2)
+    def test_worker_processes_take_hashes_off_the_queue(self):
+        hashing_metrics.reset()
+        get_hashing_executor().make_passwords(['password1', 'password2', 'password3'])
+        self.assertEqual(hashing_metrics.snapshot()['queued'], 0)
+
+    def test_unusable_password_is_not_hashed(self):
+        with count_hasher_calls() as encode:
+            self.assertFalse(get_hashing_executor().check_password('password1', '!unusable'))
+        self.assertEqual(encode.call_count, 0)
+
+    @override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher',
+                                         'django.contrib.auth.hashers.PBKDF2PasswordHasher'])
+    def test_check_password_upgrades_outdated_hash(self):
+        user = User.objects.create(email='robert@gmail.com',
+                                   first_name='Robert',
+                                   last_name='López Pérez',
+                                   country='España',
+                                   city='Barcelona',
+                                   address='Barcelona España',
+                                   mobile_phone='+34 10101023',
+                                   password='PasswordStrong1234')
+        self.assertTrue(user.password.startswith('md5$'))
+        with self.settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.PBKDF2PasswordHasher',
+                                             'django.contrib.auth.hashers.MD5PasswordHasher']):
+            self.assertTrue(user.check_password('PasswordStrong1234'))
+            user.refresh_from_db()
+            self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
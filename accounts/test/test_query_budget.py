@@ -0,0 +1,68 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from accounts.models import User
+from core.middleware import QueryBudgetExceeded, QueryCounter, query_shape
+
+
+class TestQueryBudgetMiddleware(TestCase):
+    """Test the queries of each request are counted and checked against the view budget"""
+
+    def setUp(self):
+        self.test_user = User.objects.create(email='robert@gmail.com',
+                                             first_name='Robert',
+                                             last_name='López Pérez',
+                                             country='España',
+                                             city='Barcelona',
+                                             address='Barcelona España',
+                                             mobile_phone='+34 10101023',
+                                             password='PasswordStrong1234')
+        self.client = APIClient()
+        refresh = RefreshToken.for_user(self.test_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+        self.url = f'/api/v1/accounts/users/{self.test_user.id}'
+
+    @override_settings(DEBUG=True)
+    def test_debug_sends_query_headers(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Query-Count'], '1')
+        self.assertIn('X-Query-Time', response)
+        self.assertEqual(response['X-Query-Duplicates'], '0')
+
+    def test_no_query_headers_without_debug(self):
+        response = self.client.get(self.url)
+        self.assertNotIn('X-Query-Count', response)
+
+    @override_settings(QUERY_BUDGETS={'accounts.views.RetrieveUpdateDestroyUser': 0})
+    def test_view_over_budget_fails(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'ran 1 queries, the budget is 0'):
+            self.client.get(self.url)
+
+    @override_settings(QUERY_BUDGETS={'accounts.views.RetrieveUpdateDestroyUser': 0}, QUERY_BUDGET_ENFORCE=False)
+    def test_view_over_budget_is_logged_when_not_enforced(self):
+        with self.assertLogs('core.middleware', level='WARNING'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+
+class TestQueryCounter(TestCase):
+    """Test repeated query shapes are reported as duplicates"""
+
+    def test_in_lists_have_the_same_shape(self):
+        self.assertEqual(query_shape('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+                         query_shape('SELECT * FROM t WHERE id IN (%s, %s)'))
+
+    def test_query_per_row_is_a_duplicate(self):
+        for number in range(3):
+            User.objects.create(email=f'user{number}@gmail.com', first_name='Robert', last_name='López',
+                                country='España', city='Barcelona', address='Barcelona España',
+                                mobile_phone=f'+34 1010102{number}', password='PasswordStrong1234')
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            for user_id in User.objects.values_list('id', flat=True):
+                User.objects.get(id=user_id)
+        self.assertEqual(counter.count, 4)
+        self.assertEqual(list(counter.duplicates(3).values()), [3])
+        self.assertEqual(counter.duplicates(4), {})
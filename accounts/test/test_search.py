@@ -0,0 +1,139 @@
+from unittest import mock
+from django.test import override_settings
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+from accounts.models import User
+from accounts.search import search_index, search_terms
+
+
+class TestSearchUsers(APITestCase):
+    """Test /api/v1/accounts/users/search endpoint, matches, ranking, pagination and the updates of the index"""
+
+    def setUp(self):
+        self.test_user = User.objects.create_superuser(email='robert@gmail.com',
+                                                       first_name='Robert',
+                                                       last_name='López Pérez',
+                                                       country='España',
+                                                       city='Barcelona',
+                                                       address='Barcelona España',
+                                                       mobile_phone='+34 10101023',
+                                                       password='PasswordStrong1234')
+        self.jose = self.create_user(1, first_name='José', last_name='Gómez Núñez', city='Sevilla',
+                                     address='Calle Gomera 12')
+        self.gomera = self.create_user(2, first_name='Ana', last_name='Gomera', city='Málaga',
+                                       address='Avenida Andalucía 3')
+        search_index.build()
+        self.client = APIClient()
+        refresh = RefreshToken.for_user(self.test_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+
+    def create_user(self, number, **fields):
+        return User.objects.create(email=f'user{number}@gmail.com', country='España',
+                                   mobile_phone=f'+34 2000000{number}', password='PasswordStrong1234', **fields)
+
+    def found_ids(self, query, **params):
+        response = self.client.get('/api/v1/accounts/users/search', {'q': query, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [user['id'] for user in response.data['results']]
+
+    def test_search_text_ignores_accents_and_case(self):
+        self.assertEqual(self.jose.search_text, 'jose gomez nunez sevilla calle gomera 12')
+        self.assertEqual(search_terms('JOSÉ gómez a'), ['jose', 'gomez'])
+
+    def test_search_matches_accented_names_without_accents(self):
+        self.assertEqual(self.found_ids('jose gomez'), [self.jose.id])
+        self.assertEqual(self.found_ids('José Gómez'), [self.jose.id])
+        self.assertEqual(self.found_ids('nunez'), [self.jose.id])
+        self.assertEqual(self.found_ids('malaga'), [self.gomera.id])
+
+    def test_search_matches_word_prefixes_and_every_word(self):
+        self.assertEqual(self.found_ids('barcel'), [self.test_user.id])
+        self.assertEqual(self.found_ids('sevilla ana'), [])
+        self.assertEqual(self.found_ids('ez'), [])
+
+    def test_search_returns_the_requested_fields_only(self):
+        response = self.client.get('/api/v1/accounts/users/search', {'q': 'gomez', 'fields': 'first_name,city'})
+        self.assertEqual(response.data['results'], [{'first_name': 'José', 'city': 'Sevilla'}])
+
+    def test_whole_words_rank_above_prefixes(self):
+        lope = self.create_user(3, first_name='Lope', last_name='De Vega', city='Madrid', address='Calle Huertas 2')
+        self.assertEqual(self.found_ids('lope'), [lope.id, self.test_user.id])
+        self.assertEqual(self.found_ids('gom'), [self.jose.id, self.gomera.id])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.jose.city = 'Córdoba'
+        self.jose.save()
+        self.assertEqual(self.found_ids('cordoba'), [self.jose.id])
+        self.assertEqual(self.found_ids('sevilla'), [])
+        self.gomera.is_active = False
+        self.gomera.save()
+        self.assertEqual(self.found_ids('gomera'), [self.jose.id])
+        self.jose.delete()
+        self.assertEqual(self.found_ids('gomera'), [])
+
+    def test_bulk_created_users_are_found(self):
+        response = self.client.post('/api/v1/accounts/users/bulk', [{
+            'first_name': 'María', 'last_name': 'Ibáñez', 'email': 'maria@gmail.com', 'country': 'España',
+            'city': 'Valencia', 'address': 'Valencia España', 'mobile_phone': '+34 30000001',
+            'password': 'PasswordStrong1234',
+        }], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.found_ids('maria ibanez'), [response.data[0]['user']['id']])
+
+    def test_results_are_paginated(self):
+        for number in range(3, 8):
+            self.create_user(number, first_name='Josefa', last_name='Gomera', city='Cádiz', address='Cádiz España')
+        response = self.client.get('/api/v1/accounts/users/search', {'q': 'gomera', 'page_size': 3})
+        ids = [user['id'] for user in response.data['results']]
+        self.assertIsNone(response.data['previous'])
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            self.assertEqual(response.status_code, 200)
+            ids += [user['id'] for user in response.data['results']]
+        # Equal ranks follow the primary key
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(self.client.get(response.data['previous']).status_code, 200)
+
+    @override_settings(USER_SEARCH_MAX_RESULTS=2)
+    def test_results_stop_at_the_limit(self):
+        self.create_user(3, first_name='Josefa', last_name='Gomera', city='Cádiz', address='Cádiz España')
+        response = self.client.get('/api/v1/accounts/users/search', {'q': 'gomera', 'page_size': 1})
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+        response = self.client.get('/api/v1/accounts/users/search', {'q': 'gomera', 'page_size': 1, 'page': 3})
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(USER_SEARCH_INDEX_BACKGROUND_BUILD=True)
+    @mock.patch('accounts.search.threading.Thread')
+    def test_expired_index_keeps_answering_while_built_in_the_background(self, thread):
+        search_index.build()
+        search_index.built_at -= 3600
+        # The authentication and the rows of the results, the table is not read again
+        with self.assertNumQueries(2):
+            self.assertEqual(self.found_ids('jose'), [self.jose.id])
+        thread.assert_called_once_with(target=search_index.run_build, name='search-index-build', daemon=True)
+        thread.return_value.start.assert_called_once_with()
+        # Later searches do not start another build while the first one may still run
+        self.found_ids('jose')
+        self.assertEqual(thread.call_count, 1)
+
+    def test_searches_that_waited_for_a_build_do_not_build_again(self):
+        with self.assertNumQueries(0):
+            search_index.build(if_needed=True)
+        search_index.reset()
+        with self.assertNumQueries(1):
+            search_index.build(if_needed=True)
+
+    def test_query_without_words_returns_400(self):
+        response = self.client.get('/api/v1/accounts/users/search', {'q': ' a '})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data), ['q'])
+
+    def test_search_access_non_admin_user_returns_403(self):
+        refresh = RefreshToken.for_user(self.jose)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+        response = self.client.get('/api/v1/accounts/users/search', {'q': 'gomez'})
+        self.assertEqual(response.status_code, 403)
@@ -1,7 +1,8 @@
 from django.test import TestCase
 from rest_framework import serializers
 from rest_framework.exceptions import AuthenticationFailed
-from api.serializers import UserSerializer, MyTokenObtainPairSerializer
+from api.serializers import (UserSerializer, MyTokenObtainPairSerializer, USER_FIELD_PLAN, USER_FIELD_COLUMNS,
+                             represent_rows, represent_instance)
 from accounts.models import User
 
 
@@ -94,6 +95,21 @@ class TestUserSerializer(TestCase):
         serializer = UserSerializer(data=user_data)
         self.assertFalse(serializer.is_valid())
 
+    def test_validation_error_non_unique_email_with_other_case(self):
+        user_data = {
+            "first_name": "Jane",
+            "last_name": "Smith",
+            "email": "Robert@Gmail.com",
+            "country": "Canada",
+            "city": "Toronto",
+            "address": "456 Maple Ave",
+            "mobile_phone": "+0 9876543210",
+            "password": "NewPassword456",
+        }
+        serializer = UserSerializer(data=user_data)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('email', serializer.errors)
+
     def test_validation_error_non_unique_mobile_phone(self):
         user_data = {
             "first_name": "Jane",
@@ -180,6 +196,34 @@ class TestUserSerializer(TestCase):
         self.assertFalse(user.is_staff)
 
 
+class TestUserFieldPlan(TestCase):
+    """Test the read only field plan gives the same representation as UserSerializer"""
+
+    def setUp(self):
+        self.test_user = User.objects.create(email='robert@gmail.com',
+                                             first_name='Robert',
+                                             last_name='López Pérez',
+                                             country='España',
+                                             city='Barcelona',
+                                             address='Barcelona España',
+                                             mobile_phone='+34 10101023',
+                                             password='PasswordStrong1234',
+                                             is_staff=True)
+
+    def test_field_plan_renames_is_staff_and_skips_password(self):
+        self.assertIn(('is_admin_user', 'is_staff'), USER_FIELD_PLAN)
+        self.assertNotIn('password', USER_FIELD_COLUMNS)
+
+    def test_represent_rows_equal_to_serializer_data(self):
+        rows = User.objects.values(*USER_FIELD_COLUMNS)
+        self.assertEqual(represent_rows(rows, USER_FIELD_PLAN),
+                         [dict(data) for data in UserSerializer(User.objects.all(), many=True).data])
+
+    def test_represent_instance_equal_to_serializer_data(self):
+        user = User.objects.only(*USER_FIELD_COLUMNS).get(id=self.test_user.id)
+        self.assertEqual(represent_instance(user, USER_FIELD_PLAN), dict(UserSerializer(self.test_user).data))
+
+
 class TestMyTokenObtainPairSerializer(TestCase):
     """Test MyTokenObtainPairSerializer to check if works properly"""
 
@@ -0,0 +1,98 @@
+import time
+from unittest import mock
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework.test import APITestCase
+from rest_framework.test import APIClient
+from accounts.models import User
+from accounts.test.test_password_hashing import count_hasher_calls
+from accounts.throttling import Counters, local_counters
+
+
+@override_settings(LOGIN_EMAIL_MAX_ATTEMPTS=3, LOGIN_IP_MAX_ATTEMPTS=5, LOGIN_LOCKOUT_EMAIL_THRESHOLD=2,
+                   LOGIN_LOCKOUT_IP_THRESHOLD=100, LOGIN_LOCKOUT_BASE=30)
+class TestLoginRateThrottle(APITestCase):
+    """Test login attempts over the limits or during a lockout are rejected before the password is checked"""
+
+    def setUp(self):
+        cache.clear()
+        local_counters.clear()
+        self.test_user = User.objects.create(email='robert@gmail.com',
+                                             first_name='Robert',
+                                             last_name='López Pérez',
+                                             country='España',
+                                             city='Barcelona',
+                                             address='Barcelona España',
+                                             mobile_phone='+34 10101023',
+                                             password='PasswordStrong1234')
+        self.client = APIClient()
+
+    def login(self, password='PasswordStrong1234', email='robert@gmail.com'):
+        return self.client.post('/api/v1/accounts/users/login', data={'email': email, 'password': password})
+
+    def test_email_over_the_limit_is_rejected_without_hashing(self):
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, 200)
+        with count_hasher_calls() as encode:
+            response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(encode.call_count, 0)
+        self.assertIn('Retry-After', response)
+        self.assertTrue(response.data['detail'].startswith('Demasiados intentos de inicio de sesión'))
+
+    def test_ip_over_the_limit_is_rejected(self):
+        for number in range(5):
+            self.assertEqual(self.login(email=f'user{number}@gmail.com').status_code, 401)
+        self.assertEqual(self.login().status_code, 429)
+        other_client = APIClient(REMOTE_ADDR='10.0.0.2')
+        response = other_client.post('/api/v1/accounts/users/login',
+                                     data={'email': 'robert@gmail.com', 'password': 'PasswordStrong1234'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_spoofed_forwarded_for_headers_share_one_ip_bucket(self):
+        for number in range(5):
+            response = self.client.post('/api/v1/accounts/users/login',
+                                        data={'email': f'user{number}@gmail.com', 'password': 'wrong'},
+                                        HTTP_X_FORWARDED_FOR=f'203.0.113.{number}')
+            self.assertEqual(response.status_code, 401)
+        response = self.client.post('/api/v1/accounts/users/login', data={'email': 'robert@gmail.com',
+                                                                          'password': 'PasswordStrong1234'},
+                                    HTTP_X_FORWARDED_FOR='203.0.113.99')
+        self.assertEqual(response.status_code, 429)
+
+    def test_failed_logins_lock_the_email_out(self):
+        self.assertEqual(self.login(password='wrong').status_code, 401)
+        self.assertEqual(self.login(password='wrong').status_code, 401)
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(int(response['Retry-After']), 30)
+
+    @override_settings(LOGIN_EMAIL_MAX_ATTEMPTS=10)
+    def test_lockout_doubles_with_every_failure(self):
+        now = time.time()
+        with mock.patch('accounts.throttling.time.time', return_value=now):
+            self.login(password='wrong')
+            self.login(password='wrong')
+        # The first lockout has ended, the next failure locks the email out twice as long
+        with mock.patch('accounts.throttling.time.time', return_value=now + 31):
+            self.assertEqual(self.login(password='wrong').status_code, 401)
+        with mock.patch('accounts.throttling.time.time', return_value=now + 32):
+            self.assertEqual(int(self.login()['Retry-After']), 59)
+
+    @override_settings(LOGIN_EMAIL_MAX_ATTEMPTS=10)
+    def test_successful_login_resets_the_failures(self):
+        self.assertEqual(self.login(password='wrong').status_code, 401)
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login(password='wrong').status_code, 401)
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_local_counters_are_used_when_the_cache_fails(self):
+        with mock.patch.object(Counters, 'cache', side_effect=ConnectionError), self.assertLogs('accounts.throttling'):
+            for _ in range(3):
+                self.assertEqual(self.login().status_code, 200)
+            self.assertEqual(self.login().status_code, 429)
+
+    @override_settings(LOGIN_THROTTLE_ENABLED=False)
+    def test_throttle_can_be_disabled(self):
+        for _ in range(4):
+            self.assertEqual(self.login().status_code, 200)
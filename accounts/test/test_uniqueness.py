@@ -0,0 +1,134 @@
+from unittest import mock
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from accounts.models import User
+from accounts.uniqueness import BloomFilter, unique_values
+from api.serializers import UserSerializer
+
+
+class TestUniquenessFilter(TestCase):
+    """Test the unique checks skip their queries for new values and taken values are still rejected"""
+
+    def setUp(self):
+        self.test_user = User.objects.create(email='robert@gmail.com',
+                                             first_name='Robert',
+                                             last_name='López Pérez',
+                                             country='España',
+                                             city='Barcelona',
+                                             address='Barcelona España',
+                                             mobile_phone='+34 10101023',
+                                             password='PasswordStrong1234')
+        unique_values.build()
+        self.data = {
+            "first_name": "John",
+            "last_name": "Doe",
+            "email": "johndoe@example.com",
+            "country": "USA",
+            "city": "New York",
+            "address": "123 Main St",
+            "mobile_phone": "+1 123456789",
+            "password": "StrongPassword123",
+        }
+
+    def tearDown(self):
+        # The values of this test are rolled back, the next tests start without filters
+        unique_values.reset()
+
+    def signup(self, **data):
+        return APIClient().post('/api/v1/accounts/users/', data={**self.data, **data})
+
+    def create_behind_the_filter(self, **fields):
+        # bulk_create() sends no post_save signal, like a row saved by another process
+        User.objects.bulk_create([User(first_name='Jane', last_name='Smith', country='Canada', city='Toronto',
+                                       address='456 Maple Ave', password='PasswordStrong1234', **fields)])
+
+    def test_bloom_filter_finds_every_added_value(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        for number in range(1000):
+            bloom_filter.add(f'user{number}@gmail.com')
+        self.assertTrue(all(f'user{number}@gmail.com' in bloom_filter for number in range(1000)))
+        false_positives = sum(f'other{number}@gmail.com' in bloom_filter for number in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_signup_of_new_values_skips_the_unique_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.signup()
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT')])
+        self.assertEqual(self.signup(mobile_phone='+1 987654321').status_code, 400)
+
+    def test_taken_values_are_rejected(self):
+        response = self.signup(email='robert@gmail.com')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', response.data)
+        response = self.signup(email='Robert@Gmail.com')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', response.data)
+        response = self.signup(mobile_phone='+34 10101023')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('mobile_phone', response.data)
+
+    def test_values_unknown_to_the_filter_are_rejected_by_the_unique_index(self):
+        self.create_behind_the_filter(email='janesmith@example.com', mobile_phone='+0 9876543210')
+        response = self.signup(email='janesmith@example.com')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data), ['email'])
+        self.assertEqual(User.objects.count(), 2)
+
+        serializer = UserSerializer(self.test_user, data={'mobile_phone': '+0 9876543210'}, partial=True)
+        self.assertTrue(serializer.is_valid())
+        with self.assertRaises(ValidationError) as error:
+            serializer.save()
+        self.assertEqual(list(error.exception.detail), ['mobile_phone'])
+        self.assertEqual(User.objects.get(pk=self.test_user.pk).mobile_phone, '+34 10101023')
+
+    def test_deleted_values_trigger_a_rebuild(self):
+        self.assertFalse(unique_values.needs_build())
+        self.test_user.delete()
+        self.assertTrue(unique_values.needs_build())
+
+    def test_profile_updates_do_not_count_against_the_capacity(self):
+        count = unique_values.count
+        self.test_user.city = 'Girona'
+        self.test_user.save()
+        self.assertEqual(unique_values.count, count)
+        self.test_user.email = 'robert.lopez@gmail.com'
+        self.test_user.save()
+        self.assertEqual(unique_values.count, count + 1)
+        self.assertTrue(unique_values.might_contain('email', 'robert.lopez@gmail.com'))
+
+    @override_settings(USER_UNIQUENESS_FILTER_AUTO_BUILD=True)
+    @mock.patch('accounts.uniqueness.threading.Thread')
+    def test_missing_filter_is_built_in_the_background(self, thread):
+        # Requests arriving before the first build query the database
+        with CaptureQueriesContext(connection) as queries:
+            response = self.signup()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SELECT')]), 2)
+        thread.assert_called_once_with(target=unique_values.run_build, name='uniqueness-filter-build', daemon=True)
+        thread.return_value.start.assert_called_once_with()
+        # Later requests do not start another build while the first one may still run
+        self.signup(email='other@example.com', mobile_phone='+1 555555555')
+        self.assertEqual(thread.call_count, 1)
+
+    @override_settings(USER_UNIQUENESS_FILTER_AUTO_BUILD=True)
+    @mock.patch('accounts.uniqueness.threading.Thread')
+    def test_stale_filter_keeps_answering_while_built_in_the_background(self, thread):
+        unique_values.build()
+        self.test_user.delete()
+        self.assertTrue(unique_values.needs_build())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.signup()
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT')])
+        thread.return_value.start.assert_called_once_with()
+
+    @override_settings(USER_UNIQUENESS_FILTER_ENABLED=False)
+    def test_disabled_filter_queries_the_database(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.signup()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SELECT')]), 2)
@@ -1,7 +1,8 @@
 from django.urls import reverse, resolve
 from accounts.models import User
 from django.test import TestCase
-from accounts.views import ListCreateUser, RetrieveUpdateDestroyUser, MyTokenObtainPairView
+from accounts.views import ListCreateUser, RetrieveUpdateDestroyUser, MyTokenObtainPairView, ExportUsers, \
+    BulkCreateUsers
 
 
 class TestUrls(TestCase):
@@ -27,3 +28,11 @@ class TestUrls(TestCase):
     def test_token_obtain_pair_url_resolve(self):
         url = reverse('token_obtain_pair')
         self.assertEquals(resolve(url).func.view_class, MyTokenObtainPairView)
+
+    def test_export_users_url_resolve(self):
+        url = reverse('export_users')
+        self.assertEquals(resolve(url).func.view_class, ExportUsers)
+
+    def test_bulk_create_users_url_resolve(self):
+        url = reverse('bulk_create_users')
+        self.assertEquals(resolve(url).func.view_class, BulkCreateUsers)
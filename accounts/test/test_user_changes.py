@@ -0,0 +1,143 @@
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from accounts.bulk import bulk_create_users
+from accounts.models import User, UserChange, UserChangeManager
+
+
+def create_user():
+    return User.objects.create(email='robert@gmail.com',
+                               first_name='Robert',
+                               last_name='López Pérez',
+                               country='España',
+                               city='Barcelona',
+                               address='Barcelona España',
+                               mobile_phone='+34 10101023',
+                               password='PasswordStrong1234')
+
+
+@override_settings(USER_HISTORY_FORMAT='diff', USER_HISTORY_SNAPSHOT_INTERVAL=3)
+class TestUserChange(TestCase):
+    """Test the compact history stores changed fields only and rebuilds every version"""
+
+    def setUp(self):
+        self.test_user = create_user()
+
+    def test_creation_stores_a_snapshot_and_no_historical_user(self):
+        change = self.test_user.changes.get()
+        self.assertEqual((change.version, change.snapshot_version, change.history_type), (1, 1, '+'))
+        self.assertEqual(change.changes['email'], 'robert@gmail.com')
+        self.assertEqual(self.test_user.history.count(), 0)
+
+    def test_update_stores_changed_fields_only(self):
+        user = User.objects.get(id=self.test_user.id)
+        user.city = 'Madrid'
+        user.save()
+        change = user.changes.get(version=2)
+        self.assertEqual(change.changes, {'city': 'Madrid'})
+        self.assertEqual(change.snapshot_version, 1)
+
+    def test_snapshot_every_interval(self):
+        for city in ['Madrid', 'Sevilla', 'Toledo']:
+            user = User.objects.get(id=self.test_user.id)
+            user.city = city
+            user.save()
+        change = self.test_user.changes.get(version=4)
+        self.assertEqual(change.snapshot_version, 4)
+        self.assertEqual(change.changes['email'], 'robert@gmail.com')
+
+    def test_concurrent_save_takes_the_next_version(self):
+        user = User.objects.get(id=self.test_user.id)
+        # Another request saved the user after this save looked up the last version
+        UserChange.objects.create(user=self.test_user, version=2, snapshot_version=1, history_type='~',
+                                  history_date=timezone.now(), changes={'city': 'Sevilla'})
+        original_filter = UserChangeManager.filter
+        lookups = []
+
+        def stale_first_lookup(manager, *args, **kwargs):
+            lookups.append(kwargs)
+            queryset = original_filter(manager, *args, **kwargs)
+            return queryset.filter(version__lt=2) if len(lookups) == 1 else queryset
+
+        user.city = 'Madrid'
+        with mock.patch.object(UserChangeManager, 'filter', autospec=True, side_effect=stale_first_lookup):
+            user.save()
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual(list(user.changes.filter(version__gt=1).order_by('version').values_list('version', 'changes')),
+                         [(2, {'city': 'Sevilla'}), (3, {'city': 'Madrid'})])
+
+    def test_rebuild_any_version(self):
+        for city in ['Madrid', 'Sevilla', 'Toledo', 'Cádiz']:
+            user = User.objects.get(id=self.test_user.id)
+            user.city = city
+            user.save()
+        self.assertEqual(UserChange.objects.rebuild(self.test_user.id, 1).city, 'Barcelona')
+        self.assertEqual(UserChange.objects.rebuild(self.test_user.id, 3).city, 'Sevilla')
+        rebuilt = UserChange.objects.rebuild(self.test_user.id, 5)
+        self.assertEqual(rebuilt.city, 'Cádiz')
+        self.assertEqual(rebuilt.email, 'robert@gmail.com')
+        self.assertEqual(rebuilt.date_joined, self.test_user.date_joined)
+
+    def test_bulk_creation_stores_a_snapshot(self):
+        admin = User.objects.create(email='rossi@gmail.com', first_name='Rossi', last_name='Valentina',
+                                    country='Italia', city='Milan', address='Milan Italia',
+                                    mobile_phone='+55 101017890', password='PasswordStrong1234')
+        results = bulk_create_users([{'first_name': 'John', 'last_name': 'Doe', 'email': 'johndoe@example.com',
+                                      'country': 'USA', 'city': 'New York', 'address': '123 Main St',
+                                      'mobile_phone': '+1 123456789', 'password': 'StrongPassword123'}],
+                                    history_user=admin)
+        user = User.objects.get(id=results[0]['user']['id'])
+        user.city = 'Boston'
+        user.save()
+        self.assertEqual(list(user.changes.order_by('version').values_list('version', 'snapshot_version',
+                                                                           'history_type', 'history_user')),
+                         [(1, 1, '+', admin.id), (2, 1, '~', None)])
+        self.assertEqual(user.changes.get(version=2).changes, {'city': 'Boston'})
+        self.assertEqual(user.history.count(), 0)
+
+
+class TestConvertUserHistory(TestCase):
+    """Test the convert_user_history command turns HistoricalUser rows into UserChange rows"""
+
+    @override_settings(USER_HISTORY_SNAPSHOT_INTERVAL=3)
+    def test_convert_and_delete_historical_rows(self):
+        test_user = create_user()
+        for city in ['Madrid', 'Sevilla', 'Toledo']:
+            user = User.objects.get(id=test_user.id)
+            user.city = city
+            user.save()
+        self.assertEqual(test_user.history.count(), 4)
+        call_command('convert_user_history', '--delete', stdout=StringIO())
+        self.assertEqual(test_user.history.count(), 0)
+        self.assertEqual(list(test_user.changes.order_by('version').values_list('snapshot_version', flat=True)),
+                         [1, 1, 1, 4])
+        self.assertEqual(test_user.changes.get(version=2).changes, {'city': 'Madrid'})
+        self.assertEqual(UserChange.objects.rebuild(test_user.id, 3).city, 'Sevilla')
+
+        call_command('convert_user_history', stdout=StringIO())
+        self.assertEqual(test_user.changes.count(), 4)
+
+    @override_settings(USER_HISTORY_SNAPSHOT_INTERVAL=3)
+    def test_older_historical_rows_are_merged_below_existing_changes(self):
+        test_user = create_user()
+        user = User.objects.get(id=test_user.id)
+        user.city = 'Madrid'
+        user.save()
+        with override_settings(USER_HISTORY_FORMAT='diff'):
+            user = User.objects.get(id=test_user.id)
+            user.city = 'Sevilla'
+            user.save()
+            user = User.objects.get(id=test_user.id)
+            user.city = 'Toledo'
+            user.save()
+        self.assertEqual(test_user.history.count(), 2)
+        call_command('convert_user_history', '--delete', stdout=StringIO())
+        self.assertEqual(test_user.history.count(), 0)
+        self.assertEqual(list(test_user.changes.order_by('version').values_list('version', 'snapshot_version',
+                                                                                'history_type')),
+                         [(1, 1, '+'), (2, 1, '~'), (3, 3, '~'), (4, 3, '~')])
+        self.assertEqual(UserChange.objects.rebuild(test_user.id, 1).city, 'Barcelona')
+        self.assertEqual(UserChange.objects.rebuild(test_user.id, 2).city, 'Madrid')
+        self.assertEqual(UserChange.objects.rebuild(test_user.id, 4).city, 'Toledo')
@@ -0,0 +1,188 @@
+# Module to rate limit the login attempts before the password is checked
+import hashlib
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCounters:
+    """In process counters with expiry, used when the shared cache is not reachable"""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                return None
+            return entry[0]
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self.prune()
+            self._entries[key] = (value, time.monotonic() + timeout)
+
+    def incr(self, key, timeout):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if len(self._entries) >= self.max_size:
+                    self.prune()
+                entry = (0, time.monotonic() + timeout)
+            self._entries[key] = (entry[0] + 1, entry[1])
+            return entry[0] + 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def prune(self):
+        now = time.monotonic()
+        for key in [key for key, (_, expires_at) in self._entries.items() if expires_at < now]:
+            del self._entries[key]
+        # Still full, drop the oldest half
+        if len(self._entries) >= self.max_size:
+            for key in list(self._entries)[:self.max_size // 2]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_counters = LocalCounters()
+
+
+class Counters:
+    """Counters in the LOGIN_THROTTLE_CACHE_ALIAS cache, falling back to the local counters when it fails"""
+
+    def cache(self):
+        return caches[settings.LOGIN_THROTTLE_CACHE_ALIAS]
+
+    def get_many(self, keys):
+        try:
+            return self.cache().get_many(keys)
+        except Exception:
+            logger.warning("Login throttle cache unavailable, using the local counters", exc_info=True)
+            values = {key: local_counters.get(key) for key in keys}
+            return {key: value for key, value in values.items() if value is not None}
+
+    def set(self, key, value, timeout):
+        try:
+            self.cache().set(key, value, timeout)
+        except Exception:
+            logger.warning("Login throttle cache unavailable, using the local counters", exc_info=True)
+            local_counters.set(key, value, timeout)
+
+    def incr(self, key, timeout):
+        try:
+            cache = self.cache()
+            if cache.add(key, 1, timeout):
+                return 1
+            try:
+                return cache.incr(key)
+            except ValueError:
+                # Expired between add() and incr()
+                cache.set(key, 1, timeout)
+                return 1
+        except Exception:
+            logger.warning("Login throttle cache unavailable, using the local counters", exc_info=True)
+            return local_counters.incr(key, timeout)
+
+    def delete(self, key):
+        try:
+            self.cache().delete(key)
+        except Exception:
+            logger.warning("Login throttle cache unavailable, using the local counters", exc_info=True)
+        local_counters.delete(key)
+
+
+counters = Counters()
+
+
+def throttle_key(kind, scope, value):
+    digest = hashlib.sha256(value.encode()).hexdigest()[:32]
+    return f'login-throttle:{kind}:{scope}:{digest}'
+
+
+def login_email(request):
+    email = request.data.get('email') if hasattr(request.data, 'get') else None
+    return email.strip().lower() if isinstance(email, str) else ''
+
+
+class LoginThrottled(Throttled):
+    default_detail = 'Demasiados intentos de inicio de sesión, inténtelo más tarde.'
+    extra_detail_singular = 'Podrá intentarlo de nuevo en {wait} segundo.'
+    extra_detail_plural = 'Podrá intentarlo de nuevo en {wait} segundos.'
+
+
+class LoginRateThrottle(BaseThrottle):
+    """Sliding window limits of login attempts per client IP and per email, checked before the password hash.
+    The window count is the current fixed window plus the previous one weighted by the part of it still inside
+    the sliding window. Clients or emails locked out by record_failed_login() are rejected until the lock ends."""
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def scopes(self, request):
+        scopes = [('ip', self.get_ident(request) or '', settings.LOGIN_IP_MAX_ATTEMPTS)]
+        email = login_email(request)
+        if email:
+            scopes.append(('email', email, settings.LOGIN_EMAIL_MAX_ATTEMPTS))
+        return scopes
+
+    def allow_request(self, request, view):
+        if not settings.LOGIN_THROTTLE_ENABLED:
+            return True
+        window = settings.LOGIN_THROTTLE_WINDOW
+        now = time.time()
+        current, elapsed = divmod(now, window)
+        scopes = self.scopes(request)
+        lock_keys = [throttle_key('lock', scope, value) for scope, value, _ in scopes]
+        previous_keys = [throttle_key(f'window{int(current) - 1}', scope, value) for scope, value, _ in scopes]
+        stored = counters.get_many(lock_keys + previous_keys)
+
+        locked_until = max((stored.get(key, 0) for key in lock_keys), default=0)
+        if locked_until > now:
+            self.wait_seconds = locked_until - now
+            return False
+
+        for (scope, value, max_attempts), previous_key in zip(scopes, previous_keys):
+            count = counters.incr(throttle_key(f'window{int(current)}', scope, value), window * 2)
+            estimated = count + stored.get(previous_key, 0) * (window - elapsed) / window
+            if estimated > max_attempts:
+                self.wait_seconds = window - elapsed
+                return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+
+def record_failed_login(request):
+    """Count a failed login of the client and the email, past the threshold they are locked out for a time that
+    doubles with every further failure"""
+    throttle = LoginRateThrottle()
+    thresholds = {'ip': settings.LOGIN_LOCKOUT_IP_THRESHOLD, 'email': settings.LOGIN_LOCKOUT_EMAIL_THRESHOLD}
+    for scope, value, _ in throttle.scopes(request):
+        failures = counters.incr(throttle_key('failures', scope, value), settings.LOGIN_LOCKOUT_WINDOW)
+        if failures >= thresholds[scope]:
+            duration = min(settings.LOGIN_LOCKOUT_BASE * 2 ** min(failures - thresholds[scope], 32),
+                           settings.LOGIN_LOCKOUT_MAX)
+            counters.set(throttle_key('lock', scope, value), time.time() + duration, duration)
+
+
+def record_successful_login(request):
+    email = login_email(request)
+    if email:
+        counters.delete(throttle_key('failures', 'email', email))
@@ -0,0 +1,182 @@
+# Module to answer the unique checks of emails and mobile phones without querying for values never seen
+import hashlib
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+from rest_framework.validators import UniqueValidator
+from core.metrics import uniqueness_checks
+from core.middleware import uncounted_queries
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Probabilistic set of strings, values added are always found and about error_rate of the values never added
+    are found too while it holds at most capacity values. Values can not be removed."""
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, value):
+        # Double hashing, the hash_count positions come from the two halves of a single digest
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self.size for index in range(self.hash_count)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(value))
+
+
+class UniqueValuesFilter:
+    """Bloom filters of the values in use in unique columns of the users table. A background thread builds them
+    from the table on first use and again after USER_UNIQUENESS_FILTER_TTL seconds, when they hold more values than
+    their capacity or when a tenth of their values were deleted. The unique checks query the database until the
+    first build ends and use the current filters during the next ones. Values saved by other processes are only
+    known after a rebuild, the unique indexes reject them meanwhile."""
+    # Seconds between the background builds started by the unique checks, a failing build is not retried on
+    # every request
+    build_interval = 60
+
+    def __init__(self, fields):
+        self.fields = fields
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._filters = None
+        self._pending = None
+        self.capacity = 0
+        self.count = 0
+        self.removed = 0
+        self.built_at = 0
+        self.build_started_at = None
+
+    @staticmethod
+    def prepare(field, value):
+        # The value as stored, emails are lowercased
+        return str(User._meta.get_field(field).get_prep_value(value))
+
+    def needs_build(self):
+        return (self._filters is None or time.monotonic() - self.built_at > settings.USER_UNIQUENESS_FILTER_TTL
+                or self.count > self.capacity or self.removed * 10 > self.count)
+
+    def build(self, blocking=True):
+        """Fill new filters from the table and swap them in, the current ones keep answering meanwhile"""
+        if not self._build_lock.acquire(blocking=blocking):
+            return
+        try:
+            with self._lock:
+                self._pending = []
+            # Filling the filters is not part of the request that happens to trigger it
+            with uncounted_queries():
+                capacity = max(settings.USER_UNIQUENESS_FILTER_CAPACITY, User.objects.count() * 2)
+                filters = {field: BloomFilter(capacity, settings.USER_UNIQUENESS_FILTER_ERROR_RATE)
+                           for field in self.fields}
+                count = 0
+                for values in User.objects.values_list(*self.fields).iterator(chunk_size=10000):
+                    for field, value in zip(self.fields, values):
+                        filters[field].add(value)
+                    count += 1
+            with self._lock:
+                # Values saved while the table was read
+                for values in self._pending:
+                    for field, value in values.items():
+                        filters[field].add(value)
+                count += len(self._pending)
+                self._filters, self._pending = filters, None
+                self.capacity, self.count, self.removed = capacity, count, 0
+                self.built_at = time.monotonic()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            logger.exception("Could not build the uniqueness filter, the unique checks query the database")
+        finally:
+            self._build_lock.release()
+
+    def build_in_background(self):
+        """Start a thread building the filters, unless a build is running or one started recently"""
+        with self._lock:
+            now = time.monotonic()
+            if self.build_started_at is not None and now - self.build_started_at < self.build_interval:
+                return
+            self.build_started_at = now
+        threading.Thread(target=self.run_build, name='uniqueness-filter-build', daemon=True).start()
+
+    def run_build(self):
+        try:
+            self.build(blocking=False)
+        finally:
+            connections.close_all()
+
+    def might_contain(self, field, value):
+        """False when the value is certainly not in use, True when it may be and the database has to tell"""
+        if not settings.USER_UNIQUENESS_FILTER_ENABLED or field not in self.fields:
+            return True
+        if self.needs_build() and settings.USER_UNIQUENESS_FILTER_AUTO_BUILD:
+            self.build_in_background()
+        filters = self._filters
+        return filters is None or self.prepare(field, value) in filters[field]
+
+    def add(self, users):
+        with self._lock:
+            for user in users:
+                values = {field: self.prepare(field, getattr(user, field)) for field in self.fields}
+                if self._filters is not None:
+                    for field, value in values.items():
+                        self._filters[field].add(value)
+                if self._pending is not None:
+                    self._pending.append(values)
+                self.count += 1
+
+    def remove(self, users):
+        # Deleted values stay in the filters, they only cost a query until the next build
+        with self._lock:
+            self.removed += len(users)
+
+    def reset(self):
+        with self._lock:
+            self._filters = None
+            self.capacity = self.count = self.removed = 0
+            self.build_started_at = None
+
+
+unique_values = UniqueValuesFilter(('email', 'mobile_phone'))
+
+
+@receiver(setting_changed)
+def reset_unique_values(*, setting, **kwargs):
+    if setting.startswith('USER_UNIQUENESS_FILTER_'):
+        unique_values.reset()
+
+
+class FilteredUniqueValidator(UniqueValidator):
+    """UniqueValidator skipping the query for values the uniqueness filter has never seen. The skipped fields are
+    recorded in the unchecked_unique_fields set of the serializer, which must rely on the unique indexes when it
+    saves, serializers without that set always query."""
+
+    @classmethod
+    def from_validator(cls, validator):
+        return cls(queryset=validator.queryset, message=validator.message, lookup=validator.lookup)
+
+    def __call__(self, value, serializer_field):
+        field_name = serializer_field.source_attrs[-1]
+        unchecked = getattr(serializer_field.parent, 'unchecked_unique_fields', None)
+        if unchecked is not None and not unique_values.might_contain(field_name, value):
+            uniqueness_checks.inc(field=field_name, result='skipped')
+            unchecked.add(serializer_field.field_name)
+            return
+        uniqueness_checks.inc(field=field_name, result='queried')
+        self.check(value, serializer_field)
+
+    def check(self, value, serializer_field):
+        super().__call__(value, serializer_field)
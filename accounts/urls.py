@@ -1,8 +1,17 @@
 from django.urls import path
-from .views import ListCreateUser, RetrieveUpdateDestroyUser, MyTokenObtainPairView
+from .views import ListCreateUser, RetrieveUpdateDestroyUser, MyTokenObtainPairView, ExportUsers, \
+    BulkCreateUsers, SearchUsers
+from .async_views import AsyncListCreateUser, AsyncRetrieveUpdateDestroyUser, AsyncTokenObtainPairView
 
 urlpatterns = [
     path('users/', ListCreateUser.as_view(), name='list_create_users'),
     path('users/<int:id>', RetrieveUpdateDestroyUser.as_view(), name='retrieve_update_destroy_user'),
+    path('users/export', ExportUsers.as_view(), name='export_users'),
+    path('users/search', SearchUsers.as_view(), name='search_users'),
+    path('users/bulk', BulkCreateUsers.as_view(), name='bulk_create_users'),
     path('users/login', MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
+    # Async counterparts for ASGI deployments
+    path('async/users/', AsyncListCreateUser.as_view(), name='async_list_create_users'),
+    path('async/users/<int:id>', AsyncRetrieveUpdateDestroyUser.as_view(), name='async_retrieve_update_destroy_user'),
+    path('async/users/login', AsyncTokenObtainPairView.as_view(), name='async_token_obtain_pair'),
     ]
@@ -1,5 +1,10 @@
 
 # Module to build util functions or classes
+import datetime
+import re
+import unicodedata
+from django.core.serializers.json import DjangoJSONEncoder
+
 
 def make_upper_camel_case_names(name):
     # split name in case that name have more than one word
@@ -12,3 +17,18 @@ def make_upper_camel_case_names(name):
             split_names_list.append(modified_name)
         return " ".join(split_names_list)
     return name[0].upper()+name[1:].lower()
+
+
+def make_search_text(*values):
+    # Lowercase words without accents, "José Gómez" and "jose gomez" give the same text
+    text = unicodedata.normalize('NFKD', ' '.join(values))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'\w+', text.casefold()))
+
+
+class ChangesJSONEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder drops the microseconds after the milliseconds, keep them so datetimes rebuild exactly
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
@@ -1,18 +1,44 @@
-from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
+import json
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.generics import GenericAPIView, ListCreateAPIView, RetrieveUpdateDestroyAPIView
+from rest_framework.views import APIView
+from rest_framework.parsers import JSONParser
 from rest_framework import permissions
 from rest_framework.response import Response
 from rest_framework import status
-from api.serializers import UserSerializer, MyTokenObtainPairSerializer
-from .models import User
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.filters import OrderingFilter
+from api.serializers import (UserSerializer, MyTokenObtainPairSerializer, USER_FIELD_PLAN, USER_FIELD_COLUMNS,
+                             plan_columns, represent_rows, represent_instance, select_field_plan)
+from .models import User, get_history_user
 from rest_framework_simplejwt.views import TokenObtainPairView
 from .permissions import IsAuthenticatedAndIsOwner
+from .pagination import UserCursorPagination, UserSearchPagination
+from .filters import UserFilterBackend
+from .search import get_search_engine, search_terms
+from .parsers import NDJSONParser
+from .bulk import bulk_create_users
+from .throttling import LoginRateThrottle, LoginThrottled, record_failed_login, record_successful_login
 
 
 # Create your views here.
 
-class ListCreateUser(ListCreateAPIView):
+class SparseFieldsMixin:
+    """?fields=id,email,city answers with those fields only and reads their columns only"""
+
+    def get_field_plan(self):
+        return select_field_plan(USER_FIELD_PLAN, self.request.query_params.get('fields'))
+
+
+class ListCreateUser(SparseFieldsMixin, ListCreateAPIView):
     queryset = User.objects.filter(is_active=True)
     serializer_class = UserSerializer
+    pagination_class = UserCursorPagination
+    filter_backends = [UserFilterBackend, OrderingFilter, ]
+    # Orderings with an index the cursor pages can follow
+    ordering_fields = ['id', 'date_joined', ]
+    ordering = ['id', ]
 
     def get_permissions(self):
         if self.request.method == 'GET':
@@ -23,8 +49,19 @@ class ListCreateUser(ListCreateAPIView):
             self.permission_classes = [permissions.IsAdminUser, ]
         return super().get_permissions()
 
+    def get_list_rows(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        # The cursor pagination reads the position from the ordering columns of the rows
+        ordering = [field.lstrip('-') for field in queryset.query.order_by]
+        return queryset.values(*plan_columns(self.get_field_plan(), *ordering))
 
-class RetrieveUpdateDestroyUser(RetrieveUpdateDestroyAPIView):
+    def list(self, request, *args, **kwargs):
+        # Read only fast path, fetch the serialized columns only and skip the serializer field tree
+        page = self.paginate_queryset(self.get_list_rows())
+        return self.get_paginated_response(represent_rows(page, self.get_field_plan()))
+
+
+class RetrieveUpdateDestroyUser(SparseFieldsMixin, RetrieveUpdateDestroyAPIView):
     queryset = User.objects.filter(is_active=True)
     serializer_class = UserSerializer
     lookup_field = 'id'
@@ -38,6 +75,32 @@ class RetrieveUpdateDestroyUser(RetrieveUpdateDestroyAPIView):
             self.permission_classes = [permissions.IsAdminUser, ]
         return super().get_permissions()
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == 'GET':
+            queryset = queryset.only(*plan_columns(self.get_field_plan()))
+        return queryset
+
+    def get_object(self):
+        if self.is_self_service():
+            # The owner's own record was already loaded by the authentication, reuse it instead of fetching it again
+            self.check_object_permissions(self.request, self.request.user)
+            return self.request.user
+        return super().get_object()
+
+    def is_self_service(self):
+        # Stateless token users only carry claims, their record still has to be fetched. The authenticated user may
+        # come from the cache and be stale, updates fetch the record so they never save old values back
+        user = self.request.user
+        return (self.request.method == 'GET'
+                and isinstance(user, User)
+                and user.is_active
+                and user.pk == self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return Response(represent_instance(instance, self.get_field_plan()))
+
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         instance.is_active = False
@@ -45,6 +108,75 @@ class RetrieveUpdateDestroyUser(RetrieveUpdateDestroyAPIView):
         return Response({'Response': 'Se eliminó al usuario de forma correcta'}, status=status.HTTP_204_NO_CONTENT)
 
 
+class ExportUsers(APIView):
+    """Stream every active user as NDJSON, one row at a time, worker memory stays flat"""
+    permission_classes = [permissions.IsAdminUser, ]
+
+    def get(self, request, *args, **kwargs):
+        keys = [key for key, _ in USER_FIELD_PLAN]
+        rows = (User.objects.filter(is_active=True)
+                .order_by('id')
+                .values_list(*USER_FIELD_COLUMNS)
+                .iterator(chunk_size=settings.USERS_EXPORT_CHUNK_SIZE))
+        lines = (json.dumps(dict(zip(keys, row)), ensure_ascii=False) + '\n' for row in rows)
+        response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="users.ndjson"'
+        return response
+
+
+class SearchUsers(SparseFieldsMixin, GenericAPIView):
+    """Active users with a word starting by each word of ?q= in their names, city or address, accents and case
+    ignored, best matches first"""
+    queryset = User.objects.filter(is_active=True)
+    permission_classes = [permissions.IsAdminUser, ]
+    pagination_class = UserSearchPagination
+
+    def get(self, request, *args, **kwargs):
+        terms = search_terms(request.query_params.get('q', ''))
+        if not terms:
+            raise ValidationError({'q': [f"Escribe al menos una palabra de {settings.USER_SEARCH_MIN_TERM_LENGTH} "
+                                         f"letras"]})
+        field_plan = self.get_field_plan()
+        # The ranked rows of the in process index are matched by their id
+        rows = get_search_engine().search(self.get_queryset().values(*plan_columns(field_plan, 'id')), terms)
+        page = self.paginate_queryset(rows)
+        return self.get_paginated_response(represent_rows(page, field_plan))
+
+
+class BulkCreateUsers(APIView):
+    """Create a batch of users sent as a JSON array or as NDJSON, returns one result per item"""
+    permission_classes = [permissions.IsAdminUser, ]
+    parser_classes = [JSONParser, NDJSONParser, ]
+
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'Response': 'Se esperaba una lista de usuarios'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.USERS_BULK_CREATE_MAX_ITEMS:
+            return Response({'Response': f'No se pueden crear más de {settings.USERS_BULK_CREATE_MAX_ITEMS} '
+                                         f'usuarios por petición'}, status=status.HTTP_400_BAD_REQUEST)
+        # Stateless token users are not User instances, the history only needs the primary key
+        results = bulk_create_users(items, history_user=get_history_user(request=request))
+        if all(result['status'] == status.HTTP_201_CREATED for result in results):
+            return Response(results, status=status.HTTP_201_CREATED)
+        if not any(result['status'] == status.HTTP_201_CREATED for result in results):
+            return Response(results, status=status.HTTP_400_BAD_REQUEST)
+        return Response(results, status=status.HTTP_207_MULTI_STATUS)
+
+
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
     permission_classes = [permissions.AllowAny, ]
+    throttle_classes = [LoginRateThrottle, ]
+
+    def post(self, request, *args, **kwargs):
+        try:
+            response = super().post(request, *args, **kwargs)
+        except AuthenticationFailed:
+            record_failed_login(request)
+            raise
+        record_successful_login(request)
+        return response
+
+    def throttled(self, request, wait):
+        raise LoginThrottled(wait)
@@ -1,7 +1,20 @@
+import time
+from contextlib import contextmanager, nullcontext
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from django.contrib.auth.models import update_last_login
 from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ImproperlyConfigured
 from accounts.models import User
+from accounts.uniqueness import FilteredUniqueValidator
+from accounts.validators import validate_mobile_phone
+from core.metrics import logins, tokens_issued
+from core.middleware import uncounted_failure, uncounted_queries
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -20,28 +33,189 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ("id",)
         extra_kwargs = {'password': {'write_only': True}}
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Fields whose unique check was answered by the uniqueness filter without a query
+        self.unchecked_unique_fields = set()
+
+    def build_standard_field(self, field_name, model_field):
+        field_class, field_kwargs = super().build_standard_field(field_name, model_field)
+        if 'validators' in field_kwargs:
+            field_kwargs['validators'] = [
+                FilteredUniqueValidator.from_validator(validator) if type(validator) is UniqueValidator else validator
+                for validator in field_kwargs['validators']]
+        return field_class, field_kwargs
+
     def validate_password(self, password):
         validate_password(password)
         return password
 
+    @contextmanager
+    def unique_backstop(self):
+        """Turn the unique index violations of the fields the filter did not check into their validation errors.
+        Inside a transaction the save gets a savepoint, so the table can still be queried after the violation. The
+        rejected save and the checks after it are left out of the query budget of the request."""
+        savepoint = bool(self.unchecked_unique_fields) and transaction.get_connection().in_atomic_block
+        try:
+            with uncounted_failure(IntegrityError), transaction.atomic() if savepoint else nullcontext():
+                yield
+        except IntegrityError:
+            self.raise_unique_errors()
+            raise
+
+    def raise_unique_errors(self):
+        errors = {}
+        with uncounted_queries():
+            for field_name in self.unchecked_unique_fields:
+                field = self.fields[field_name]
+                for validator in field.validators:
+                    if isinstance(validator, FilteredUniqueValidator):
+                        try:
+                            validator.check(self.validated_data[field_name], field)
+                        except serializers.ValidationError as error:
+                            errors[field_name] = error.detail
+        if errors:
+            raise serializers.ValidationError(errors)
+
+    def create(self, validated_data):
+        password = validated_data.pop('password')
+        with self.unique_backstop():
+            return User.objects.create_user(password=password, **validated_data)
+
+    def update(self, instance, validated_data):
+        # Only hash when the client actually sends a new password
+        password = validated_data.pop('password', None)
+        if password is not None:
+            instance.set_password(password)
+        with self.unique_backstop():
+            return super().update(instance, validated_data)
+
+    async def acreate(self, validated_data):
+        password = validated_data.pop('password')
+        # The async views run in autocommit, the failed INSERT leaves the connection usable
+        try:
+            with uncounted_failure(IntegrityError):
+                return await User.objects.acreate_user(password=password, **validated_data)
+        except IntegrityError:
+            await sync_to_async(self.raise_unique_errors)()
+            raise
+
+    async def aupdate(self, instance, validated_data):
+        # update() of the async views, the serializer has no many to many fields to set
+        password = validated_data.pop('password', None)
+        if password is not None:
+            await instance.aset_password(password)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        try:
+            with uncounted_failure(IntegrityError):
+                await instance.asave()
+        except IntegrityError:
+            await sync_to_async(self.raise_unique_errors)()
+            raise
+        return instance
+
+
+class BulkUserSerializer(UserSerializer):
+    """Validate one item of a bulk creation, uniqueness is checked once for the whole batch"""
+
+    class Meta(UserSerializer.Meta):
+        extra_kwargs = {
+            **UserSerializer.Meta.extra_kwargs,
+            'email': {'validators': []},
+            'mobile_phone': {'validators': [validate_mobile_phone, ]},
+        }
+
+
+# Serializer fields whose representation is the model value itself, safe to read without to_representation()
+PLAIN_VALUE_FIELDS = (serializers.IntegerField, serializers.CharField, serializers.BooleanField, )
+
+
+def build_field_plan(serializer_class):
+    """Precompute (output key, model field) pairs of the readable fields of a model serializer"""
+    fields = serializer_class().fields
+    plan = []
+    for name, field in fields.items():
+        if field.write_only:
+            continue
+        if not isinstance(field, PLAIN_VALUE_FIELDS):
+            raise ImproperlyConfigured(f"{serializer_class.__name__}.{name} can not be read through a field plan")
+        plan.append((name, field.source))
+    return tuple(plan)
+
+
+def select_field_plan(field_plan, fields):
+    """Part of a field plan with the output keys of a comma separated ?fields= value, the whole plan without one"""
+    if not fields:
+        return field_plan
+    keys = [key for key, _ in field_plan]
+    requested = {name.strip() for name in fields.split(',') if name.strip()}
+    if not requested or requested - set(keys):
+        raise serializers.ValidationError({'fields': [f"Campo no permitido, los campos son: {', '.join(keys)}"]})
+    return tuple((key, column) for key, column in field_plan if key in requested)
+
+
+def plan_columns(field_plan, *columns):
+    """Model columns to read for a field plan, followed by the other columns given, each one once"""
+    return tuple(dict.fromkeys([*(column for _, column in field_plan), *columns]))
+
+
+def represent_rows(rows, field_plan):
+    """Map .values() rows to the serializer representation following a precomputed field plan"""
+    return [{key: row[column] for key, column in field_plan} for row in rows]
+
+
+def represent_instance(instance, field_plan):
+    """Map a model instance to the serializer representation following a precomputed field plan"""
+    return {key: getattr(instance, column) for key, column in field_plan}
+
+
+USER_FIELD_PLAN = build_field_plan(UserSerializer)
+USER_FIELD_COLUMNS = tuple(column for _, column in USER_FIELD_PLAN)
+
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     token_type = 'Bearer'
 
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # Claims read by StatelessJWTAuthentication, claims_at bounds how stale they can get
+        for claim in settings.USER_AUTH_TOKEN_CLAIMS:
+            token[claim] = getattr(user, claim)
+        if settings.USER_AUTH_TOKEN_CLAIMS:
+            token['claims_at'] = time.time()
+        tokens_issued.inc()
+        return token
+
     def validate(self, attrs):
         data = super().validate(attrs)
+        logins.inc()
+        return self.represent_login(self.user, data['access'], data['refresh'])
+
+    @classmethod
+    def login(cls, user):
+        """Issue the tokens of a user whose credentials were already checked"""
+        refresh = cls.get_token(user)
+        if jwt_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, user)
+        logins.inc()
+        return cls.represent_login(user, str(refresh.access_token), str(refresh))
+
+    @classmethod
+    def represent_login(cls, user, access_token, refresh_token):
         new_data_representation = {
-            'user': {'id': self.user.id,
-                     'first_name': self.user.first_name,
-                     'last_name': self.user.last_name,
-                     'email': self.user.email,
-                     'mobile_phone': self.user.mobile_phone,
-                     'country': self.user.country,
-                     'city': self.user.city,
-                     'address': self.user.address,
-                     'is_admin_user': self.user.is_staff},
-            'access_token': data['access'],
-            'refresh_token': data['refresh'],
-            'token_type': self.token_type
+            'user': {'id': user.id,
+                     'first_name': user.first_name,
+                     'last_name': user.last_name,
+                     'email': user.email,
+                     'mobile_phone': user.mobile_phone,
+                     'country': user.country,
+                     'city': user.city,
+                     'address': user.address,
+                     'is_admin_user': user.is_staff},
+            'access_token': access_token,
+            'refresh_token': refresh_token,
+            'token_type': cls.token_type
         }
         return new_data_representation
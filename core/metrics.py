@@ -0,0 +1,226 @@
+# Module to collect the service metrics and serve them in the Prometheus text format
+import bisect
+import hmac
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Metric:
+    """Samples are kept per tuple of label values, guarded by the lock of the registry"""
+    type = None
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.samples = {}
+        registry.register(self)
+
+    def label_values(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def refresh(self):
+        pass
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.registry.lock:
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+    def merge(self, samples, key, value):
+        samples[key] = samples.get(key, 0) + value
+
+    def lines(self, key, value):
+        yield self.name + '_total', key, value
+
+
+class Gauge(Metric):
+    """Current value, summed over the processes. A gauge with a function reads its value on every snapshot."""
+    type = 'gauge'
+    function = None
+
+    def set(self, value, **labels):
+        key = self.label_values(labels)
+        with self.registry.lock:
+            self.samples[key] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def refresh(self):
+        if self.function is not None:
+            self.set(self.function())
+
+    def merge(self, samples, key, value):
+        samples[key] = samples.get(key, 0) + value
+
+    def lines(self, key, value):
+        yield self.name, key, value
+
+
+class Histogram(Metric):
+    """Histogram sample: observations per bucket (the last one is +Inf) followed by the sum"""
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, documentation, labels)
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            sample = self.samples.get(key)
+            if sample is None:
+                sample = self.samples[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            sample[index] += 1
+            sample[-1] += value
+
+    def merge(self, samples, key, value):
+        sample = samples.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+        for index, count in enumerate(value):
+            sample[index] += count
+
+    def lines(self, key, value):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), value):
+            cumulative += count
+            yield self.name + '_bucket', key + (('+Inf' if bound == math.inf else repr(bound)),), cumulative
+        yield self.name + '_sum', key, value[-1]
+        yield self.name + '_count', key, cumulative
+
+
+class Registry:
+    """Metrics of the process. With a multiprocess_dir every process writes its samples to a file of its own at most
+    every write_interval seconds and the scrape merges the files, so any worker can answer it."""
+
+    def __init__(self, multiprocess_dir=None, write_interval=5.0):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.multiprocess_dir = multiprocess_dir
+        self.write_interval = write_interval
+        self._written_at = 0.0
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def counter(self, name, documentation, labels=()):
+        return Counter(self, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return Gauge(self, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return Histogram(self, name, documentation, labels, buckets)
+
+    def snapshot(self):
+        for metric in list(self.metrics.values()):
+            metric.refresh()
+        with self.lock:
+            return {name: [[list(key), list(value) if isinstance(value, list) else value]
+                           for key, value in metric.samples.items()]
+                    for name, metric in self.metrics.items()}
+
+    def reset(self):
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.samples.clear()
+
+    def process_file(self, pid=None):
+        return Path(self.multiprocess_dir) / f'metrics-{pid or os.getpid()}.json'
+
+    def write(self, force=False):
+        """Write the samples of this process to the multiprocess directory, cheap to call after every request"""
+        if not self.multiprocess_dir or (not force and time.monotonic() - self._written_at < self.write_interval):
+            return
+        self._written_at = time.monotonic()
+        path = self.process_file()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        temporary_path.write_text(json.dumps(self.snapshot()))
+        os.replace(temporary_path, path)
+
+    def collect(self):
+        """Samples of every process merged by metric name and label values"""
+        snapshots = []
+        if self.multiprocess_dir:
+            self.write(force=True)
+            for path in Path(self.multiprocess_dir).glob('metrics-*.json'):
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue
+        else:
+            snapshots.append(self.snapshot())
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, samples in snapshot.items():
+                if name in self.metrics:
+                    for key, value in samples:
+                        self.metrics[name].merge(merged[name], tuple(key), value)
+        return merged
+
+    def render(self):
+        output = []
+        for name, samples in self.collect().items():
+            metric = self.metrics[name]
+            exposed_name = name + '_total' if metric.type == 'counter' else name
+            output.append(f'# HELP {exposed_name} {metric.documentation}')
+            output.append(f'# TYPE {exposed_name} {metric.type}')
+            for key in sorted(samples):
+                for sample_name, label_values, value in metric.lines(key, samples[key]):
+                    labels = ','.join(f'{label}="{escape(label_value)}"' for label, label_value
+                                      in zip(metric.labels + ('le',), label_values))
+                    output.append(f'{sample_name}{{{labels}}} {value}' if labels else f'{sample_name} {value}')
+        return '\n'.join(output) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry(settings.METRICS_MULTIPROCESS_DIR, settings.METRICS_WRITE_INTERVAL)
+
+request_duration = registry.histogram('http_request_duration_seconds', 'Request latency by view',
+                                      labels=('view', 'method'))
+request_queries = registry.histogram('http_request_queries', 'Database queries per request by view',
+                                     labels=('view', 'method'), buckets=QUERY_COUNT_BUCKETS)
+request_query_duration = registry.counter('http_request_query_seconds', 'Database time of the requests by view',
+                                          labels=('view', ))
+logins = registry.counter('accounts_logins', 'Successful logins')
+failed_logins = registry.counter('accounts_failed_logins', 'Failed login attempts')
+tokens_issued = registry.counter('accounts_tokens_issued', 'Refresh and access token pairs issued')
+password_hashing_duration = registry.histogram('accounts_password_hashing_seconds',
+                                               'Password hashing and verification time, per call or batch')
+password_hashing_queued = registry.gauge('accounts_password_hashing_queued',
+                                         'Password hashes submitted to the hashing pool and not started yet')
+uniqueness_checks = registry.counter('accounts_uniqueness_checks',
+                                     'Unique checks of emails and mobile phones, queried or answered by the filter',
+                                     labels=('field', 'result'))
+history_write_duration = registry.histogram('accounts_history_write_seconds',
+                                            'Historical records write time, in the request or in batches',
+                                            labels=('writer', ))
+
+
+def metrics_view(request):
+    if settings.METRICS_TOKEN:
+        authorization = request.headers.get('Authorization', '').encode()
+        if not hmac.compare_digest(authorization, f'Bearer {settings.METRICS_TOKEN}'.encode()):
+            return HttpResponseForbidden()
+    elif not (settings.DEBUG or settings.METRICS_PUBLIC):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
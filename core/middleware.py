@@ -0,0 +1,213 @@
+# Module to count the SQL queries and database time of every request
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from .metrics import registry, request_duration, request_queries, request_query_duration
+
+logger = logging.getLogger(__name__)
+
+# Placeholder lists of IN clauses and VALUES rows change with the number of parameters, not with the query shape
+PLACEHOLDER_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_shape(sql):
+    return PLACEHOLDER_LIST.sub('(%s, ...)', sql)
+
+
+class QueryCounter:
+    """Database execute wrapper recording the SQL and the time of every query"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(duration for _, duration in self.queries)
+
+    def duplicates(self, threshold):
+        """Query shapes run at least threshold times, usually a query per row (N+1)"""
+        shapes = Counter(query_shape(sql) for sql, _ in self.queries)
+        return {shape: count for shape, count in shapes.items() if count >= threshold}
+
+
+# Counter of the request being served, context variables follow the request into sync_to_async() threads
+current_query_counter = ContextVar('current_query_counter', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    counter = current_query_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+@contextmanager
+def uncounted_queries():
+    """Leave the queries of a one-off job run by a request, like filling a cache, out of its count"""
+    token = current_query_counter.set(None)
+    try:
+        yield
+    finally:
+        current_query_counter.reset(token)
+
+
+@contextmanager
+def uncounted_failure(*exceptions):
+    """Leave the queries of a block out of the count of the request when it raises one of exceptions, like an
+    INSERT rejected by a unique index and the rollback of its savepoint"""
+    counter = current_query_counter.get()
+    mark = counter.count if counter is not None else 0
+    try:
+        yield
+    except exceptions:
+        if counter is not None:
+            del counter.queries[mark:]
+        raise
+
+
+def add_query_counter(connection):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def install_query_counter():
+    """Add count_query() to the connections of the calling thread, new connections get it when they connect"""
+    for connection in connections.all():
+        add_query_counter(connection)
+
+
+def add_query_counter_on_connect(sender, connection, **kwargs):
+    add_query_counter(connection)
+
+
+connection_created.connect(add_query_counter_on_connect)
+
+
+class SyncAndAsyncMiddleware:
+    """Middleware running in the mode of the handler, so async views are not pushed onto the sync thread"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process(request, await self.get_response(request))
+
+    def process(self, request, response):
+        return response
+
+
+class MetricsMiddleware(SyncAndAsyncMiddleware):
+    """Record the latency and the queries of the requests by view, it goes before QueryBudgetMiddleware which
+    counts the queries and resolves the view name"""
+
+    def __call__(self, request):
+        request.started_at = time.perf_counter()
+        return super().__call__(request)
+
+    def process(self, request, response):
+        started_at = request.started_at
+        view = getattr(request, 'query_budget_view', None)
+        if view is not None:
+            request_duration.observe(time.perf_counter() - started_at, view=view, method=request.method)
+            counter = getattr(request, 'query_counter', None)
+            if counter is not None:
+                request_queries.observe(counter.count, view=view, method=request.method)
+                request_query_duration.inc(counter.duration, view=view)
+        registry.write()
+        return response
+
+
+def view_name(view_func):
+    view = getattr(view_func, 'view_class', view_func)
+    return f'{view.__module__}.{view.__qualname__}'
+
+
+class QueryBudgetMiddleware(SyncAndAsyncMiddleware):
+    """Count the queries of each request on every database connection. Views over their QUERY_BUDGETS entry or
+    running the same query shape QUERY_DUPLICATE_THRESHOLD times are logged, with QUERY_BUDGET_ENFORCE on (the
+    test runner turns it on) they raise QueryBudgetExceeded. In DEBUG the numbers are sent as response headers.
+    Queries run while a streaming response is consumed are not counted."""
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        install_query_counter()
+        token = current_query_counter.set(QueryCounter())
+        try:
+            request.query_counter = current_query_counter.get()
+            response = self.get_response(request)
+        finally:
+            current_query_counter.reset(token)
+        return self.process(request, response)
+
+    async def __acall__(self, request):
+        # Connections are per thread, the ones of the async view queries live in the sync_to_async() thread
+        await sync_to_async(install_query_counter)()
+        token = current_query_counter.set(QueryCounter())
+        try:
+            request.query_counter = current_query_counter.get()
+            response = await self.get_response(request)
+        finally:
+            current_query_counter.reset(token)
+        return self.process(request, response)
+
+    def process(self, request, response):
+        counter = request.query_counter
+        self.check(request, counter)
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(counter.count)
+            response['X-Query-Time'] = f'{counter.duration * 1000:.2f}'
+            response['X-Query-Duplicates'] = str(sum(counter.duplicates(settings.QUERY_DUPLICATE_THRESHOLD)
+                                                     .values()))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget_view = view_name(view_func)
+
+    def check(self, request, counter):
+        view = getattr(request, 'query_budget_view', None)
+        problems = []
+        budget = settings.QUERY_BUDGETS.get(view)
+        if budget is not None and counter.count > budget:
+            problems.append(f'{request.method} {request.path} ({view}) ran {counter.count} queries, '
+                            f'the budget is {budget}')
+        for shape, count in counter.duplicates(settings.QUERY_DUPLICATE_THRESHOLD).items():
+            problems.append(f'{request.method} {request.path} ({view}) ran {count} times: {shape}')
+        if not problems:
+            return
+        if settings.QUERY_BUDGET_ENFORCE and view in settings.QUERY_BUDGETS:
+            raise QueryBudgetExceeded('\n'.join(problems))
+        for problem in problems:
+            logger.warning(problem)
@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'simple_history.middleware.HistoryRequestMiddleware',
@@ -62,6 +64,30 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'core.urls'
 
+# Queries allowed per request of a view, core.middleware.QueryBudgetMiddleware logs the requests going over them
+# and the query shapes repeated QUERY_DUPLICATE_THRESHOLD times (N+1). QUERY_BUDGET_ENFORCE raises instead of
+# logging, the test runner turns it on so a test of a budgeted view fails when the view gets more queries.
+QUERY_BUDGETS = {
+    'accounts.views.ListCreateUser': 4,
+    'accounts.views.RetrieveUpdateDestroyUser': 6,
+    'accounts.async_views.AsyncListCreateUser': 4,
+    'accounts.async_views.AsyncRetrieveUpdateDestroyUser': 6,
+    'accounts.views.SearchUsers': 3,
+}
+QUERY_DUPLICATE_THRESHOLD = int(os.environ.get("QUERY_DUPLICATE_THRESHOLD", default=5))
+QUERY_BUDGET_ENFORCE = int(os.environ.get("QUERY_BUDGET_ENFORCE", default=0))
+TEST_RUNNER = 'core.test_runner.QueryBudgetTestRunner'
+
+# Metrics served at /metrics in the Prometheus text format. Set METRICS_MULTIPROCESS_DIR when running several
+# worker processes (gunicorn, uwsgi), each one writes its samples there at most every METRICS_WRITE_INTERVAL
+# seconds and any of them answers the scrape with the merged samples. Empty the directory on deploys.
+# The scraper has to send METRICS_TOKEN as a Bearer token, without a token the metrics are only served with DEBUG on
+# or when METRICS_PUBLIC opts out of the token (e.g. the port is only reachable from the monitoring network).
+METRICS_MULTIPROCESS_DIR = os.environ.get("METRICS_MULTIPROCESS_DIR", default=None)
+METRICS_WRITE_INTERVAL = float(os.environ.get("METRICS_WRITE_INTERVAL", default=5.0))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", default="")
+METRICS_PUBLIC = int(os.environ.get("METRICS_PUBLIC", default=0))
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -135,12 +161,107 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'accounts.User'
 
+# NUM_PROXIES is the number of reverse proxies in front of the app. The throttles take the client IP from the
+# address the last of them appended to X-Forwarded-For, with 0 they use REMOTE_ADDR and ignore the header, which
+# clients can forge to get a new login throttle bucket on every attempt.
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'accounts.authentication.CachedJWTAuthentication',
+    ),
+    'NUM_PROXIES': int(os.environ.get("NUM_PROXIES", default=0)),
 }
 
+# Users resolved from access tokens are cached, use a shared CACHES backend (redis, memcached) when running
+# several worker processes so invalidations reach all of them. The local LRU saves the shared cache round trip,
+# other processes may see a stale user for at most USER_AUTH_LOCAL_CACHE_TTL seconds.
+USER_AUTH_CACHE_ALIAS = os.environ.get("USER_AUTH_CACHE_ALIAS", default="default")
+USER_AUTH_CACHE_TIMEOUT = int(os.environ.get("USER_AUTH_CACHE_TIMEOUT", default=300))
+USER_AUTH_LOCAL_CACHE_SIZE = int(os.environ.get("USER_AUTH_LOCAL_CACHE_SIZE", default=1024))
+USER_AUTH_LOCAL_CACHE_TTL = int(os.environ.get("USER_AUTH_LOCAL_CACHE_TTL", default=5))
+# Claims embedded in the tokens at login, accounts.authentication.StatelessJWTAuthentication builds the request
+# user from them with no database query. Claims older than USER_AUTH_CLAIMS_MAX_AGE seconds, or read before the
+# user changed (role, permissions, soft delete), fall back to a cached/database lookup.
+USER_AUTH_TOKEN_CLAIMS = ('email', 'is_staff', 'is_active', )
+USER_AUTH_CLAIMS_MAX_AGE = int(os.environ.get("USER_AUTH_CLAIMS_MAX_AGE", default=300))
+
+# Login attempts allowed per client IP and per email in a sliding window of LOGIN_THROTTLE_WINDOW seconds, counted
+# in a shared cache (in process counters when it is unreachable) before the password is checked. After
+# LOGIN_LOCKOUT_*_THRESHOLD failures in LOGIN_LOCKOUT_WINDOW seconds the IP or email is locked out for
+# LOGIN_LOCKOUT_BASE seconds, doubled on every further failure up to LOGIN_LOCKOUT_MAX.
+LOGIN_THROTTLE_ENABLED = int(os.environ.get("LOGIN_THROTTLE_ENABLED", default=1))
+LOGIN_THROTTLE_CACHE_ALIAS = os.environ.get("LOGIN_THROTTLE_CACHE_ALIAS", default="default")
+LOGIN_THROTTLE_WINDOW = int(os.environ.get("LOGIN_THROTTLE_WINDOW", default=60))
+LOGIN_IP_MAX_ATTEMPTS = int(os.environ.get("LOGIN_IP_MAX_ATTEMPTS", default=30))
+LOGIN_EMAIL_MAX_ATTEMPTS = int(os.environ.get("LOGIN_EMAIL_MAX_ATTEMPTS", default=10))
+LOGIN_LOCKOUT_WINDOW = int(os.environ.get("LOGIN_LOCKOUT_WINDOW", default=900))
+LOGIN_LOCKOUT_IP_THRESHOLD = int(os.environ.get("LOGIN_LOCKOUT_IP_THRESHOLD", default=20))
+LOGIN_LOCKOUT_EMAIL_THRESHOLD = int(os.environ.get("LOGIN_LOCKOUT_EMAIL_THRESHOLD", default=5))
+LOGIN_LOCKOUT_BASE = int(os.environ.get("LOGIN_LOCKOUT_BASE", default=30))
+LOGIN_LOCKOUT_MAX = int(os.environ.get("LOGIN_LOCKOUT_MAX", default=3600))
+
+# Users listing pagination, clients can ask for a different size with ?page_size=
+USERS_PAGE_SIZE = int(os.environ.get("USERS_PAGE_SIZE", default=50))
+USERS_MAX_PAGE_SIZE = int(os.environ.get("USERS_MAX_PAGE_SIZE", default=500))
+# Rows fetched per round trip by the server side cursor of the NDJSON users export
+USERS_EXPORT_CHUNK_SIZE = int(os.environ.get("USERS_EXPORT_CHUNK_SIZE", default=2000))
+# Users bulk creation, items accepted per request and rows per INSERT
+USERS_BULK_CREATE_MAX_ITEMS = int(os.environ.get("USERS_BULK_CREATE_MAX_ITEMS", default=5000))
+USERS_BULK_CREATE_BATCH_SIZE = int(os.environ.get("USERS_BULK_CREATE_BATCH_SIZE", default=1000))
+
+# Users admin changelist, searches and filters count at most ADMIN_USERS_COUNT_LIMIT rows (the whole table uses the
+# PostgreSQL planner estimate) and the options of the country filter are cached ADMIN_FILTER_CACHE_TIMEOUT seconds
+ADMIN_USERS_COUNT_LIMIT = int(os.environ.get("ADMIN_USERS_COUNT_LIMIT", default=10000))
+ADMIN_FILTER_CACHE_TIMEOUT = int(os.environ.get("ADMIN_FILTER_CACHE_TIMEOUT", default=600))
+
+# Users search at /users/search, every word of the query matches the start of a word of the names, city or address
+# with the accents and case ignored. PostgreSQL ranks the matches with its full text search, other databases (SQLite
+# test and development runs) with an in process index of the words built again every USER_SEARCH_INDEX_TTL seconds,
+# in a background thread unless USER_SEARCH_INDEX_BACKGROUND_BUILD is off. Words shorter than
+# USER_SEARCH_MIN_TERM_LENGTH are left out, at most USER_SEARCH_MAX_TERMS are matched and the pages stop at
+# USER_SEARCH_MAX_RESULTS results.
+USER_SEARCH_MIN_TERM_LENGTH = int(os.environ.get("USER_SEARCH_MIN_TERM_LENGTH", default=2))
+USER_SEARCH_MAX_TERMS = int(os.environ.get("USER_SEARCH_MAX_TERMS", default=8))
+USER_SEARCH_MAX_RESULTS = int(os.environ.get("USER_SEARCH_MAX_RESULTS", default=1000))
+USER_SEARCH_INDEX_TTL = int(os.environ.get("USER_SEARCH_INDEX_TTL", default=600))
+USER_SEARCH_INDEX_BACKGROUND_BUILD = int(os.environ.get("USER_SEARCH_INDEX_BACKGROUND_BUILD", default=1))
+
+# Password hashing executor, accounts.hashing provides InlineHashingExecutor, ThreadPoolHashingExecutor
+# (hashlib releases the GIL while running PBKDF2) and ProcessPoolHashingExecutor (hashers holding the GIL)
+PASSWORD_HASHING_EXECUTOR = os.environ.get("PASSWORD_HASHING_EXECUTOR",
+                                           default="accounts.hashing.ThreadPoolHashingExecutor")
+PASSWORD_HASHING_WORKERS = int(os.environ.get("PASSWORD_HASHING_WORKERS", default=os.cpu_count() or 1))
+
+# Historical records of the users are queued and written in batches by a background thread when
+# HISTORY_BUFFERED_WRITES is on, a batch waits at most HISTORY_FLUSH_INTERVAL seconds
+HISTORY_BUFFERED_WRITES = int(os.environ.get("HISTORY_BUFFERED_WRITES", default=0))
+HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", default=500))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", default=1.0))
+HISTORY_QUEUE_SIZE = int(os.environ.get("HISTORY_QUEUE_SIZE", default=10000))
+# 'full' keeps a HistoricalUser row with every column per change, 'diff' stores accounts.UserChange rows with the
+# changed fields only and a full snapshot every USER_HISTORY_SNAPSHOT_INTERVAL versions
+USER_HISTORY_FORMAT = os.environ.get("USER_HISTORY_FORMAT", default="full")
+USER_HISTORY_SNAPSHOT_INTERVAL = int(os.environ.get("USER_HISTORY_SNAPSHOT_INTERVAL", default=20))
+# Bloom filters of the emails and mobile phones in use, the unique checks of the signup and the profile updates
+# skip their query for values the filters have never seen. Every process builds its own filters from the table in
+# a background thread on first use and again every USER_UNIQUENESS_FILTER_TTL seconds, values saved by other
+# processes meanwhile are caught by the unique indexes and reported as the same validation error. With
+# USER_UNIQUENESS_FILTER_AUTO_BUILD off the filters are only built by calling unique_values.build().
+USER_UNIQUENESS_FILTER_ENABLED = int(os.environ.get("USER_UNIQUENESS_FILTER_ENABLED", default=1))
+USER_UNIQUENESS_FILTER_AUTO_BUILD = int(os.environ.get("USER_UNIQUENESS_FILTER_AUTO_BUILD", default=1))
+USER_UNIQUENESS_FILTER_CAPACITY = int(os.environ.get("USER_UNIQUENESS_FILTER_CAPACITY", default=1000000))
+USER_UNIQUENESS_FILTER_ERROR_RATE = float(os.environ.get("USER_UNIQUENESS_FILTER_ERROR_RATE", default=0.01))
+USER_UNIQUENESS_FILTER_TTL = int(os.environ.get("USER_UNIQUENESS_FILTER_TTL", default=3600))
+
+# HistoricalUser retention, run accounts.archive.archive_user_history periodically (python manage.py
+# archive_user_history) to move older rows to gzipped NDJSON files. On PostgreSQL the table can be split in
+# monthly partitions with python manage.py partition_user_history, old months are then dropped instead of deleted.
+# The default HISTORY_ARCHIVE_DIR is inside the project (and ignored by git), point it to a persistent volume.
+HISTORY_RETENTION_DAYS = int(os.environ.get("HISTORY_RETENTION_DAYS", default=365))
+HISTORY_ARCHIVE_DIR = os.environ.get("HISTORY_ARCHIVE_DIR", default=BASE_DIR / 'history_archive')
+HISTORY_ARCHIVE_CHUNK_SIZE = int(os.environ.get("HISTORY_ARCHIVE_CHUNK_SIZE", default=10000))
+HISTORY_DELETE_BATCH_SIZE = int(os.environ.get("HISTORY_DELETE_BATCH_SIZE", default=1000))
+HISTORY_PARTITION_MONTHS_AHEAD = int(os.environ.get("HISTORY_PARTITION_MONTHS_AHEAD", default=3))
+
 # JWT Token Configuration
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=5),
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """Test runner failing the requests of the views that go over their query budget. The uniqueness filter and
+    the search index are not built in the background, the connection of the build thread would not see the rows
+    of the test transaction. The unique checks query the database unless a test builds the filter."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.QUERY_BUDGET_ENFORCE = True
+        settings.USER_UNIQUENESS_FILTER_AUTO_BUILD = False
+        settings.USER_SEARCH_INDEX_BACKGROUND_BUILD = False